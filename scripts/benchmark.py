@@ -0,0 +1,434 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+from dataclasses import asdict, dataclass, field
+from datetime import UTC, datetime
+from time import perf_counter
+from uuid import UUID, uuid4
+
+import duckdb
+import httpx
+
+RESULTS_DB = "benchmarks.db"
+ENDPOINTS = {
+    "single": "parse_prediction",
+    "batch": "parse_prediction_batch",
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Throughput and latency of the API against a stubbed model."
+    )
+    parser.add_argument(
+        "--endpoints",
+        nargs="+",
+        choices=sorted(ENDPOINTS),
+        default=["single", "batch"],
+    )
+    parser.add_argument(
+        "--concurrency",
+        nargs="+",
+        type=int,
+        default=[1, 8, 32],
+        help="Concurrent clients; each value is benchmarked separately.",
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=200,
+        help="Requests sent per endpoint and concurrency level.",
+    )
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument(
+        "--base-url",
+        default=None,
+        help=(
+            "Benchmark a running server instead of the app in-process. "
+            "Start it with MODEL_BACKEND=replay or fake."
+        ),
+    )
+    parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=None,
+        help="In-process only: multiplier for the stub's sampled model latency.",
+    )
+    parser.add_argument(
+        "--keep-cache",
+        action="store_true",
+        help="In-process only: keep the response cache and request coalescing on.",
+    )
+    parser.add_argument("--label", default=None, help="Free-form tag for the run.")
+    parser.add_argument("--results-db", default=RESULTS_DB)
+    return parser.parse_args()
+
+
+@dataclass
+class Sample:
+    latency_ms: float
+    model_ms: float | None
+    items: int
+    ok: bool
+
+
+@dataclass
+class BenchmarkResult:
+    run_id: UUID
+    created_at: datetime
+    label: str | None
+    git_commit: str | None
+    model_backend: str
+    target: str
+    endpoint: str
+    concurrency: int
+    batch_size: int
+    requests: int
+    errors: int
+    duration_s: float
+    requests_per_second: float
+    items_per_second: float
+    latency_p50_ms: float | None
+    latency_p95_ms: float | None
+    latency_p99_ms: float | None
+    model_p50_ms: float | None
+    model_p95_ms: float | None
+    model_p99_ms: float | None
+    overhead_p50_ms: float | None
+    overhead_p95_ms: float | None
+    overhead_p99_ms: float | None
+    extra: dict = field(default_factory=dict)
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    """Nearest-rank percentile."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def parse_server_timing(header: str | None) -> float | None:
+    if not header:
+        return None
+    match = re.search(r"model;dur=([\d.]+)", header)
+    return float(match.group(1)) if match else None
+
+
+def load_payloads(endpoint: str, batch_size: int) -> list[dict]:
+    from src import config
+
+    with open(config.dataset_file) as f:
+        dataset = json.load(f)
+    items = [
+        {
+            "id": str(entry["id"]),
+            "post_text": entry["post_text"],
+            "post_created_at": entry["post_created_at"],
+        }
+        for entry in dataset
+    ]
+    if endpoint == "single":
+        return items
+    return [
+        {"items": [items[(start + i) % len(items)] for i in range(batch_size)]}
+        for start in range(0, len(items), batch_size)
+    ]
+
+
+async def drive(
+    client: httpx.AsyncClient,
+    endpoint: str,
+    payloads: list[dict],
+    requests: int,
+    concurrency: int,
+) -> tuple[list[Sample], float]:
+    queue: asyncio.Queue[dict] = asyncio.Queue()
+    for index in range(requests):
+        queue.put_nowait(payloads[index % len(payloads)])
+    samples: list[Sample] = []
+
+    async def client_loop() -> None:
+        while not queue.empty():
+            payload = queue.get_nowait()
+            started = perf_counter()
+            try:
+                response = await client.post(f"/{ENDPOINTS[endpoint]}", json=payload)
+                ok = response.status_code == 200
+                model_ms = parse_server_timing(response.headers.get("server-timing"))
+            except httpx.HTTPError:
+                ok, model_ms = False, None
+            samples.append(
+                Sample(
+                    latency_ms=(perf_counter() - started) * 1000,
+                    model_ms=model_ms,
+                    items=len(payload.get("items", [payload])),
+                    ok=ok,
+                )
+            )
+
+    started = perf_counter()
+    await asyncio.gather(*[client_loop() for _ in range(concurrency)])
+    return samples, perf_counter() - started
+
+
+def summarise(
+    samples: list[Sample],
+    duration_s: float,
+    endpoint: str,
+    concurrency: int,
+    args: argparse.Namespace,
+    run_id: UUID,
+    git_commit: str | None,
+) -> BenchmarkResult:
+    succeeded = [sample for sample in samples if sample.ok]
+    latencies = [sample.latency_ms for sample in succeeded]
+    models = [sample.model_ms for sample in succeeded if sample.model_ms is not None]
+    overheads = [
+        sample.latency_ms - sample.model_ms
+        for sample in succeeded
+        if sample.model_ms is not None
+    ]
+    return BenchmarkResult(
+        run_id=run_id,
+        created_at=datetime.now(UTC),
+        label=args.label,
+        git_commit=git_commit,
+        model_backend=os.environ["MODEL_BACKEND"] if not args.base_url else "remote",
+        target=args.base_url or "in-process",
+        endpoint=endpoint,
+        concurrency=concurrency,
+        batch_size=args.batch_size if endpoint == "batch" else 1,
+        requests=len(samples),
+        errors=len(samples) - len(succeeded),
+        duration_s=duration_s,
+        requests_per_second=len(succeeded) / duration_s,
+        items_per_second=sum(sample.items for sample in succeeded) / duration_s,
+        latency_p50_ms=percentile(latencies, 50),
+        latency_p95_ms=percentile(latencies, 95),
+        latency_p99_ms=percentile(latencies, 99),
+        model_p50_ms=percentile(models, 50),
+        model_p95_ms=percentile(models, 95),
+        model_p99_ms=percentile(models, 99),
+        overhead_p50_ms=percentile(overheads, 50),
+        overhead_p95_ms=percentile(overheads, 95),
+        overhead_p99_ms=percentile(overheads, 99),
+        extra={
+            "latency_scale": args.latency_scale,
+            "keep_cache": args.keep_cache,
+        },
+    )
+
+
+def store_results(results_db: str, results: list[BenchmarkResult]) -> None:
+    connection = duckdb.connect(results_db)
+    try:
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS benchmark_results (
+                run_id UUID,
+                created_at TIMESTAMP WITH TIME ZONE,
+                label VARCHAR,
+                git_commit VARCHAR,
+                model_backend VARCHAR,
+                target VARCHAR,
+                endpoint VARCHAR,
+                concurrency INTEGER,
+                batch_size INTEGER,
+                requests INTEGER,
+                errors INTEGER,
+                duration_s DOUBLE,
+                requests_per_second DOUBLE,
+                items_per_second DOUBLE,
+                latency_p50_ms DOUBLE,
+                latency_p95_ms DOUBLE,
+                latency_p99_ms DOUBLE,
+                model_p50_ms DOUBLE,
+                model_p95_ms DOUBLE,
+                model_p99_ms DOUBLE,
+                overhead_p50_ms DOUBLE,
+                overhead_p95_ms DOUBLE,
+                overhead_p99_ms DOUBLE,
+                extra JSON
+            );
+            """
+        )
+        connection.executemany(
+            f"INSERT INTO benchmark_results VALUES ({', '.join(['?'] * 24)})",
+            [
+                [*list(asdict(result).values())[:-1], json.dumps(result.extra)]
+                for result in results
+            ],
+        )
+    finally:
+        connection.close()
+
+
+def previous_result(results_db: str, result: BenchmarkResult) -> tuple | None:
+    """The latest earlier run of the same benchmark, for regression deltas."""
+    connection = duckdb.connect(results_db, read_only=True)
+    try:
+        return connection.execute(
+            """
+            SELECT requests_per_second, overhead_p50_ms, overhead_p95_ms
+            FROM benchmark_results
+            WHERE run_id <> ? AND target = ? AND endpoint = ?
+                AND concurrency = ? AND batch_size = ?
+            ORDER BY created_at DESC
+            LIMIT 1
+            """,
+            [
+                result.run_id,
+                result.target,
+                result.endpoint,
+                result.concurrency,
+                result.batch_size,
+            ],
+        ).fetchone()
+    finally:
+        connection.close()
+
+
+def format_ms(value: float | None) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def format_delta(current: float | None, before: float | None) -> str:
+    if current is None or not before:
+        return "-"
+    return f"{(current - before) / before:+.1%}"
+
+
+def print_results(results_db: str, results: list[BenchmarkResult]) -> None:
+    headers = [
+        "endpoint",
+        "conc",
+        "req/s",
+        "items/s",
+        "errors",
+        "lat_p50",
+        "lat_p95",
+        "lat_p99",
+        "model_p50",
+        "over_p50",
+        "over_p95",
+        "over_p99",
+        "d_req/s",
+        "d_over_p50",
+        "d_over_p95",
+    ]
+    table = []
+    for result in results:
+        before = previous_result(results_db, result) or (None, None, None)
+        table.append(
+            [
+                result.endpoint,
+                str(result.concurrency),
+                f"{result.requests_per_second:.1f}",
+                f"{result.items_per_second:.1f}",
+                str(result.errors),
+                format_ms(result.latency_p50_ms),
+                format_ms(result.latency_p95_ms),
+                format_ms(result.latency_p99_ms),
+                format_ms(result.model_p50_ms),
+                format_ms(result.overhead_p50_ms),
+                format_ms(result.overhead_p95_ms),
+                format_ms(result.overhead_p99_ms),
+                format_delta(result.requests_per_second, before[0]),
+                format_delta(result.overhead_p50_ms, before[1]),
+                format_delta(result.overhead_p95_ms, before[2]),
+            ]
+        )
+
+    widths = [
+        max(len(header), *(len(row[idx]) for row in table))
+        for idx, header in enumerate(headers)
+    ]
+    print("  ".join(header.rjust(widths[idx]) for idx, header in enumerate(headers)))
+    for row in table:
+        print("  ".join(cell.rjust(widths[idx]) for idx, cell in enumerate(row)))
+
+
+def current_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> list[BenchmarkResult]:
+    run_id = uuid4()
+    git_commit = current_commit()
+    results = []
+
+    async def benchmark(client: httpx.AsyncClient) -> None:
+        for endpoint in args.endpoints:
+            payloads = load_payloads(endpoint, args.batch_size)
+            for concurrency in args.concurrency:
+                samples, duration_s = await drive(
+                    client, endpoint, payloads, args.requests, concurrency
+                )
+                results.append(
+                    summarise(
+                        samples,
+                        duration_s,
+                        endpoint,
+                        concurrency,
+                        args,
+                        run_id,
+                        git_commit,
+                    )
+                )
+
+    if args.base_url:
+        limits = httpx.Limits(max_connections=max(args.concurrency))
+        async with httpx.AsyncClient(
+            base_url=args.base_url, timeout=300, limits=limits
+        ) as client:
+            await benchmark(client)
+        return results
+
+    from src import config
+
+    if not args.keep_cache:
+        # Every request should reach the (stubbed) model.
+        config.response_cache_enabled = False
+        config.request_coalescing_enabled = False
+
+    from src.main import app, lifespan
+
+    async with lifespan(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://benchmark", timeout=300
+        ) as client:
+            await benchmark(client)
+    return results
+
+
+def main() -> None:
+    args = parse_args()
+    # src reads the backend from the environment on import; the in-process
+    # target must never reach Gemini.
+    os.environ.setdefault("MODEL_BACKEND", "fake")
+    if args.latency_scale is not None:
+        os.environ["STUB_LATENCY_SCALE"] = str(args.latency_scale)
+    if not args.base_url and os.environ["MODEL_BACKEND"] == "google":
+        raise SystemExit("Refusing to benchmark in-process against Gemini")
+
+    results = asyncio.run(run(args))
+    store_results(args.results_db, results)
+    print_results(args.results_db, results)
+
+
+if __name__ == "__main__":
+    main()
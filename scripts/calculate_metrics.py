@@ -1,36 +1,25 @@
+import argparse
+import hashlib
 import json
+import shutil
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
+from uuid import UUID
 import duckdb
-from scipy.stats import spearmanr
-from sklearn.metrics import (
-    accuracy_score,
-    ConfusionMatrixDisplay,
-    confusion_matrix,
-    f1_score,
-    precision_score,
-    recall_score,
-)
-import matplotlib.pyplot as plt
+import numpy as np
 from src import config
-from src.models import ParsedPredictionResponse
-
-
-@dataclass
-class AlignedExample:
-    prediction_id: str
-    prediction: ParsedPredictionResponse
-    annotation: ParsedPredictionResponse
+from src.database import connect, wait_for_lock
+from src.models import ParsedPredictionResponse, response_list_adapter
 
 
 def load_annotations() -> dict[str, ParsedPredictionResponse]:
     with open(config.dataset_file) as f:
         dataset = json.load(f)
 
-    annotations = {}
-    for entry in dataset:
-        annotations[str(entry["id"])] = ParsedPredictionResponse.model_validate(
+    annotations = response_list_adapter.validate_python(
+        [
             {
                 "target_type": entry["target_type"],
                 "extracted_value": entry.get("extracted_value"),
@@ -38,67 +27,323 @@ def load_annotations() -> dict[str, ParsedPredictionResponse]:
                 "timeframe": entry["timeframe"],
                 "notes": entry["notes"],
             }
+            for entry in dataset
+        ]
+    )
+    return {
+        str(entry["id"]): annotation for entry, annotation in zip(dataset, annotations)
+    }
+
+
+def normalised_columns(payload: str) -> str:
+    """Select list of the fields compared against the annotations.
+
+    Matches comparing the validated models: extracted values compare field
+    by field with numbers as doubles, and timeframes compare as instants.
+    """
+
+    value = f"({payload} -> 'extracted_value')"
+    timeframe = f"({payload} -> 'timeframe')"
+    return f"""
+        {payload} ->> 'target_type' AS target_type,
+        CASE WHEN coalesce(json_type({value}), 'NULL') <> 'NULL' THEN {{
+            'asset': {value} ->> 'asset',
+            'currency': {value} ->> 'currency',
+            'price': CAST({value} ->> 'price' AS DOUBLE),
+            'percentage': CAST({value} ->> 'percentage' AS DOUBLE),
+            'min': CAST({value} ->> 'min' AS DOUBLE),
+            'max': CAST({value} ->> 'max' AS DOUBLE),
+            'ranking': CAST({value} ->> 'ranking' AS BIGINT)
+        }} END AS extracted_value,
+        {{
+            'explicit': CAST({timeframe} ->> 'explicit' AS BOOLEAN),
+            'start': CAST({timeframe} ->> 'start' AS TIMESTAMPTZ),
+            'end': CAST({timeframe} ->> 'end' AS TIMESTAMPTZ)
+        }} AS timeframe,
+        CAST({payload} ->> 'bear_bull' AS INTEGER) AS bear_bull
+    """
+
+
+AGGREGATE_TABLES = """
+CREATE TABLE IF NOT EXISTS eval_target_confusion (
+    run_id VARCHAR,
+    batch_size INTEGER,
+    true_target_type VARCHAR,
+    pred_target_type VARCHAR,
+    examples BIGINT,
+    timeframe_matches BIGINT,
+    value_matches BIGINT,
+    PRIMARY KEY (run_id, batch_size, true_target_type, pred_target_type)
+);
+CREATE TABLE IF NOT EXISTS eval_bear_bull (
+    run_id VARCHAR,
+    batch_size INTEGER,
+    true_bear_bull INTEGER,
+    pred_bear_bull INTEGER,
+    examples BIGINT,
+    PRIMARY KEY (run_id, batch_size, true_bear_bull, pred_bear_bull)
+);
+CREATE TABLE IF NOT EXISTS eval_watermark (
+    dataset_hash VARCHAR,
+    results_file VARCHAR,
+    aggregated_through BIGINT
+);
+"""
+
+
+def align_in_database(
+    connection: duckdb.DuckDBPyConnection, since: int | None, until: int
+) -> None:
+    """Joins the predictions with an id in (since, until] with their
+    annotations into the `aligned` table."""
+
+    connection.execute(
+        f"""
+        CREATE OR REPLACE TEMP TABLE aligned AS
+        WITH predictions AS (
+            SELECT
+                run_id,
+                batch_size,
+                coalesce(
+                    raw_prediction_json ->> 'id',
+                    prediction_id,
+                    CAST(example_id AS VARCHAR)
+                ) AS prediction_id,
+                {normalised_columns("raw_prediction_json")}
+            FROM results.prediction_results
+            WHERE id > coalesce(?, 0) AND id <= ?
+        ),
+        annotations AS (
+            SELECT json ->> 'id' AS prediction_id, {normalised_columns("json")}
+            FROM read_json_objects(?, format = 'array')
+        )
+        SELECT
+            CAST(p.run_id AS VARCHAR) AS run_id,
+            p.batch_size,
+            p.prediction_id,
+            a.prediction_id IS NOT NULL AS annotated,
+            a.target_type AS true_target_type,
+            p.target_type AS pred_target_type,
+            p.extracted_value IS NOT DISTINCT FROM a.extracted_value AS value_match,
+            p.timeframe IS NOT DISTINCT FROM a.timeframe AS timeframe_match,
+            a.bear_bull AS true_bear_bull,
+            p.bear_bull AS pred_bear_bull
+        FROM predictions p
+        LEFT JOIN annotations a USING (prediction_id)
+        """,
+        [since, until, config.dataset_file],
+    )
+    missing = connection.execute(
+        "SELECT prediction_id FROM aligned WHERE NOT annotated LIMIT 1"
+    ).fetchone()
+    if missing is not None:
+        raise KeyError(f"No annotation found for prediction id {missing[0]}")
+
+
+def dataset_hash() -> str:
+    with open(config.dataset_file, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def update_aggregates(
+    connection: duckdb.DuckDBPyConnection, rebuild: bool = False
+) -> int:
+    """Folds predictions logged since the last update into the per-run
+    aggregate tables and returns how many rows that was.
+
+    Every aggregate is a count, so new rows are merged by adding to the
+    existing counts. The watermark is the highest prediction_results `id`
+    aggregated so far: ids come from a sequence and log_prediction_rows
+    commits them in order, so a row with a lower id can't appear later. A
+    changed annotated dataset or results database triggers a rebuild.
+    """
+
+    connection.execute(AGGREGATE_TABLES)
+    current_hash = dataset_hash()
+    watermark = connection.execute(
+        "SELECT dataset_hash, results_file, aggregated_through FROM eval_watermark"
+    ).fetchone()
+    if watermark is None or watermark[:2] != (current_hash, config.results_db_file):
+        rebuild = True
+    since = None if rebuild else watermark[2]
+    until = connection.execute(
+        "SELECT max(id) FROM results.prediction_results"
+    ).fetchone()[0]
+    if until is None or (since is not None and until <= since):
+        return 0
+
+    align_in_database(connection, since, until)
+    connection.begin()
+    try:
+        if rebuild:
+            connection.execute("DELETE FROM eval_target_confusion")
+            connection.execute("DELETE FROM eval_bear_bull")
+        connection.execute(
+            """
+            INSERT INTO eval_target_confusion
+            SELECT
+                run_id,
+                batch_size,
+                true_target_type,
+                pred_target_type,
+                count(*),
+                count(*) FILTER (timeframe_match),
+                count(*) FILTER (value_match)
+            FROM aligned
+            GROUP BY ALL
+            ON CONFLICT DO UPDATE SET
+                examples = examples + excluded.examples,
+                timeframe_matches = timeframe_matches + excluded.timeframe_matches,
+                value_matches = value_matches + excluded.value_matches
+            """
+        )
+        connection.execute(
+            """
+            INSERT INTO eval_bear_bull
+            SELECT run_id, batch_size, true_bear_bull, pred_bear_bull, count(*)
+            FROM aligned
+            GROUP BY ALL
+            ON CONFLICT DO UPDATE SET examples = examples + excluded.examples
+            """
+        )
+        connection.execute("DELETE FROM eval_watermark")
+        connection.execute(
+            "INSERT INTO eval_watermark VALUES (?, ?, ?)",
+            [current_hash, config.results_db_file, until],
         )
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return connection.execute("SELECT count(*) FROM aligned").fetchone()[0]
+
+
+def average_rank(value: str) -> str:
+    """Rank of each distinct value in the bear_bull histogram, with ties
+    sharing their average position as in spearmanr."""
+
+    return f"""(
+        sum(sum(examples)) OVER (
+            PARTITION BY run_id, batch_size ORDER BY {value}
+        ) - (sum(examples) - 1) / 2.0
+    )"""
+
+
+SPEARMAN_QUERY = f"""
+WITH true_ranks AS (
+    SELECT run_id, batch_size, true_bear_bull,
+        {average_rank("true_bear_bull")} AS true_rank
+    FROM eval_bear_bull
+    GROUP BY run_id, batch_size, true_bear_bull
+),
+pred_ranks AS (
+    SELECT run_id, batch_size, pred_bear_bull,
+        {average_rank("pred_bear_bull")} AS pred_rank
+    FROM eval_bear_bull
+    GROUP BY run_id, batch_size, pred_bear_bull
+),
+ranked AS (
+    SELECT run_id, batch_size, examples, true_rank, pred_rank
+    FROM eval_bear_bull
+    JOIN true_ranks USING (run_id, batch_size, true_bear_bull)
+    JOIN pred_ranks USING (run_id, batch_size, pred_bear_bull)
+),
+centred AS (
+    SELECT
+        run_id,
+        batch_size,
+        examples,
+        true_rank - sum(examples * true_rank) OVER group_rows
+            / sum(examples) OVER group_rows AS true_delta,
+        pred_rank - sum(examples * pred_rank) OVER group_rows
+            / sum(examples) OVER group_rows AS pred_delta
+    FROM ranked
+    WINDOW group_rows AS (PARTITION BY run_id, batch_size)
+)
+SELECT
+    run_id,
+    batch_size,
+    sum(examples * true_delta * pred_delta) / sqrt(
+        sum(examples * true_delta * true_delta)
+        * sum(examples * pred_delta * pred_delta)
+    ) AS spearman
+FROM centred
+GROUP BY run_id, batch_size
+"""
+
+
+@dataclass
+class GroupMetrics:
+    run_id: str
+    batch_size: int
+    labels: list[str]
+    matrix: np.ndarray
+    timeframe_exact_match: float
+    value_exact_match: float
+    spearman: float
+
 
-    return annotations
+def attach_results(connection: duckdb.DuckDBPyConnection) -> None:
+    """Attaches results_db_file read-only as `results`; the aggregates are
+    written to eval_db_file."""
 
+    path = config.results_db_file.replace("'", "''")
+    wait_for_lock(lambda: connection.execute(f"ATTACH '{path}' AS results (READ_ONLY)"))
 
-def fetch_predictions() -> dict[
-    tuple[str, int], list[tuple[str, ParsedPredictionResponse]]
-]:
-    connection = duckdb.connect(config.db_file, read_only=True)
+
+def fetch_group_metrics(rebuild: bool = False) -> list[GroupMetrics]:
+    connection = connect(config.eval_db_file)
     try:
-        rows = connection.execute(
+        attach_results(connection)
+        new_rows = update_aggregates(connection, rebuild=rebuild)
+        print(f"aggregated {new_rows} new prediction rows")
+        confusion = connection.execute(
+            """
+            SELECT run_id, batch_size, true_target_type, pred_target_type, examples
+            FROM eval_target_confusion
             """
-            SELECT run_id, batch_size, example_id, prediction_id, raw_prediction_json
-            FROM prediction_results
-            ORDER BY run_id, batch_size, example_id
+        ).fetchall()
+        aggregates = connection.execute(
+            f"""
+            SELECT
+                run_id,
+                batch_size,
+                sum(timeframe_matches) / sum(examples),
+                sum(value_matches) / sum(examples),
+                any_value(ranks.spearman)
+            FROM eval_target_confusion
+            LEFT JOIN ({SPEARMAN_QUERY}) ranks USING (run_id, batch_size)
+            GROUP BY run_id, batch_size
+            ORDER BY run_id, batch_size
             """
         ).fetchall()
     finally:
         connection.close()
 
-    grouped = defaultdict(list)
-    for run_id, batch_size, example_id, prediction_id, raw_prediction_json in rows:
-        if isinstance(raw_prediction_json, str):
-            payload = json.loads(raw_prediction_json)
-        else:
-            payload = raw_prediction_json
-        prediction = ParsedPredictionResponse.model_validate(payload)
-        resolved_id = (
-            prediction.id
-            or prediction_id
-            or payload.get("id")
-            or str(example_id)
-        )
-        grouped[(str(run_id), batch_size)].append((str(resolved_id), prediction))
-
-    return grouped
-
-
-def align_predictions(
-    predictions: dict[tuple[str, int], list[tuple[str, ParsedPredictionResponse]]],
-    annotations: dict[str, ParsedPredictionResponse],
-) -> dict[tuple[str, int], list[AlignedExample]]:
-    aligned = {}
-    for key, items in predictions.items():
-        aligned[key] = []
-        for prediction_id, prediction in items:
-            annotation = annotations.get(prediction_id)
-            if annotation is None:
-                raise KeyError(
-                    f"No annotation found for prediction id {prediction_id}"
-                )
-
-            aligned[key].append(
-                AlignedExample(
-                    prediction_id=prediction_id,
-                    prediction=prediction,
-                    annotation=annotation,
-                )
+    counts = defaultdict(dict)
+    for run_id, batch_size, true_label, pred_label, count in confusion:
+        counts[(run_id, batch_size)][(true_label, pred_label)] = count
+
+    groups = []
+    for run_id, batch_size, timeframe_match, value_match, spearman in aggregates:
+        group_counts = counts[(run_id, batch_size)]
+        labels = sorted({label for pair in group_counts for label in pair})
+        index = {label: position for position, label in enumerate(labels)}
+        matrix = np.zeros((len(labels), len(labels)), dtype=np.int64)
+        for (true_label, pred_label), count in group_counts.items():
+            matrix[index[true_label], index[pred_label]] = count
+        groups.append(
+            GroupMetrics(
+                run_id=run_id,
+                batch_size=batch_size,
+                labels=labels,
+                matrix=matrix,
+                timeframe_exact_match=timeframe_match,
+                value_exact_match=value_match,
+                spearman=float("nan") if spearman is None else spearman,
             )
-
-    return aligned
+        )
+    return groups
 
 
 def serialise_timeframe(model: ParsedPredictionResponse) -> str:
@@ -121,73 +366,51 @@ def serialise_extracted_value(model: ParsedPredictionResponse) -> str:
     return json.dumps(value.model_dump(mode="python"), sort_keys=True, default=str)
 
 
-def print_classification_metrics(
-    name: str, y_true: list[str], y_pred: list[str]
-) -> None:
-    labels = sorted(set(y_true) | set(y_pred))
-    accuracy = accuracy_score(y_true, y_pred)
-    precision = precision_score(
-        y_true,
-        y_pred,
-        labels=labels,
-        average="macro",
-    )
-    recall = recall_score(
-        y_true,
-        y_pred,
-        labels=labels,
-        average="macro",
-    )
-    f1 = f1_score(
-        y_true,
-        y_pred,
-        labels=labels,
-        average="macro",
-    )
-
-    print(name)
-    print(f"  accuracy: {accuracy:.4f}")
-    print(f"  precision: {precision:.4f}")
-    print(f"  recall: {recall:.4f}")
-    print(f"  f1: {f1:.4f}")
+def print_classification_metrics(name: str, matrix: np.ndarray) -> None:
+    """Accuracy and macro precision/recall/f1, with 0 for undefined ratios."""
 
+    true_positives = np.diag(matrix).astype(float)
+    predicted = matrix.sum(axis=0)
+    actual = matrix.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(predicted > 0, true_positives / predicted, 0.0)
+        recall = np.where(actual > 0, true_positives / actual, 0.0)
+        f1 = np.where(
+            predicted + actual > 0, 2 * true_positives / (predicted + actual), 0.0
+        )
 
-def compute_metrics_for_group(examples: list[AlignedExample]):
-    y_true_target = [ex.annotation.target_type for ex in examples]
-    y_pred_target = [ex.prediction.target_type for ex in examples]
+    print(name)
+    print(f"  accuracy: {true_positives.sum() / matrix.sum():.4f}")
+    print(f"  precision: {precision.mean():.4f}")
+    print(f"  recall: {recall.mean():.4f}")
+    print(f"  f1: {f1.mean():.4f}")
 
-    labels = sorted(set(y_true_target) | set(y_pred_target))
-    matrix = confusion_matrix(y_true_target, y_pred_target, labels=labels)
-    print_classification_metrics("target_type", y_true_target, y_pred_target)
 
-    y_true_timeframe = [serialise_timeframe(ex.annotation) for ex in examples]
-    y_pred_timeframe = [serialise_timeframe(ex.prediction) for ex in examples]
-    exact_timeframe = sum(
-        true == pred for true, pred in zip(y_true_timeframe, y_pred_timeframe)
-    ) / len(examples)
+def print_group_metrics(group: GroupMetrics) -> None:
+    print_classification_metrics("target_type", group.matrix)
     print("timeframe")
-    print(f"  exact_match: {exact_timeframe:.4f}")
-
-    y_true_value = [serialise_extracted_value(ex.annotation) for ex in examples]
-    y_pred_value = [serialise_extracted_value(ex.prediction) for ex in examples]
-    exact_value = sum(
-        true == pred for true, pred in zip(y_true_value, y_pred_value)
-    ) / len(examples)
+    print(f"  exact_match: {group.timeframe_exact_match:.4f}")
     print("extracted_value")
-    print(f"  exact_match: {exact_value:.4f}")
-
-    true_bear_bull = [ex.annotation.bear_bull for ex in examples]
-    pred_bear_bull = [ex.prediction.bear_bull for ex in examples]
-    spearman = spearmanr(true_bear_bull, pred_bear_bull)
+    print(f"  exact_match: {group.value_exact_match:.4f}")
     print("bear_bull")
-    print(f"  spearman: {spearman.statistic:.4f}")
+    print(f"  spearman: {group.spearman:.4f}")
+
+
+def plotting():
+    """The plotting stack, imported only once a figure is rendered."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from sklearn.metrics import ConfusionMatrixDisplay
 
-    return labels, matrix
+    return plt, ConfusionMatrixDisplay
 
 
 def save_confusion_matrix(
     labels: list[str], matrix, destination: Path, title: str
 ) -> None:
+    plt, ConfusionMatrixDisplay = plotting()
     destination.parent.mkdir(parents=True, exist_ok=True)
     display = ConfusionMatrixDisplay(confusion_matrix=matrix, display_labels=labels)
     display.plot(cmap="Blues", xticks_rotation=45, colorbar=False)
@@ -197,25 +420,99 @@ def save_confusion_matrix(
     plt.close()
 
 
-def run_metrics(aligned: dict[tuple[str, int], list[AlignedExample]]) -> None:
-    for (run_id, batch_size), examples in aligned.items():
-        print(f"run_id={run_id} batch_size={batch_size}")
-        labels, matrix = compute_metrics_for_group(examples)
-        image_path = Path(f"report/confusion_matrix/batch-size-{batch_size}.png")
-        save_confusion_matrix(
-            labels,
-            matrix,
-            image_path,
-            title=f"batch_size={batch_size}",
+def render_confusion_matrices(
+    groups: list[GroupMetrics], jobs: int = 1, report_run: str | None = None
+) -> None:
+    """Saves one figure per group, in a pool of `jobs` processes if above 1.
+
+    The figures of `report_run` are also copied to `batch-size-{n}.png`, the
+    stable names that report/relatorio.md embeds.
+    """
+
+    figures = [
+        (
+            group.labels,
+            group.matrix,
+            Path(
+                f"report/confusion_matrix/{group.run_id}-batch-size-{group.batch_size}.png"
+            ),
+            f"run_id={group.run_id[:8]} batch_size={group.batch_size}",
         )
+        for group in groups
+    ]
+    if jobs <= 1:
+        for figure in figures:
+            save_confusion_matrix(*figure)
+    else:
+        # Imported before the pool starts so that forked workers inherit it.
+        plotting()
+        with ProcessPoolExecutor(max_workers=min(jobs, len(figures))) as pool:
+            for _ in pool.map(save_confusion_matrix, *zip(*figures)):
+                pass
+
+    for group, (_, _, destination, _) in zip(groups, figures):
+        if group.run_id == report_run:
+            shutil.copyfile(
+                destination, destination.with_name(f"batch-size-{group.batch_size}.png")
+            )
+
+
+def run_metrics(
+    groups: list[GroupMetrics],
+    plots: bool = True,
+    jobs: int = 1,
+    report_run: str | None = None,
+) -> None:
+    for group in groups:
+        print(f"run_id={group.run_id} batch_size={group.batch_size}")
+        print_group_metrics(group)
         print()
+    if report_run is not None and all(group.run_id != report_run for group in groups):
+        print(f"Run {report_run} has no evaluated predictions; report figures kept")
+    if plots and groups:
+        render_confusion_matrices(groups, jobs, report_run)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Quality metrics of every (run_id, batch_size) group."
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Recompute the aggregate tables from all of prediction_results.",
+    )
+    parser.add_argument(
+        "--no-plots",
+        action="store_true",
+        help="Only print the metrics; matplotlib and sklearn are never imported.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Processes used to render the confusion matrices.",
+    )
+    parser.add_argument(
+        "--report-run",
+        type=UUID,
+        default=None,
+        help=(
+            "Also save this run's confusion matrices as batch-size-{n}.png, "
+            "the figures embedded in report/relatorio.md."
+        ),
+    )
+    return parser.parse_args()
 
 
 def main() -> None:
-    annotations = load_annotations()
-    predictions = fetch_predictions()
-    aligned = align_predictions(predictions, annotations)
-    run_metrics(aligned)
+    args = parse_args()
+    run_metrics(
+        fetch_group_metrics(rebuild=args.rebuild),
+        plots=not args.no_plots,
+        jobs=args.jobs,
+        report_run=str(args.report_run) if args.report_run else None,
+    )
 
 
 if __name__ == "__main__":
@@ -1,64 +1,143 @@
-from dataclasses import dataclass
+import argparse
+import re
+from datetime import UTC, datetime, timedelta
 
 import duckdb
+import httpx
 
 from src import config
-
-
-INPUT_RATE = 0.3 / 1_000_000
-OUTPUT_RATE = 2.5 / 1_000_000
-
-QUERY = f"""
-SELECT
-    model_name,
-    batch_size,
-    COUNT(*) AS request_count,
-    AVG(CAST(succeeded AS DOUBLE)) AS success_rate,
-    AVG(latency_ms) / 1000.0 AS latency_mean,
-    percentile_cont(0.5) WITHIN GROUP (ORDER BY latency_ms) / 1000.0 AS latency_p50,
-    percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms) / 1000.0 AS latency_p95,
-    AVG(input_tokens) AS input_tokens_mean,
-    AVG(input_tokens * {INPUT_RATE}) AS input_cost_mean,
-    percentile_cont(0.5) WITHIN GROUP (ORDER BY input_tokens * {INPUT_RATE}) AS input_cost_p50,
-    percentile_cont(0.95) WITHIN GROUP (ORDER BY input_tokens * {INPUT_RATE}) AS input_cost_p95,
-    AVG(output_tokens) AS output_tokens_mean,
-    AVG(output_tokens * {OUTPUT_RATE}) AS output_cost_mean,
-    percentile_cont(0.5) WITHIN GROUP (ORDER BY output_tokens * {OUTPUT_RATE}) AS output_cost_p50,
-    percentile_cont(0.95) WITHIN GROUP (ORDER BY output_tokens * {OUTPUT_RATE}) AS output_cost_p95
-FROM token_usage
-GROUP BY 1, 2
-ORDER BY 1, 2
-"""
-
-
-@dataclass
-class ReportRow:
-    model_name: str | None
-    batch_size: int | None
-    request_count: int
-    success_rate: float | None
-    latency_mean: float | None
-    latency_p50: float | None
-    latency_p95: float | None
-    input_tokens_mean: float | None
-    input_cost_mean: float | None
-    input_cost_p50: float | None
-    input_cost_p95: float | None
-    output_tokens_mean: float | None
-    output_cost_mean: float | None
-    output_cost_p50: float | None
-    output_cost_p95: float | None
-
-
-def fetch_rows() -> list[ReportRow]:
-    connection = duckdb.connect(config.db_file, read_only=True)
+from src.database import connect
+from src.rollups import (
+    GRANULARITIES,
+    GROUP_COLUMNS,
+    ReportRow,
+    create_rollup_tables,
+    fetch_report,
+    rebuild_usage_rollups,
+)
+
+DURATION = re.compile(r"(\d+)([hdw])")
+DURATION_UNITS = {"h": "hours", "d": "days", "w": "weeks"}
+
+
+def parse_time(value: str) -> datetime:
+    """An ISO timestamp (UTC unless it has an offset) or a duration ago: 12h, 7d, 2w."""
+    if match := DURATION.fullmatch(value):
+        amount, unit = match.groups()
+        return datetime.now(UTC) - timedelta(**{DURATION_UNITS[unit]: int(amount)})
+    moment = datetime.fromisoformat(value)
+    return moment if moment.tzinfo else moment.replace(tzinfo=UTC)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Latency and cost of model calls, from the usage rollups."
+    )
+    parser.add_argument(
+        "--since",
+        type=parse_time,
+        default=None,
+        help="Start of the window: ISO timestamp or a duration ago (12h, 7d, 2w).",
+    )
+    parser.add_argument(
+        "--until",
+        type=parse_time,
+        default=None,
+        help="End of the window, in the same formats as --since.",
+    )
+    parser.add_argument(
+        "--granularity",
+        choices=GRANULARITIES,
+        default="day",
+        help="Rollup to read; the window is widened to whole buckets.",
+    )
+    parser.add_argument(
+        "--group-by",
+        nargs="*",
+        choices=sorted(GROUP_COLUMNS),
+        default=["model", "batch_size"],
+        help="Dimensions to report separately; the others are merged.",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Recompute the rollups from token_usage, e.g. after a price change.",
+    )
+    parser.add_argument(
+        "--api",
+        default=None,
+        metavar="URL",
+        help=(
+            "Read the report from a running API (e.g. http://localhost:8000), "
+            "which holds the lock on the database file."
+        ),
+    )
+    args = parser.parse_args()
+    if args.api and args.rebuild:
+        parser.error("--rebuild needs the database file; stop the API first")
+    return args
+
+
+def ensure_rollups(connection: duckdb.DuckDBPyConnection, rebuild: bool) -> None:
+    """Creates the rollups, backfilling them when token_usage has rows they
+    don't cover (a database from before the rollups existed)."""
+
+    create_rollup_tables(connection)
+    if not rebuild:
+        covered, logged = connection.execute(
+            """
+            SELECT
+                (SELECT coalesce(sum(request_count), 0) FROM usage_rollups
+                 WHERE granularity = 'day'),
+                (SELECT count(*) FROM token_usage)
+            """
+        ).fetchone()
+        rebuild = covered != logged
+    if rebuild:
+        rebuild_usage_rollups(connection)
+
+
+def fetch_rows(
+    since: datetime | None = None,
+    until: datetime | None = None,
+    granularity: str = "day",
+    group_by: list[str] | None = None,
+    rebuild: bool = False,
+) -> list[ReportRow]:
+    connection = connect(config.db_file)
     try:
-        result = connection.execute(QUERY)
-        rows = result.fetchall()
+        ensure_rollups(connection, rebuild)
+        return fetch_report(connection, since, until, granularity, group_by)
     finally:
         connection.close()
 
-    return [ReportRow(*row) for row in rows]
+
+def fetch_rows_from_api(
+    api_url: str,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    granularity: str = "day",
+    group_by: list[str] | None = None,
+) -> list[ReportRow]:
+    params = {"granularity": granularity}
+    if group_by is not None:
+        params["group_by"] = ",".join(group_by)
+    for name, moment in (("since", since), ("until", until)):
+        if moment is not None:
+            params[name] = moment.isoformat()
+    response = httpx.get(f"{api_url.rstrip('/')}/usage_report", params=params)
+    response.raise_for_status()
+    return [
+        ReportRow(
+            **{
+                **row,
+                "bucket_start": datetime.fromisoformat(row["bucket_start"])
+                if row["bucket_start"]
+                else None,
+            }
+        )
+        for row in response.json()
+    ]
 
 
 def format_number(value: float | None, digits: int = 2) -> str:
@@ -75,6 +154,7 @@ def format_percentage(value: float | None) -> str:
 
 def print_report(rows: list[ReportRow]) -> None:
     headers = [
+        "bucket",
         "model",
         "batch",
         "requests",
@@ -82,20 +162,27 @@ def print_report(rows: list[ReportRow]) -> None:
         "lat_mean_s",
         "lat_p50_s",
         "lat_p95_s",
+        "lat_p99_s",
         "in_tokens",
+        "in_cached",
+        "in_uncached_cost",
+        "in_cached_cost",
         "in_cost_mean",
         "in_cost_p50",
         "in_cost_p95",
+        "in_cost_p99",
         "out_tokens",
         "out_cost_mean",
         "out_cost_p50",
         "out_cost_p95",
+        "out_cost_p99",
     ]
 
     table: list[list[str]] = []
     for row in rows:
         table.append(
             [
+                row.bucket_start.isoformat(" ") if row.bucket_start else "-",
                 row.model_name or "-",
                 str(row.batch_size) if row.batch_size is not None else "-",
                 str(row.request_count),
@@ -103,14 +190,20 @@ def print_report(rows: list[ReportRow]) -> None:
                 format_number(row.latency_mean),
                 format_number(row.latency_p50),
                 format_number(row.latency_p95),
+                format_number(row.latency_p99),
                 format_number(row.input_tokens_mean, digits=1),
+                format_number(row.cached_input_tokens_mean, digits=1),
+                format_number(row.uncached_input_cost_mean, digits=4),
+                format_number(row.cached_input_cost_mean, digits=4),
                 format_number(row.input_cost_mean, digits=4),
                 format_number(row.input_cost_p50, digits=4),
                 format_number(row.input_cost_p95, digits=4),
+                format_number(row.input_cost_p99, digits=4),
                 format_number(row.output_tokens_mean, digits=1),
                 format_number(row.output_cost_mean, digits=4),
                 format_number(row.output_cost_p50, digits=4),
                 format_number(row.output_cost_p95, digits=4),
+                format_number(row.output_cost_p99, digits=4),
             ]
         )
 
@@ -129,7 +222,31 @@ def print_report(rows: list[ReportRow]) -> None:
 
 
 def main() -> None:
-    rows = fetch_rows()
+    args = parse_args()
+    if args.api:
+        rows = fetch_rows_from_api(
+            args.api,
+            since=args.since,
+            until=args.until,
+            granularity=args.granularity,
+            group_by=args.group_by,
+        )
+    else:
+        try:
+            rows = fetch_rows(
+                since=args.since,
+                until=args.until,
+                granularity=args.granularity,
+                group_by=args.group_by,
+                rebuild=args.rebuild,
+            )
+        except duckdb.IOException as exc:
+            if "lock" not in str(exc):
+                raise
+            raise SystemExit(
+                f"{config.db_file} is locked, most likely by the running API; "
+                "read the report through it with --api http://localhost:8000"
+            ) from exc
     print_report(rows)
 
 
@@ -1,13 +1,21 @@
 import argparse
+import asyncio
 import json
 from typing import Any, TypedDict
 from uuid import UUID, uuid4
 
-import requests
-from requests import RequestException
+import duckdb
+import httpx
 
+from src import config
+from src.helpers import TokenBudget, estimate_item_tokens, pack_by_token_budget
 from src.models import ExtractedValueType, TargetType, Timeframe
-from src.database import init_db, latest_example_id, log_predictions
+from src.database import (
+    PredictionRow,
+    completed_batch_ids,
+    init_results_db,
+    log_prediction_rows,
+)
 
 DATASET_PATH = "data/annotated-dataset.json"
 API_BASE_URL = "http://localhost:8000"
@@ -28,6 +36,28 @@ def parse_args():
         default=None,
         help="Existing run identifier to resume; defaults to a new UUID",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Maximum number of batches in flight at once.",
+    )
+    parser.add_argument(
+        "--token-budget",
+        type=int,
+        default=None,
+        help=(
+            "Pack batches by estimated output tokens, up to this many per batch; "
+            "--batch-sizes then caps the items per batch. Use a new --run-id "
+            "when switching between packed and fixed-size batches."
+        ),
+    )
+    parser.add_argument(
+        "--latency-target",
+        type=float,
+        default=None,
+        help="Seconds a packed batch should take; further caps its output tokens.",
+    )
     return parser.parse_args()
 
 
@@ -62,14 +92,16 @@ def format_api_input(batch: list[DatasetEntry]) -> list[dict]:
     ]
 
 
-def fetch_predictions(endpoint: str, payload: Any) -> list[APIResponse]:
+async def fetch_predictions(
+    client: httpx.AsyncClient, endpoint: str, payload: Any
+) -> list[APIResponse]:
     """Send a POST request and normalize the response to a list."""
 
     url = f"{API_BASE_URL}/{endpoint}"
     try:
-        response = requests.post(url, json=payload, timeout=300)
+        response = await client.post(url, json=payload)
         response.raise_for_status()
-    except RequestException as exc:
+    except httpx.HTTPError as exc:
         raise RuntimeError(f"Request to {url} failed") from exc
 
     data: list[APIResponse] | APIResponse = response.json()
@@ -85,58 +117,150 @@ def log_prediction_results(
     batch_size: int,
     predictions: list[APIResponse],
 ):
-    for i, pred in enumerate(predictions):
-        log_predictions(
+    log_prediction_rows(
+        [
+            PredictionRow(
+                run_id=run_id,
+                batch_id=batch_id,
+                batch_size=batch_size,
+                example_id=batch_id + i,
+                raw_prediction_json=pred,
+            )
+            for i, pred in enumerate(predictions)
+        ]
+    )
+
+
+def batch_ranges(
+    dataset: list[DatasetEntry], batch_size: int, budget: TokenBudget | None
+) -> list[tuple[int, int]]:
+    if budget is None:
+        return [(i, i + batch_size) for i in range(0, len(dataset), batch_size)]
+    return pack_by_token_budget(
+        (estimate_item_tokens(item["post_text"]) for item in dataset), budget
+    )
+
+
+async def process_batch(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    run_id: UUID,
+    batch_id: int,
+    batch_size: int,
+    batch: list[DatasetEntry],
+) -> bool:
+    """Fetch and log one batch. A failure is reported and left unlogged, so
+    the other batches keep going and a resumed run retries this one."""
+
+    endpoint = "parse_prediction_batch" if batch_size > 1 else "parse_prediction"
+    input_batch = format_api_input(batch)
+    if endpoint == "parse_prediction":
+        payload = input_batch[0]
+    else:
+        payload = {"items": input_batch}
+
+    try:
+        async with semaphore:
+            print(f"Processing batch {batch_id}...")
+            predictions = await fetch_predictions(client, endpoint, payload)
+
+        # Each batch is logged in one transaction as soon as it completes, so a
+        # resumed run can skip exactly the batches that finished, in any order.
+        # The write runs off the event loop so it does not stall other batches.
+        await asyncio.to_thread(
+            log_prediction_results,
             run_id=run_id,
             batch_id=batch_id,
             batch_size=batch_size,
-            example_id=batch_id + i,
-            raw_prediction_json=pred,
+            predictions=predictions,
         )
+    except (RuntimeError, ValueError, duckdb.Error) as exc:
+        # Request failures, unreadable responses and failed writes; anything
+        # else is a bug and stops the run.
+        cause = f": {exc.__cause__}" if exc.__cause__ is not None else ""
+        print(f"Batch {batch_id} failed: {exc}{cause}")
+        return False
+    return True
 
 
-def main():
-    init_db()
-    args = parse_args()
-    run_id = args.run_id or uuid4()
+async def process_batch_size(
+    run_id: UUID,
+    batch_size: int,
+    dataset: list[DatasetEntry],
+    concurrency: int,
+    budget: TokenBudget | None = None,
+) -> None:
+    # Batches are identified by their first example, so packed batches resume
+    # correctly as long as the budget is the same.
+    completed = completed_batch_ids(run_id, batch_size)
+    pending = [
+        (start, stop)
+        for start, stop in batch_ranges(dataset, batch_size, budget)
+        if start not in completed
+    ]
+    if not pending:
+        print(
+            f"Run {run_id} already processed all examples for batch size {batch_size}"
+        )
+        return
 
-    with open(DATASET_PATH) as f:
-        dataset: list[DatasetEntry] = json.load(f)
+    print(
+        f"Processing run {run_id} batch size {batch_size}: {len(pending)} pending "
+        f"batches, concurrency {concurrency}"
+    )
 
-    for batch_size in args.batch_sizes:
-        endpoint = "parse_prediction_batch" if batch_size > 1 else "parse_prediction"
-        last_example = latest_example_id(run_id, batch_size)
-        start_index = (last_example + 1) if last_example is not None else 0
-        if start_index >= len(dataset):
-            print(
-                f"Run {run_id} already processed all examples for batch size {batch_size}"
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+    async with (
+        httpx.AsyncClient(timeout=300, limits=limits) as client,
+        asyncio.TaskGroup() as group,
+    ):
+        tasks = [
+            group.create_task(
+                process_batch(
+                    client,
+                    semaphore,
+                    run_id=run_id,
+                    batch_id=start,
+                    batch_size=batch_size,
+                    batch=dataset[start:stop],
+                )
             )
-            continue
+            for start, stop in pending
+        ]
 
+    failed = sum(not task.result() for task in tasks)
+    if failed:
         print(
-            f"Processing run {run_id} batch size {batch_size} starting from example {start_index}"
+            f"Run {run_id} batch size {batch_size}: {failed} of {len(pending)} "
+            f"batches failed; rerun with --run-id {run_id} to retry them"
         )
+        return
+    print(f"Completed run {run_id} for batch size {batch_size}")
 
-        for i in range(start_index, len(dataset), batch_size):
-            print(f"Processing batch {i}...")
-            batch = dataset[i : i + batch_size]
-            input_batch = format_api_input(batch)
 
-            if endpoint == "parse_prediction":
-                payload = input_batch[0]
-            else:
-                payload = {"items": input_batch}
+def main():
+    init_results_db()
+    args = parse_args()
+    run_id = args.run_id or uuid4()
 
-            predictions = fetch_predictions(endpoint, payload)
+    with open(DATASET_PATH) as f:
+        dataset: list[DatasetEntry] = json.load(f)
 
-            log_prediction_results(
-                run_id=run_id,
-                batch_id=i,
-                batch_size=batch_size,
-                predictions=predictions,
+    for batch_size in args.batch_sizes:
+        budget = None
+        if args.token_budget is not None:
+            budget = TokenBudget(
+                max_input_tokens=config.batch_max_input_tokens,
+                max_output_tokens=args.token_budget,
+                max_items=batch_size,
+                latency_target_seconds=args.latency_target,
             )
-
-        print(f"Completed run {run_id} for batch size {batch_size}")
+        asyncio.run(
+            process_batch_size(
+                run_id, batch_size, dataset, max(args.concurrency, 1), budget
+            )
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+from src import config
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Cold import time of the API, from `python -X importtime`. "
+            "Exits with an error when the median exceeds the budget."
+        )
+    )
+    parser.add_argument("--module", default="src.main")
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=5,
+        help="Fresh interpreters to time; the median is reported.",
+    )
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=config.import_budget_ms,
+        help=(
+            "Fail when the median cumulative import time is above this "
+            "(default: config.import_budget_ms)."
+        ),
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=15,
+        help="Slowest top-level imports of the module to list.",
+    )
+    return parser.parse_args()
+
+
+def time_import(module: str) -> dict[str, int]:
+    """Cumulative import time in microseconds of `module` and of each module
+    it imports directly, measured in a fresh interpreter."""
+
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+        check=True,
+    )
+    # A module's line comes after the lines of everything it imported, which
+    # are indented two more spaces.
+    children: dict[str, int] = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match is None:
+            continue
+        indent, name, cumulative = (
+            len(match.group(3)),
+            match.group(4),
+            int(match.group(2)),
+        )
+        if indent == 3:
+            children[name] = cumulative
+        elif indent == 1:
+            if name == module:
+                return {**children, module: cumulative}
+            children = {}
+    raise RuntimeError(f"{module} is missing from the importtime output")
+
+
+def main() -> None:
+    args = parse_args()
+    runs = [time_import(args.module) for _ in range(args.runs)]
+    totals = [run[args.module] / 1000 for run in runs]
+    median = statistics.median(totals)
+
+    children = {name for run in runs for name in run if name != args.module}
+    slowest = sorted(
+        (
+            (statistics.median(run.get(name, 0) for run in runs) / 1000, name)
+            for name in children
+        ),
+        reverse=True,
+    )
+    print(
+        f"import {args.module}: median {median:.0f} ms, "
+        f"min {min(totals):.0f} ms, max {max(totals):.0f} ms ({args.runs} runs)"
+    )
+    for elapsed, name in slowest[: args.top]:
+        print(f"{elapsed:8.1f} ms  {name}")
+
+    if median > args.budget_ms:
+        raise SystemExit(
+            f"import {args.module} took {median:.0f} ms, "
+            f"over the {args.budget_ms:.0f} ms budget"
+        )
+
+
+if __name__ == "__main__":
+    main()
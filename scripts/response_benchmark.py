@@ -0,0 +1,157 @@
+import argparse
+import json
+from collections.abc import Callable, Coroutine
+from time import perf_counter
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from src import config
+from src.helpers import infer_target_type, to_response
+from src.main import json_response
+from src.models import (
+    ParsedPrediction,
+    ParsedPredictionResponse,
+    response_adapter,
+    response_list_adapter,
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Cost of turning parsed predictions into a response body: FastAPI's "
+            "response_model validation and encoding against the single "
+            "serialization the endpoints now do."
+        )
+    )
+    parser.add_argument(
+        "--batch-sizes",
+        nargs="+",
+        type=int,
+        default=[1, 16],
+        help="Predictions per response; 1 goes through the single endpoint path.",
+    )
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=200,
+        help="Passes over the dataset per case; the fastest one is reported.",
+    )
+    return parser.parse_args()
+
+
+def load_parsed() -> list[ParsedPrediction]:
+    with open(config.dataset_file) as f:
+        dataset = json.load(f)
+    return [
+        ParsedPrediction.model_validate(
+            {
+                "extracted_value": entry.get("extracted_value"),
+                "bear_bull": entry["bear_bull"],
+                "timeframe": entry["timeframe"],
+                "notes": entry["notes"],
+            }
+        )
+        for entry in dataset
+    ]
+
+
+def validated_response(
+    parsed: ParsedPrediction, prediction_id: str
+) -> ParsedPredictionResponse:
+    """`to_response` as it was, running every field through validation."""
+    return ParsedPredictionResponse(
+        id=prediction_id,
+        target_type=infer_target_type(parsed),
+        extracted_value=parsed.extracted_value,
+        bear_bull=parsed.bear_bull,
+        timeframe=parsed.timeframe,
+        notes=parsed.notes,
+    )
+
+
+def run_to_completion(coroutine: Coroutine):
+    """Result of a coroutine that never suspends, without an event loop."""
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("coroutine suspended")
+
+
+def fastapi_body(many: bool) -> Callable[[list], bytes]:
+    """The body FastAPI renders for an endpoint returning validated models."""
+
+    field = create_model_field(
+        name="Response",
+        type_=list[ParsedPredictionResponse] if many else ParsedPredictionResponse,
+        mode="serialization",
+    )
+
+    def render(batch: list[tuple[ParsedPrediction, str]]) -> bytes:
+        models = [
+            validated_response(parsed, prediction_id) for parsed, prediction_id in batch
+        ]
+        content = run_to_completion(
+            serialize_response(
+                field=field, response_content=models if many else models[0]
+            )
+        )
+        return JSONResponse(content).body
+
+    return render
+
+
+def single_body(batch: list[tuple[ParsedPrediction, str]]) -> bytes:
+    (parsed, prediction_id) = batch[0]
+    return json_response(
+        response_adapter.dump_json(to_response(parsed, prediction_id))
+    ).body
+
+
+def batch_body(batch: list[tuple[ParsedPrediction, str]]) -> bytes:
+    return json_response(
+        response_list_adapter.dump_json(
+            [to_response(parsed, prediction_id) for parsed, prediction_id in batch]
+        )
+    ).body
+
+
+def main() -> None:
+    args = parse_args()
+    parsed = load_parsed()
+    print(f"{len(parsed)} predictions, best of {args.rounds} rounds")
+    print(f"{'batch':>5}  {'fastapi/s':>10}  {'fast/s':>10}  {'speedup':>7}")
+
+    for batch_size in args.batch_sizes:
+        items = [(prediction, str(index)) for index, prediction in enumerate(parsed)]
+        batches = [
+            items[start : start + batch_size]
+            for start in range(0, len(items), batch_size)
+        ]
+        before = fastapi_body(many=batch_size > 1)
+        after = batch_body if batch_size > 1 else single_body
+
+        for batch in batches:
+            if before(batch) != after(batch):
+                raise SystemExit(f"Bodies differ for batch {batch[0][1]}")
+
+        best = [float("inf"), float("inf")]
+        for _ in range(args.rounds):
+            for index, render in enumerate((before, after)):
+                started = perf_counter()
+                for batch in batches:
+                    render(batch)
+                best[index] = min(best[index], perf_counter() - started)
+
+        before_rate, after_rate = (len(parsed) / elapsed for elapsed in best)
+        print(
+            f"{batch_size:>5}  {before_rate:>10.0f}  {after_rate:>10.0f}  "
+            f"{after_rate / before_rate:>6.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
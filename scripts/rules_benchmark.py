@@ -0,0 +1,156 @@
+import argparse
+import hashlib
+import json
+from statistics import mean
+from time import perf_counter
+
+import duckdb
+from scipy.stats import spearmanr
+
+from scripts.calculate_metrics import (
+    load_annotations,
+    serialise_extracted_value,
+    serialise_timeframe,
+)
+from src import config
+from src.helpers import to_response
+from src.models import NaturalLanguagePrediction
+from src.rules import extract
+
+# Share of the annotated posts kept out of rule development. The rules must
+# not be tuned on these posts, which is why --show-misses never lists them.
+HELD_OUT_SHARE = 0.3
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Accuracy, coverage and savings of the rule-based extractor."
+    )
+    parser.add_argument(
+        "--min-confidence",
+        type=float,
+        default=config.rules_min_confidence,
+        help="Confidence from which a rule result is used instead of the model.",
+    )
+    parser.add_argument(
+        "--show-misses",
+        action="store_true",
+        help=(
+            "Print the covered development posts whose parse differs from the "
+            "annotation; held-out posts are never shown."
+        ),
+    )
+    return parser.parse_args()
+
+
+def fetch_model_baseline() -> tuple[float | None, float | None]:
+    """Mean latency (s) and cost of successful single-post model calls."""
+    try:
+        connection = duckdb.connect(config.db_file, read_only=True)
+    except duckdb.Error:
+        return None, None
+    try:
+        return connection.execute(
+            """
+            SELECT
+                AVG(latency_ms) / 1000.0,
+                AVG(
+                    greatest(CAST(input_tokens AS BIGINT) - cache_read_tokens, 0)
+                    * input_rate
+                    + cache_read_tokens * cached_input_rate
+                    + output_tokens * output_rate
+                )
+            FROM token_usage
+            JOIN model_pricing USING (model_name)
+            WHERE batch_size = 1 AND succeeded
+            """
+        ).fetchone()
+    except duckdb.Error:
+        return None, None
+    finally:
+        connection.close()
+
+
+def split_of(entry_id: object) -> str:
+    """ "held-out" for a fixed share of the posts, chosen by a hash of the id so
+    that it does not change between runs, and "dev" for the rest."""
+    digest = hashlib.sha256(str(entry_id).encode()).digest()
+    return "held-out" if digest[0] < 256 * HELD_OUT_SHARE else "dev"
+
+
+def print_accuracy(split: str, posts: int, covered: list, show_misses: bool) -> None:
+    print(
+        f"{split}: {len(covered)} of {posts} posts covered ({len(covered) / posts:.1%})"
+    )
+    if not covered:
+        return
+
+    target_hits = value_hits = timeframe_hits = 0
+    for entry, prediction, annotation in covered:
+        target_ok = prediction.target_type == annotation.target_type
+        value_ok = serialise_extracted_value(prediction) == serialise_extracted_value(
+            annotation
+        )
+        timeframe_ok = serialise_timeframe(prediction) == serialise_timeframe(
+            annotation
+        )
+        target_hits += target_ok
+        value_hits += value_ok
+        timeframe_hits += timeframe_ok
+        if show_misses and not (target_ok and value_ok and timeframe_ok):
+            print(f"  miss id={entry['id']}: {entry['post_text']}")
+
+    print(f"  target_type accuracy: {target_hits / len(covered):.4f}")
+    print(f"  extracted_value exact_match: {value_hits / len(covered):.4f}")
+    print(f"  timeframe exact_match: {timeframe_hits / len(covered):.4f}")
+    if len(covered) > 1:
+        spearman = spearmanr(
+            [annotation.bear_bull for _, _, annotation in covered],
+            [prediction.bear_bull for _, prediction, _ in covered],
+        )
+        print(f"  bear_bull spearman: {spearman.statistic:.4f}")
+
+
+def main() -> None:
+    args = parse_args()
+    annotations = load_annotations()
+    with open(config.dataset_file) as f:
+        dataset = json.load(f)
+
+    timings = []
+    posts = {"dev": 0, "held-out": 0}
+    covered = {"dev": [], "held-out": []}
+    for entry in dataset:
+        item = NaturalLanguagePrediction(
+            post_text=entry["post_text"], post_created_at=entry["post_created_at"]
+        )
+        started = perf_counter()
+        result = extract(item)
+        timings.append(perf_counter() - started)
+        split = split_of(entry["id"])
+        posts[split] += 1
+        if result is not None and result.confidence >= args.min_confidence:
+            covered[split].append(
+                (entry, to_response(result.parsed), annotations[str(entry["id"])])
+            )
+
+    print(f"posts: {len(dataset)}")
+    print(f"rule latency mean: {mean(timings) * 1e6:.1f} us")
+    print(f"rule latency max: {max(timings) * 1e6:.1f} us")
+    print_accuracy("dev", posts["dev"], covered["dev"], args.show_misses)
+    # Only this number says how the rules do on posts they were not fitted to.
+    print_accuracy("held-out", posts["held-out"], covered["held-out"], False)
+
+    total_covered = len(covered["dev"]) + len(covered["held-out"])
+    latency, cost = fetch_model_baseline()
+    if latency is None:
+        print("no single-post model calls in token_usage to compare against")
+        return
+    print("saved against single-post model calls")
+    print(f"  latency per covered post: {latency:.2f} s")
+    print(f"  latency total: {latency * total_covered:.1f} s")
+    print(f"  cost total: ${cost * total_covered:.4f}")
+
+
+if __name__ == "__main__":
+    main()
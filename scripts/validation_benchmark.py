@@ -0,0 +1,148 @@
+import argparse
+import json
+from collections.abc import Callable
+from time import perf_counter
+
+from pydantic import TypeAdapter
+
+from src import config
+from src.helpers import to_response
+from src.models import (
+    ParsedPrediction,
+    ParsedPredictionResponse,
+    PercentageChange,
+    Range,
+    Ranking,
+    TargetPrice,
+)
+
+
+class PlainParsedPrediction(ParsedPrediction):
+    """ParsedPrediction with the undiscriminated union, as a baseline."""
+
+    extracted_value: TargetPrice | PercentageChange | Range | Ranking | None
+
+
+class PlainParsedPredictionResponse(ParsedPredictionResponse):
+    extracted_value: TargetPrice | PercentageChange | Range | Ranking | None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Validation throughput of the prediction models on the annotated "
+            "dataset, with the discriminated extracted_value union against "
+            "a plain union."
+        )
+    )
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=200,
+        help="Passes over the dataset per case; the fastest one is reported.",
+    )
+    parser.add_argument("--batch-size", type=int, default=16)
+    return parser.parse_args()
+
+
+def load_predictions() -> list[dict]:
+    with open(config.dataset_file) as f:
+        dataset = json.load(f)
+    return [
+        {
+            "extracted_value": entry.get("extracted_value"),
+            "bear_bull": entry["bear_bull"],
+            "timeframe": entry["timeframe"],
+            "notes": entry["notes"],
+        }
+        for entry in dataset
+    ]
+
+
+def cases(
+    predictions: list[dict],
+    batch_size: int,
+    parsed_model: type[ParsedPrediction],
+    response_model: type[ParsedPredictionResponse],
+) -> dict[str, tuple[Callable[[], object], int]]:
+    """Each stage that validates a prediction on its way through the API, as
+    a callable and the number of predictions one call validates."""
+
+    batch_adapter = TypeAdapter(list[parsed_model])
+    single_json = [json.dumps(prediction) for prediction in predictions]
+    batches_json = [
+        json.dumps(predictions[start : start + batch_size])
+        for start in range(0, len(predictions), batch_size)
+    ]
+    parsed = [parsed_model.model_validate(prediction) for prediction in predictions]
+    responses = [
+        to_response(prediction, str(index)).model_dump()
+        for index, prediction in enumerate(parsed)
+    ]
+
+    return {
+        "model output (single)": (
+            lambda: [parsed_model.model_validate_json(raw) for raw in single_json],
+            len(predictions),
+        ),
+        "model output (batch)": (
+            lambda: [batch_adapter.validate_json(raw) for raw in batches_json],
+            len(predictions),
+        ),
+        "to_response": (
+            lambda: [
+                response_model(
+                    target_type="none",
+                    extracted_value=prediction.extracted_value,
+                    bear_bull=prediction.bear_bull,
+                    timeframe=prediction.timeframe,
+                    notes=prediction.notes,
+                )
+                for prediction in parsed
+            ],
+            len(predictions),
+        ),
+        "response_model": (
+            lambda: [response_model.model_validate(raw) for raw in responses],
+            len(predictions),
+        ),
+    }
+
+
+def best_rates(
+    runs: list[Callable[[], object]], items: int, rounds: int
+) -> list[float]:
+    """Predictions per second of each run in its fastest round. The runs
+    alternate within a round so drift on the machine hits them alike."""
+
+    best = [float("inf")] * len(runs)
+    for _ in range(rounds):
+        for index, run in enumerate(runs):
+            started = perf_counter()
+            run()
+            best[index] = min(best[index], perf_counter() - started)
+    return [items / elapsed for elapsed in best]
+
+
+def main() -> None:
+    args = parse_args()
+    predictions = load_predictions()
+    plain = cases(
+        predictions,
+        args.batch_size,
+        PlainParsedPrediction,
+        PlainParsedPredictionResponse,
+    )
+    tagged = cases(
+        predictions, args.batch_size, ParsedPrediction, ParsedPredictionResponse
+    )
+
+    print(f"{len(predictions)} predictions, best of {args.rounds} rounds")
+    print(f"{'stage':>22}  {'plain/s':>10}  {'tagged/s':>10}  {'speedup':>7}")
+    for name, (run, items) in plain.items():
+        before, after = best_rates([run, tagged[name][0]], items, args.rounds)
+        print(f"{name:>22}  {before:>10.0f}  {after:>10.0f}  {after / before:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,26 @@
 import asyncio
-from google.genai.errors import ClientError
-from pydantic_ai import Agent, RunUsage
+import sys
+from collections.abc import Coroutine
+from functools import cache
+from time import perf_counter
+from typing import Annotated, Any, Literal
+from pydantic import ValidationError, ValidatorFunctionWrapHandler, WrapValidator
+from pydantic_ai import Agent, NativeOutput, RunUsage
 from . import config
-from .helpers import build_batch_prompt, build_single_prompt
+from .cache import response_cache, response_key
+from .context_cache import context_caches
+from .helpers import build_batch_prompt, build_single_prompt, estimate_tokens
 from .models import NaturalLanguagePrediction, ParsedPrediction
+from .rate_limit import backoff_delay, rate_limiter, retry_delay_hint
+from .rules import extract
+from .metrics import (
+    model_call_duration,
+    model_tokens,
+    rate_limit_retries,
+    rate_limit_sleep,
+)
+from .telemetry import add_model_time
+from .tracing import tracer
 
 few_shot = """
 Input:
@@ -154,51 +171,389 @@ batch_instructions = (
     "is a ParsedPrediction object matching the order of the provided posts."
 )
 
-agent = Agent(
-    config.model,
-    output_type=ParsedPrediction,
-    instructions=single_instructions,
-    model_settings=config.agent_settings,
-)
 
-batch_agent = Agent(
-    config.model,
-    output_type=list[ParsedPrediction],
-    instructions=batch_instructions,
-    model_settings=config.batch_agent_settings,
-)
+def _discard_invalid(
+    value: Any, handler: ValidatorFunctionWrapHandler
+) -> ParsedPrediction | None:
+    try:
+        return handler(value)
+    except ValidationError:
+        return None
+
+
+# Same JSON schema as ParsedPrediction, but an item that fails validation
+# becomes None instead of failing (and re-running) the whole batch.
+SalvageablePrediction = Annotated[ParsedPrediction, WrapValidator(_discard_invalid)]
+
+AgentKind = Literal["single", "batch"]
+
+
+@cache
+def get_agent(kind: AgentKind, cached: bool = False) -> Agent:
+    """The agent for single or batch prompts, built on first use.
+
+    Cached variants are for runs that reference a context cache holding the
+    instructions. Gemini rejects system instructions and tools next to cached
+    content, so they have no instructions and use native structured output.
+    """
+    if kind == "single":
+        output_type = ParsedPrediction
+        instructions, settings = single_instructions, config.agent_settings
+    else:
+        output_type = (
+            list[SalvageablePrediction]
+            if config.batch_salvage_enabled
+            else list[ParsedPrediction]
+        )
+        instructions, settings = batch_instructions, config.batch_agent_settings
+
+    if cached:
+        return Agent(
+            config.get_model(),
+            output_type=NativeOutput(output_type),
+            model_settings=settings,
+        )
+    return Agent(
+        config.get_model(),
+        output_type=output_type,
+        instructions=instructions,
+        model_settings=settings,
+    )
+
+
+def warm_up() -> None:
+    """Builds the model and agents ahead of the first request."""
+    for kind in ("single", "batch"):
+        get_agent(kind)
+        if config.context_cache_enabled:
+            get_agent(kind, cached=True)
+
+
+def _client_error(exc: Exception) -> tuple[int, str] | None:
+    """Code and status of a Gemini client error, None for any other error.
+
+    google.genai is only imported with the Google model, so its error class
+    is looked up rather than imported here.
+    """
+    errors = sys.modules.get("google.genai.errors")
+    if errors is None or not isinstance(exc, errors.ClientError):
+        return None
+    return exc.code, (exc.status or "").upper()
+
 
-RATE_LIMIT_DELAY_SECONDS = 45
 MAX_RATE_LIMIT_RETRIES = 5
 
 
-async def run_agent(
-    item: NaturalLanguagePrediction,
-) -> tuple[ParsedPrediction, RunUsage]:
-    prompt = build_single_prompt(item)
-    for _ in range(MAX_RATE_LIMIT_RETRIES):
+async def _run(kind: AgentKind, prompt: str):
+    runner = get_agent(kind)
+    if not config.context_cache_enabled:
+        return await runner.run(prompt)
+
+    if kind == "single":
+        instructions, settings = single_instructions, config.agent_settings
+    else:
+        instructions, settings = batch_instructions, config.batch_agent_settings
+
+    cache_name = await context_caches.name_for(instructions, settings)
+    if cache_name is None:
+        return await runner.run(prompt)
+
+    try:
+        return await get_agent(kind, cached=True).run(
+            prompt, model_settings={**settings, "google_cached_content": cache_name}
+        )
+    except Exception as exc:
+        error = _client_error(exc)
+        if error is None or error[0] not in (403, 404):
+            raise
+        # The cache expired or was deleted behind our back.
+        context_caches.invalidate(cache_name)
+        return await runner.run(prompt)
+
+
+async def _run_with_retries(kind: AgentKind, prompt: str):
+    instructions = single_instructions if kind == "single" else batch_instructions
+    estimated_tokens = estimate_tokens(instructions) + estimate_tokens(prompt)
+    for attempt in range(MAX_RATE_LIMIT_RETRIES):
+        waited = await rate_limiter.acquire(estimated_tokens)
+        rate_limit_sleep.inc(waited)
+        started = perf_counter()
         try:
-            response = await agent.run(prompt)
-            return response.output, response.usage()
-        except ClientError as exc:
-            if exc.code == 429 and (exc.status or "").upper() == "RESOURCE_EXHAUSTED":
-                await asyncio.sleep(RATE_LIMIT_DELAY_SECONDS)
+            with tracer.start_as_current_span(
+                "model_call",
+                attributes={
+                    "agent": kind,
+                    "attempt": attempt,
+                    "rate_limit.wait_seconds": waited,
+                },
+            ):
+                response = await _run(kind, prompt)
+            usage = response.usage()
+            model_tokens.inc(usage.input_tokens, kind, "input")
+            model_tokens.inc(usage.output_tokens, kind, "output")
+            model_tokens.inc(usage.cache_read_tokens, kind, "cache_read")
+            model_tokens.inc(usage.cache_write_tokens, kind, "cache_write")
+            return response.output, usage
+        except Exception as exc:
+            if _client_error(exc) == (429, "RESOURCE_EXHAUSTED"):
+                rate_limit_retries.inc()
+                rate_limiter.pause(
+                    backoff_delay(attempt, retry_delay_hint(exc.details))
+                )
                 continue
             raise
+        finally:
+            elapsed = perf_counter() - started
+            add_model_time(elapsed)
+            model_call_duration.observe(elapsed, kind)
     raise RuntimeError("Exceeded retry attempts due to repeated rate limits")
 
 
+class SingleFlight:
+    """Shares in-progress model calls between concurrent callers.
+
+    Each prompt key maps to a future for its parsed output while a model call
+    that covers it is running. Later callers with the same key await that
+    future instead of paying for another call. The call itself runs as its
+    own task, so a disconnecting client does not cancel it for the others.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[str, asyncio.Future[ParsedPrediction]] = {}
+
+    def pending(self, key: str) -> asyncio.Future[ParsedPrediction] | None:
+        return self._calls.get(key)
+
+    def lead(
+        self,
+        keys: list[str],
+        call: Coroutine[Any, Any, tuple[list[ParsedPrediction], RunUsage]],
+    ) -> asyncio.Task[tuple[list[ParsedPrediction], RunUsage]]:
+        """Runs `call`, whose outputs line up with `keys`, on behalf of everyone."""
+        loop = asyncio.get_running_loop()
+        futures = {}
+        for key in keys:
+            future = loop.create_future()
+            future.add_done_callback(_mark_exception_retrieved)
+            self._calls[key] = futures[key] = future
+
+        task = loop.create_task(call)
+        task.add_done_callback(lambda done: self._settle(futures, done))
+        return task
+
+    def _settle(
+        self,
+        futures: dict[str, asyncio.Future[ParsedPrediction]],
+        task: asyncio.Task[tuple[list[ParsedPrediction], RunUsage]],
+    ) -> None:
+        for key, future in futures.items():
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+        if task.cancelled():
+            for future in futures.values():
+                future.cancel()
+            return
+
+        exc = task.exception()
+        outputs = [] if exc else task.result()[0]
+        if exc is None and len(outputs) != len(futures):
+            exc = ValueError(
+                "Batch parsing returned a different number of predictions than inputs"
+            )
+        if exc is not None:
+            for future in futures.values():
+                future.set_exception(exc)
+            return
+
+        for future, output in zip(futures.values(), outputs):
+            if isinstance(output, Exception):
+                future.set_exception(output)
+            else:
+                future.set_result(output)
+
+
+def _mark_exception_retrieved(future: asyncio.Future) -> None:
+    # A failed key may have no waiters left; don't log "never retrieved".
+    if not future.cancelled():
+        future.exception()
+
+
+in_flight = SingleFlight()
+
+
+async def _call_single(
+    prompt: str, key: str
+) -> tuple[list[ParsedPrediction], RunUsage]:
+    parsed, usage = await _run_with_retries("single", prompt)
+    if config.response_cache_enabled:
+        await response_cache.set(key, parsed)
+    return [parsed], usage
+
+
+async def _parse_batch(
+    items: list[NaturalLanguagePrediction], resubmit_as_batch: bool = True
+) -> tuple[list[ParsedPrediction | Exception], RunUsage]:
+    """Parses a batch, salvaging the items the model got wrong.
+
+    An item that still fails on its own comes back as its exception, so the
+    items that did validate are returned (and cached) all the same.
+    """
+    parsed_list, usage = await _run_with_retries("batch", build_batch_prompt(items))
+    if not config.batch_salvage_enabled:
+        return parsed_list, usage
+
+    # Keep every item that validated and only pay again for the ones that
+    # are missing or invalid: first as a smaller batch, then one by one.
+    parsed_list = list(parsed_list[: len(items)])
+    parsed_list += [None] * (len(items) - len(parsed_list))
+    failed = [index for index, parsed in enumerate(parsed_list) if parsed is None]
+    if not failed:
+        return parsed_list, usage
+
+    if resubmit_as_batch and len(failed) > 1:
+        retried, retry_usage = await _parse_batch(
+            [items[index] for index in failed], resubmit_as_batch=False
+        )
+    else:
+        outcomes = await asyncio.gather(
+            *[
+                _run_with_retries("single", build_single_prompt(items[index]))
+                for index in failed
+            ],
+            return_exceptions=True,
+        )
+        retried, retry_usage = [], RunUsage()
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                retried.append(outcome)
+            elif isinstance(outcome, BaseException):
+                raise outcome
+            else:
+                retried.append(outcome[0])
+                retry_usage += outcome[1]
+
+    for index, parsed in zip(failed, retried):
+        parsed_list[index] = parsed
+    return parsed_list, usage + retry_usage
+
+
+async def _call_batch(
+    items: list[NaturalLanguagePrediction], keys: list[str]
+) -> tuple[list[ParsedPrediction | Exception], RunUsage]:
+    parsed_list, usage = await _parse_batch(items)
+    if config.response_cache_enabled and len(parsed_list) == len(keys):
+        await response_cache.set_many(
+            {
+                key: parsed
+                for key, parsed in zip(keys, parsed_list)
+                if not isinstance(parsed, Exception)
+            }
+        )
+    return parsed_list, usage
+
+
+def _parse_with_rules(item: NaturalLanguagePrediction) -> ParsedPrediction | None:
+    ruled = extract(item)
+    if ruled is None or ruled.confidence < config.rules_min_confidence:
+        return None
+    return ruled.parsed
+
+
+async def run_agent(
+    item: NaturalLanguagePrediction,
+) -> tuple[ParsedPrediction, RunUsage]:
+    if config.rules_enabled and (parsed := _parse_with_rules(item)) is not None:
+        return parsed, RunUsage()
+
+    prompt = build_single_prompt(item)
+    if not (config.response_cache_enabled or config.request_coalescing_enabled):
+        return await _run_with_retries("single", prompt)
+
+    key = response_key(prompt, single_instructions, config.agent_settings)
+    if config.response_cache_enabled:
+        cached = await response_cache.get(key)
+        if cached is not None:
+            return cached, RunUsage()
+
+    if not config.request_coalescing_enabled:
+        outputs, usage = await _call_single(prompt, key)
+        return outputs[0], usage
+
+    shared = in_flight.pending(key)
+    if shared is not None:
+        return await asyncio.shield(shared), RunUsage()
+
+    task = in_flight.lead([key], _call_single(prompt, key))
+    outputs, usage = await asyncio.shield(task)
+    return outputs[0], usage
+
+
 async def run_batch_agent(
     items: list[NaturalLanguagePrediction],
-) -> tuple[list[ParsedPrediction], RunUsage]:
-    prompt = build_batch_prompt(items)
-    for _ in range(MAX_RATE_LIMIT_RETRIES):
-        try:
-            response = await batch_agent.run(prompt)
-            return response.output, response.usage()
-        except ClientError as exc:
-            if exc.code == 429 and (exc.status or "").upper() == "RESOURCE_EXHAUSTED":
-                await asyncio.sleep(RATE_LIMIT_DELAY_SECONDS)
-                continue
-            raise
-    raise RuntimeError("Exceeded retry attempts due to repeated rate limits")
+) -> tuple[list[ParsedPrediction | Exception], RunUsage]:
+    """Parses a batch; an item that could not be parsed is its exception."""
+    if not config.rules_enabled:
+        return await _run_batch_agent(items)
+
+    ruled = [_parse_with_rules(item) for item in items]
+    remaining = [item for item, parsed in zip(items, ruled) if parsed is None]
+    if not remaining:
+        return ruled, RunUsage()
+
+    parsed_list, usage = await _run_batch_agent(remaining)
+    if len(parsed_list) != len(remaining):
+        return parsed_list, usage
+    model_outputs = iter(parsed_list)
+    return [parsed or next(model_outputs) for parsed in ruled], usage
+
+
+async def _run_batch_agent(
+    items: list[NaturalLanguagePrediction],
+) -> tuple[list[ParsedPrediction | Exception], RunUsage]:
+    if not (config.response_cache_enabled or config.request_coalescing_enabled):
+        return await _parse_batch(items)
+
+    # Items are cached and coalesced individually so that a batch only pays
+    # for the distinct posts that are neither cached nor already being parsed.
+    keys = [
+        response_key(
+            build_single_prompt(item), batch_instructions, config.batch_agent_settings
+        )
+        for item in items
+    ]
+    results: dict[str, ParsedPrediction | Exception] = {}
+    if config.response_cache_enabled:
+        results = await response_cache.get_many(keys)
+
+    waiting: dict[str, asyncio.Future[ParsedPrediction]] = {}
+    owned: dict[str, NaturalLanguagePrediction] = {}
+    for key, item in zip(keys, items):
+        if key in results or key in waiting or key in owned:
+            continue
+        shared = in_flight.pending(key) if config.request_coalescing_enabled else None
+        if shared is not None:
+            waiting[key] = shared
+        else:
+            owned[key] = item
+
+    usage = RunUsage()
+    if owned:
+        call = _call_batch(list(owned.values()), list(owned))
+        if config.request_coalescing_enabled:
+            outputs, usage = await asyncio.shield(in_flight.lead(list(owned), call))
+        else:
+            outputs, usage = await call
+        if len(outputs) != len(owned):
+            return outputs, usage
+        results.update(zip(owned, outputs))
+
+    shared_outputs = await asyncio.gather(
+        *map(asyncio.shield, waiting.values()), return_exceptions=True
+    )
+    for key, output in zip(waiting, shared_outputs):
+        if isinstance(output, BaseException) and not isinstance(output, Exception):
+            raise output
+        results[key] = output
+
+    return [results[key] for key in keys], usage
@@ -0,0 +1,110 @@
+import asyncio
+
+from pydantic_ai import RunUsage
+
+from . import config
+from .agent import run_agent, run_batch_agent
+from .models import NaturalLanguagePrediction, ParsedPrediction
+
+Pending = tuple[
+    NaturalLanguagePrediction, asyncio.Future[tuple[ParsedPrediction, RunUsage]]
+]
+
+
+class MicroBatcher:
+    """Groups concurrent single-item requests into batch model calls.
+
+    Items wait at most `max_wait_ms` (or until `max_batch_size` are queued)
+    and are then parsed together through `run_batch_agent`. A lone item goes
+    through `run_agent` instead, so light traffic keeps single-call latency.
+    The first caller of each batch carries its token usage; the others report
+    zero and log no usage row, so token_usage still adds up to what the model
+    billed.
+    """
+
+    def __init__(self, max_batch_size: int, max_wait_ms: float) -> None:
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._pending: list[Pending] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._dispatches: set[asyncio.Task] = set()
+
+    async def submit(
+        self, item: NaturalLanguagePrediction
+    ) -> tuple[ParsedPrediction, RunUsage]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        return await future
+
+    async def drain(self) -> None:
+        """Dispatches whatever is queued and waits for in-flight batches."""
+        self._flush()
+        if self._dispatches:
+            await asyncio.gather(*self._dispatches, return_exceptions=True)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch = [entry for entry in self._pending if not entry[1].done()]
+        self._pending = []
+        if not batch:
+            return
+
+        items = [item for item, _ in batch]
+        task = asyncio.get_running_loop().create_task(self._dispatch(items))
+        self._dispatches.add(task)
+        task.add_done_callback(self._dispatches.discard)
+        task.add_done_callback(lambda done: self._settle(batch, done))
+
+    async def _dispatch(
+        self, items: list[NaturalLanguagePrediction]
+    ) -> tuple[list[ParsedPrediction | Exception], RunUsage]:
+        if len(items) == 1:
+            parsed, usage = await run_agent(items[0])
+            return [parsed], usage
+        return await run_batch_agent(items)
+
+    def _settle(
+        self,
+        batch: list[Pending],
+        task: asyncio.Task[tuple[list[ParsedPrediction | Exception], RunUsage]],
+    ) -> None:
+        """Hands each caller its output, or the error of the whole batch."""
+        if task.cancelled():
+            for _, future in batch:
+                future.cancel()
+            return
+
+        exc = task.exception()
+        parsed_list, usage = ([], RunUsage()) if exc else task.result()
+        if exc is None and len(parsed_list) != len(batch):
+            exc = ValueError(
+                "Batch parsing returned a different number of predictions than inputs"
+            )
+        if exc is not None:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for (_, future), parsed in zip(batch, parsed_list):
+            if future.done():
+                continue
+            if isinstance(parsed, Exception):
+                future.set_exception(parsed)
+            else:
+                future.set_result((parsed, usage))
+                usage = RunUsage()
+
+
+micro_batcher = MicroBatcher(
+    max_batch_size=config.micro_batch_max_size,
+    max_wait_ms=config.micro_batch_max_wait_ms,
+)
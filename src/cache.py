@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from time import monotonic
+from typing import TYPE_CHECKING
+
+from . import config
+from .database import fetch_cached_responses, store_cached_responses
+from .models import ParsedPrediction
+
+if TYPE_CHECKING:
+    from pydantic_ai.models.google import GoogleModelSettings
+
+
+def response_key(
+    prompt: str, instructions: str, model_settings: "GoogleModelSettings"
+) -> str:
+    """Content address of a model call: identical inputs give identical keys."""
+    material = json.dumps(
+        {
+            "model": config.model_name,
+            "instructions": instructions,
+            "settings": model_settings,
+            "prompt": prompt,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    hits: int
+    misses: int
+    memory_hits: int
+    persistent_hits: int
+    evictions: int
+    size: int
+
+
+class ResponseCache:
+    """Two-tier cache of parsed model outputs.
+
+    The first tier is an in-memory LRU bounded by `max_entries` whose entries
+    expire after `ttl_seconds`. When `persistent` is set, misses fall through
+    to the llm_response_cache DuckDB table, which survives restarts.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, persistent: bool) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persistent = persistent
+        self._entries: OrderedDict[str, tuple[float, ParsedPrediction]] = OrderedDict()
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, key: str) -> ParsedPrediction | None:
+        return (await self.get_many([key])).get(key)
+
+    async def get_many(self, keys: list[str]) -> dict[str, ParsedPrediction]:
+        found: dict[str, ParsedPrediction] = {}
+        missing: list[str] = []
+        now = monotonic()
+        for key in dict.fromkeys(keys):
+            entry = self._entries.get(key)
+            if entry is None:
+                missing.append(key)
+                continue
+
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                missing.append(key)
+                continue
+
+            self._entries.move_to_end(key)
+            found[key] = value
+        self.memory_hits += len(found)
+
+        if missing and self.persistent:
+            stored = await asyncio.to_thread(
+                fetch_cached_responses, missing, self.ttl_seconds
+            )
+            for key, output_json in stored.items():
+                value = ParsedPrediction.model_validate_json(output_json)
+                self._remember(key, value)
+                found[key] = value
+            self.persistent_hits += len(stored)
+            missing = [key for key in missing if key not in stored]
+
+        self.misses += len(missing)
+        return found
+
+    async def set(self, key: str, value: ParsedPrediction) -> None:
+        await self.set_many({key: value})
+
+    async def set_many(self, values: dict[str, ParsedPrediction]) -> None:
+        for key, value in values.items():
+            self._remember(key, value)
+
+        if values and self.persistent:
+            await asyncio.to_thread(
+                store_cached_responses,
+                config.model_name,
+                {key: value.model_dump_json() for key, value in values.items()},
+            )
+
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self.memory_hits + self.persistent_hits,
+            misses=self.misses,
+            memory_hits=self.memory_hits,
+            persistent_hits=self.persistent_hits,
+            evictions=self.evictions,
+            size=len(self._entries),
+        )
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def _remember(self, key: str, value: ParsedPrediction) -> None:
+        self._entries[key] = (monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+response_cache = ResponseCache(
+    max_entries=config.response_cache_max_entries,
+    ttl_seconds=config.response_cache_ttl_seconds,
+    persistent=config.response_cache_persistent,
+)
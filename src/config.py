@@ -1,20 +1,122 @@
-from pydantic_ai.models.google import GoogleModelSettings
-from pydantic_ai.models.google import GoogleModel
-from . import config
+import os
+from functools import cache
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    from pydantic_ai.models import Model
+    from pydantic_ai.models.google import GoogleModelSettings
+
 load_dotenv()
 
+# Held open by the API for its whole lifetime.
 db_file = "crypto_predictions.db"
+# prediction_results, written by scripts/generate_predictions while the API runs.
+results_db_file = "prediction_results.db"
+# How long to wait for another process to release a database file.
+db_lock_timeout_seconds = 10.0
 dataset_file = "data/annotated-dataset.json"
+# Incremental evaluation aggregates, kept apart so that scripts/calculate_metrics
+# only needs a read-only view of results_db_file.
+eval_db_file = "evaluation.db"
 model_name = "gemini-2.5-flash"
 
-agent_settings = GoogleModelSettings(
-    temperature=0.3, google_thinking_config={"thinking_budget": 500}
-)
+agent_settings: "GoogleModelSettings" = {
+    "temperature": 0.3,
+    "google_thinking_config": {"thinking_budget": 500},
+}
+
+batch_agent_settings: "GoogleModelSettings" = {
+    "temperature": 0.3,
+    "google_thinking_config": {"thinking_budget": 4000},
+}
+
+# "google" calls Gemini; "replay" and "fake" are offline stubs for load tests.
+model_backend = os.getenv("MODEL_BACKEND", "google")
+stub_latency_scale = float(os.getenv("STUB_LATENCY_SCALE", "1.0"))
+
+if model_backend != "google":
+    # Keeps stub calls apart from real ones in token_usage.
+    model_name = f"stub-{model_backend}"
+
+# Build the model and agents during startup instead of on the first request.
+warm_up_on_startup = False
+# Cold `import src.main` budget in ms, enforced by scripts/import_budget.py and
+# tests/test_import_budget.py.
+import_budget_ms = 2000.0
+
+
+@cache
+def get_model() -> "Model":
+    """The model behind every agent, built on first use.
+
+    The Google client stack takes about a second to import, so it is kept out
+    of import time; see scripts/import_budget.py.
+    """
+    if model_backend == "google":
+        from pydantic_ai.models.google import GoogleModel
+
+        return GoogleModel(model_name)
+
+    from .stub_model import StubBackend
+
+    return StubBackend(model_backend, stub_latency_scale).model()
+
+
+telemetry_queue_size = 10_000
+telemetry_flush_rows = 500
+telemetry_flush_interval_seconds = 1.0
+
+response_cache_enabled = True
+response_cache_max_entries = 10_000
+response_cache_ttl_seconds = 24 * 60 * 60
+response_cache_persistent = False
+
+request_coalescing_enabled = True
+
+micro_batching_enabled = False
+micro_batch_max_size = 16
+micro_batch_max_wait_ms = 25
+
+rate_limit_requests_per_minute = 1_000
+rate_limit_tokens_per_minute = 1_000_000
+rate_limit_backoff_base_seconds = 2.0
+rate_limit_backoff_max_seconds = 60.0
+
+batch_salvage_enabled = True
+
+stream_chunk_size = 16
+stream_concurrency = 4
+
+jobs_workers = 4
+jobs_batch_size = 16
+# POST /jobs only reads `path` files from inside this directory.
+jobs_input_dir = "data/jobs"
+
+context_cache_enabled = False
+context_cache_backend = "gemini"  # or "local", an in-process stand-in
+context_cache_ttl_seconds = 60 * 60
+context_cache_refresh_margin_seconds = 5 * 60
+
+batch_max_input_tokens = 16_000
+batch_max_output_tokens = 8_000
+batch_latency_target_seconds = 60.0
+batch_output_tokens_per_second = 200.0
+
+rules_enabled = False
+rules_min_confidence = 0.8
 
-batch_agent_settings = GoogleModelSettings(
-    temperature=0.3, google_thinking_config={"thinking_budget": 4000}
-)
+tracing_enabled = False
+tracing_sample_ratio = 0.05  # requests with a sampled traceparent are always kept
+tracing_exporter = "jsonl"  # or "otlp"
+tracing_jsonl_file = "traces.jsonl"
+tracing_otlp_endpoint = None  # e.g. "http://localhost:4318/v1/traces"
 
-model = GoogleModel(config.model_name)
+# USD per token. Seeds the model_pricing table, which cost_report reads.
+model_pricing = {
+    "gemini-2.5-flash": {
+        "input": 0.3 / 1_000_000,
+        "cached_input": 0.03 / 1_000_000,
+        "output": 2.5 / 1_000_000,
+    },
+}
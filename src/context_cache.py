@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import json
+import logging
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+from itertools import count
+from typing import TYPE_CHECKING, Protocol
+
+from . import config
+
+if TYPE_CHECKING:
+    from pydantic_ai.models.google import GoogleModelSettings
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend(Protocol):
+    async def create(
+        self, model: str, system_instruction: str, ttl_seconds: int
+    ) -> tuple[str, datetime]: ...
+
+    async def delete(self, name: str) -> None: ...
+
+
+class GeminiCacheBackend:
+    """Explicit context caches through the Gemini cachedContents API."""
+
+    async def create(
+        self, model: str, system_instruction: str, ttl_seconds: int
+    ) -> tuple[str, datetime]:
+        from google.genai.types import CreateCachedContentConfig
+
+        cached = await config.get_model().client.aio.caches.create(
+            model=model,
+            config=CreateCachedContentConfig(
+                system_instruction=system_instruction,
+                ttl=f"{ttl_seconds}s",
+                display_name="parse-crypto-predictions",
+            ),
+        )
+        expires_at = cached.expire_time or datetime.now(UTC) + timedelta(
+            seconds=ttl_seconds
+        )
+        return cached.name, expires_at
+
+    async def delete(self, name: str) -> None:
+        await config.get_model().client.aio.caches.delete(name=name)
+
+
+class LocalCacheBackend:
+    """In-process stand-in for the cachedContents API, for offline runs."""
+
+    def __init__(self) -> None:
+        self.caches: dict[str, tuple[str, str, datetime]] = {}
+        self.created = 0
+        self.deleted = 0
+        self._ids = count(1)
+
+    async def create(
+        self, model: str, system_instruction: str, ttl_seconds: int
+    ) -> tuple[str, datetime]:
+        name = f"cachedContents/local-{next(self._ids)}"
+        expires_at = datetime.now(UTC) + timedelta(seconds=ttl_seconds)
+        self.caches[name] = (model, system_instruction, expires_at)
+        self.created += 1
+        return name, expires_at
+
+    async def delete(self, name: str) -> None:
+        if self.caches.pop(name, None) is not None:
+            self.deleted += 1
+
+
+@dataclass
+class CachedPrefix:
+    name: str
+    expires_at: datetime
+
+
+@dataclass
+class ContextCacheStats:
+    active: int
+    created: int
+    refreshed: int
+    failures: int
+
+
+class ContextCacheManager:
+    """Keeps one cached instructions prefix alive per model and settings.
+
+    `name_for` returns the cache to reference on a run, creating it on first
+    use and replacing it once it is within `refresh_margin_seconds` of its
+    TTL. The previous cache is left to expire rather than deleted, since
+    requests already sent may still reference it. When creation fails (e.g.
+    the prefix is under the model's minimum cacheable size) callers get None
+    and run uncached until `retry_after_seconds` have passed.
+    """
+
+    def __init__(
+        self,
+        backend: CacheBackend,
+        ttl_seconds: int,
+        refresh_margin_seconds: int,
+        retry_after_seconds: int = 300,
+    ) -> None:
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self._prefixes: dict[str, CachedPrefix] = {}
+        self._failed_until: dict[str, datetime] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._names: list[str] = []
+        self.created = 0
+        self.refreshed = 0
+        self.failures = 0
+
+    async def name_for(
+        self, instructions: str, model_settings: "GoogleModelSettings"
+    ) -> str | None:
+        key = _prefix_key(instructions, model_settings)
+        prefix = self._prefixes.get(key)
+        if prefix is not None and self._fresh(prefix):
+            return prefix.name
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            prefix = self._prefixes.get(key)
+            if prefix is not None and self._fresh(prefix):
+                return prefix.name
+
+            failed_until = self._failed_until.get(key)
+            if failed_until is not None and failed_until > datetime.now(UTC):
+                return None
+
+            try:
+                name, expires_at = await self.backend.create(
+                    config.model_name, instructions, self.ttl_seconds
+                )
+            except Exception:
+                logger.warning("Could not create context cache", exc_info=True)
+                self.failures += 1
+                self._failed_until[key] = datetime.now(UTC) + timedelta(
+                    seconds=self.retry_after_seconds
+                )
+                return None
+
+            if prefix is None:
+                self.created += 1
+            else:
+                self.refreshed += 1
+            self._prefixes[key] = CachedPrefix(name=name, expires_at=expires_at)
+            self._names.append(name)
+            return name
+
+    def invalidate(self, name: str) -> None:
+        """Forgets a cache the API no longer recognises, e.g. deleted or expired."""
+        for key, prefix in list(self._prefixes.items()):
+            if prefix.name == name:
+                del self._prefixes[key]
+
+    def stats(self) -> ContextCacheStats:
+        return ContextCacheStats(
+            active=sum(self._fresh(prefix) for prefix in self._prefixes.values()),
+            created=self.created,
+            refreshed=self.refreshed,
+            failures=self.failures,
+        )
+
+    async def close(self) -> None:
+        """Deletes every cache created by this process to stop storage billing."""
+        names, self._names = self._names, []
+        self._prefixes.clear()
+        for name in names:
+            try:
+                await self.backend.delete(name)
+            except Exception:
+                logger.warning("Could not delete context cache %s", name, exc_info=True)
+
+    def _fresh(self, prefix: CachedPrefix) -> bool:
+        margin = timedelta(seconds=self.refresh_margin_seconds)
+        return prefix.expires_at - margin > datetime.now(UTC)
+
+
+def _prefix_key(instructions: str, model_settings: "GoogleModelSettings") -> str:
+    material = json.dumps(
+        {
+            "model": config.model_name,
+            "instructions": instructions,
+            "settings": model_settings,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+def build_context_caches() -> ContextCacheManager:
+    return ContextCacheManager(
+        backend=LocalCacheBackend()
+        if config.context_cache_backend == "local"
+        else GeminiCacheBackend(),
+        ttl_seconds=config.context_cache_ttl_seconds,
+        refresh_margin_seconds=config.context_cache_refresh_margin_seconds,
+    )
+
+
+context_caches = build_context_caches()
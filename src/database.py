@@ -1,141 +1,710 @@
-from collections.abc import Mapping
+import json
+from collections.abc import Callable, Iterator, Mapping
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from threading import Lock
+from time import monotonic, sleep
 from typing import Any
 from uuid import UUID
 import duckdb
 from pydantic_ai import RunUsage
 
 from . import config
-from .models import ParsedPredictionResponse
+from .helpers import TokenBudget, estimate_item_tokens, pack_by_token_budget
+from .models import NaturalLanguagePrediction, ParsedPredictionResponse
+from .rollups import create_rollup_tables, update_usage_rollups
+
+
+def wait_for_lock[T](open_database: Callable[[], T]) -> T:
+    """Runs `open_database`, retrying while another process holds the lock.
+
+    DuckDB locks a file for the whole life of a connection; this waits out a
+    script that is finishing with the database instead of failing at once.
+    """
+    deadline = monotonic() + config.db_lock_timeout_seconds
+    while True:
+        try:
+            return open_database()
+        except duckdb.IOException as exc:
+            if "lock" not in str(exc) or monotonic() >= deadline:
+                raise
+            sleep(0.05)
+
+
+def connect(db_file: str, read_only: bool = False) -> duckdb.DuckDBPyConnection:
+    return wait_for_lock(lambda: duckdb.connect(db_file, read_only=read_only))
+
+
+class ConnectionManager:
+    """Owns a single DuckDB connection for the lifetime of the process.
+
+    Callers borrow lightweight cursors from the shared connection, which keeps
+    the database file open and locked once instead of once per statement.
+    """
+
+    def __init__(self, db_file: str) -> None:
+        self.db_file = db_file
+        self._connection: duckdb.DuckDBPyConnection | None = None
+        self._lock = Lock()
+
+    def open(self) -> duckdb.DuckDBPyConnection:
+        with self._lock:
+            if self._connection is not None:
+                return self._connection
+        # Connect outside the lock, which may mean waiting for another
+        # process, so that borrowers of an open connection are never blocked.
+        connection = connect(self.db_file)
+        with self._lock:
+            if self._connection is None:
+                self._connection, connection = connection, None
+            shared = self._connection
+        if connection is not None:
+            connection.close()
+        return shared
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    @contextmanager
+    def cursor(self) -> Iterator[duckdb.DuckDBPyConnection]:
+        """Yields a cursor on the shared connection, opening it on first use."""
+        cursor = self.open().cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+
+# The API owns `connections` for its whole lifetime. Prediction results live
+# in a database of their own, written and read only by the scripts, so that
+# they never need the lock the API holds.
+connections = ConnectionManager(config.db_file)
+results = ConnectionManager(config.results_db_file)
+
+
+@dataclass(frozen=True)
+class UsageEvent:
+    """A single token_usage row, stamped when the request finished."""
+
+    model_name: str
+    usage: RunUsage | None
+    batch_id: str
+    batch_size: int
+    latency_ms: float
+    succeeded: bool
+    timestamp: datetime = field(default_factory=lambda: datetime.now(UTC))
+
+
+@dataclass(frozen=True)
+class JobRecord:
+    """A row of the jobs table."""
+
+    job_id: UUID
+    status: str
+    source: str
+    batch_size: int
+    total_items: int
+    processed_items: int
+    failed_items: int
+    input_tokens: int
+    output_tokens: int
+    created_at: datetime
+    started_at: datetime | None
+    finished_at: datetime | None
+
+
+@dataclass(frozen=True)
+class PredictionRow:
+    """A single prediction_results row."""
+
+    run_id: UUID
+    example_id: int
+    batch_id: int
+    batch_size: int
+    raw_prediction_json: ParsedPredictionResponse | Mapping[str, Any]
 
 
 def init_db() -> None:
     """Initializes the database with the token_usage table."""
-    con = duckdb.connect(config.db_file)
-    con.execute("CREATE SEQUENCE IF NOT EXISTS token_usage_seq;")
-    con.execute(
-        """
-        CREATE TABLE IF NOT EXISTS token_usage (
-            id UBIGINT PRIMARY KEY DEFAULT nextval('token_usage_seq'),
-            timestamp TIMESTAMP WITH TIME ZONE DEFAULT now(),
-            model_name VARCHAR,
-            input_tokens UINTEGER,
-            output_tokens UINTEGER,
-            requests UINTEGER,
-            cache_read_tokens UINTEGER,
-            cache_write_tokens UINTEGER,
-            batch_id UUID,
-            batch_size UINTEGER,
-            latency_ms DOUBLE,
-            succeeded BOOLEAN
-        );
-        """
-    )
-    con.execute(
-        """
-        CREATE TABLE IF NOT EXISTS prediction_results (
-            run_id UUID,
-            example_id INTEGER,
-            batch_id int,
-            batch_size INTEGER,
-            prediction_id VARCHAR,
-            created_at TIMESTAMP DEFAULT now(),
-            raw_prediction_json JSON
-        );
-        """,
-    )
-    con.close()
+    with connections.cursor() as con:
+        con.execute("CREATE SEQUENCE IF NOT EXISTS token_usage_seq;")
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS token_usage (
+                id UBIGINT PRIMARY KEY DEFAULT nextval('token_usage_seq'),
+                timestamp TIMESTAMP WITH TIME ZONE DEFAULT now(),
+                model_name VARCHAR,
+                input_tokens UINTEGER,
+                output_tokens UINTEGER,
+                requests UINTEGER,
+                cache_read_tokens UINTEGER,
+                cache_write_tokens UINTEGER,
+                batch_id UUID,
+                batch_size UINTEGER,
+                latency_ms DOUBLE,
+                succeeded BOOLEAN
+            );
+            """
+        )
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_response_cache (
+                cache_key VARCHAR PRIMARY KEY,
+                model_name VARCHAR,
+                output_json JSON,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+            );
+            """
+        )
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id UUID PRIMARY KEY,
+                status VARCHAR,
+                source VARCHAR,
+                batch_size INTEGER,
+                total_items INTEGER,
+                processed_items INTEGER DEFAULT 0,
+                failed_items INTEGER DEFAULT 0,
+                input_tokens UBIGINT DEFAULT 0,
+                output_tokens UBIGINT DEFAULT 0,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+                started_at TIMESTAMP WITH TIME ZONE,
+                finished_at TIMESTAMP WITH TIME ZONE
+            );
+            """
+        )
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS job_inputs (
+                job_id UUID,
+                position INTEGER,
+                item_id VARCHAR,
+                post_text VARCHAR,
+                post_created_at VARCHAR
+            );
+            """
+        )
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS job_batches (
+                job_id UUID,
+                start_position INTEGER,
+                stop_position INTEGER
+            );
+            """
+        )
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS job_results (
+                job_id UUID,
+                position INTEGER,
+                prediction_id VARCHAR,
+                created_at TIMESTAMP DEFAULT now(),
+                raw_prediction_json JSON
+            );
+            """
+        )
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS job_failures (
+                job_id UUID,
+                position INTEGER,
+                error VARCHAR,
+                created_at TIMESTAMP DEFAULT now()
+            );
+            """
+        )
+        create_rollup_tables(con)
 
 
-def log_usage_event(
-    model_name: str,
-    usage: RunUsage | None,
-    batch_id: str,
-    batch_size: int,
-    latency_ms: float,
-    succeeded: bool,
-) -> None:
-    """Persist usage metrics for a single request/batch."""
-
-    con = duckdb.connect(config.db_file)
-    con.execute(
-        """
-        INSERT INTO token_usage (
-            model_name,
-            input_tokens,
-            output_tokens,
-            requests,
-            cache_read_tokens,
-            cache_write_tokens,
-            batch_id,
-            batch_size,
-            latency_ms,
-            succeeded
+def init_results_db() -> None:
+    """Creates the prediction_results table of the results database."""
+    with results.cursor() as con:
+        con.execute("CREATE SEQUENCE IF NOT EXISTS prediction_results_seq;")
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS prediction_results (
+                id BIGINT PRIMARY KEY DEFAULT nextval('prediction_results_seq'),
+                run_id UUID,
+                example_id INTEGER,
+                batch_id int,
+                batch_size INTEGER,
+                prediction_id VARCHAR,
+                created_at TIMESTAMP DEFAULT now(),
+                raw_prediction_json JSON
+            );
+            """,
         )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        [
-            model_name,
-            usage.input_tokens if usage else 0,
-            usage.output_tokens if usage else 0,
-            usage.requests if usage else 0,
-            usage.cache_read_tokens if usage else 0,
-            usage.cache_write_tokens if usage else 0,
-            batch_id,
-            batch_size,
-            latency_ms,
-            succeeded,
-        ],
+
+
+def log_usage_events(events: list[UsageEvent]) -> None:
+    """Persist many usage rows, and their rollups, in a single transaction."""
+
+    if not events:
+        return
+
+    import pandas as pd
+
+    frame = pd.DataFrame(
+        {
+            "timestamp": [event.timestamp for event in events],
+            "model_name": [event.model_name for event in events],
+            "input_tokens": [
+                event.usage.input_tokens if event.usage else 0 for event in events
+            ],
+            "output_tokens": [
+                event.usage.output_tokens if event.usage else 0 for event in events
+            ],
+            "requests": [
+                event.usage.requests if event.usage else 0 for event in events
+            ],
+            "cache_read_tokens": [
+                event.usage.cache_read_tokens if event.usage else 0 for event in events
+            ],
+            "cache_write_tokens": [
+                event.usage.cache_write_tokens if event.usage else 0 for event in events
+            ],
+            "batch_id": [event.batch_id for event in events],
+            "batch_size": [event.batch_size for event in events],
+            "latency_ms": [event.latency_ms for event in events],
+            "succeeded": [event.succeeded for event in events],
+        }
     )
-    con.close()
+
+    with connections.cursor() as con:
+        con.register("usage_rows_frame", frame)
+        con.begin()
+        try:
+            con.execute(
+                """
+                CREATE OR REPLACE TEMP TABLE usage_rows AS
+                SELECT
+                    CAST(timestamp AS TIMESTAMP WITH TIME ZONE) AS timestamp,
+                    model_name,
+                    CAST(input_tokens AS UINTEGER) AS input_tokens,
+                    CAST(output_tokens AS UINTEGER) AS output_tokens,
+                    CAST(requests AS UINTEGER) AS requests,
+                    CAST(cache_read_tokens AS UINTEGER) AS cache_read_tokens,
+                    CAST(cache_write_tokens AS UINTEGER) AS cache_write_tokens,
+                    CAST(batch_id AS UUID) AS batch_id,
+                    CAST(batch_size AS UINTEGER) AS batch_size,
+                    latency_ms,
+                    succeeded
+                FROM usage_rows_frame
+                """
+            )
+            con.execute(
+                """
+                INSERT INTO token_usage (
+                    timestamp,
+                    model_name,
+                    input_tokens,
+                    output_tokens,
+                    requests,
+                    cache_read_tokens,
+                    cache_write_tokens,
+                    batch_id,
+                    batch_size,
+                    latency_ms,
+                    succeeded
+                )
+                SELECT * FROM usage_rows
+                """
+            )
+            update_usage_rollups(con, "usage_rows")
+            con.execute("DROP TABLE usage_rows")
+        except Exception:
+            con.rollback()
+            raise
+        finally:
+            con.unregister("usage_rows_frame")
+        con.commit()
 
 
-def log_predictions(
-    run_id: UUID,
-    example_id: int,
-    batch_id: int,
-    batch_size: int,
+def _prediction_payload(
     raw_prediction_json: ParsedPredictionResponse | Mapping[str, Any],
-) -> None:
+) -> dict[str, Any]:
     if isinstance(raw_prediction_json, ParsedPredictionResponse):
-        payload = raw_prediction_json.model_dump(mode="json")
-    else:
-        payload = dict(raw_prediction_json)
-    prediction_id = payload.get("id")
-
-    con = duckdb.connect(config.db_file)
-    con.execute(
-        """
-        INSERT INTO prediction_results (
-            run_id,
-            example_id,
-            batch_id,
-            batch_size,
-            prediction_id,
-            raw_prediction_json
-        )
-        VALUES (?, ?, ?, ?, ?, ?)
-        """,
-        [run_id, example_id, batch_id, batch_size, prediction_id, payload],
+        return raw_prediction_json.model_dump(mode="json")
+    return dict(raw_prediction_json)
+
+
+# Rows take their id from a sequence as they are inserted. Holding this lock
+# until the commit makes ids become visible in increasing order, which is what
+# lets scripts/calculate_metrics use the highest id it has seen as a watermark.
+# Only one process at a time can open the results database for writing.
+_results_lock = Lock()
+
+
+def log_prediction_rows(rows: list[PredictionRow]) -> None:
+    """Persist many prediction rows in a single transaction.
+
+    Rows are appended as one DataFrame scan instead of one INSERT per row,
+    which keeps large evaluation runs (hundreds of thousands of rows) fast.
+    """
+
+    if not rows:
+        return
+
+    import pandas as pd
+
+    payloads = [_prediction_payload(row.raw_prediction_json) for row in rows]
+    frame = pd.DataFrame(
+        {
+            "run_id": [str(row.run_id) for row in rows],
+            "example_id": [row.example_id for row in rows],
+            "batch_id": [row.batch_id for row in rows],
+            "batch_size": [row.batch_size for row in rows],
+            "prediction_id": [payload.get("id") for payload in payloads],
+            "raw_prediction_json": [json.dumps(payload) for payload in payloads],
+        }
     )
-    con.close()
+
+    with _results_lock, results.cursor() as con:
+        con.register("prediction_rows_frame", frame)
+        con.begin()
+        try:
+            con.execute(
+                """
+                INSERT INTO prediction_results (
+                    run_id,
+                    example_id,
+                    batch_id,
+                    batch_size,
+                    prediction_id,
+                    raw_prediction_json
+                )
+                SELECT
+                    CAST(run_id AS UUID),
+                    example_id,
+                    batch_id,
+                    batch_size,
+                    prediction_id,
+                    CAST(raw_prediction_json AS JSON)
+                FROM prediction_rows_frame
+                """
+            )
+        except Exception:
+            con.rollback()
+            raise
+        finally:
+            con.unregister("prediction_rows_frame")
+        con.commit()
 
 
-def latest_example_id(run_id: UUID, batch_size: int) -> int | None:
-    con = duckdb.connect(config.db_file)
-    try:
-        result = con.execute(
+def completed_batch_ids(run_id: UUID, batch_size: int) -> set[int]:
+    """Batches already logged for a run; each batch is written atomically."""
+    with results.cursor() as con:
+        rows = con.execute(
             """
-            SELECT max(example_id)
+            SELECT DISTINCT batch_id
             FROM prediction_results
             WHERE run_id = ? AND batch_size = ?
             """,
             [run_id, batch_size],
+        ).fetchall()
+
+    return {int(batch_id) for (batch_id,) in rows}
+
+
+def fetch_cached_responses(
+    cache_keys: list[str], max_age_seconds: float
+) -> dict[str, str]:
+    """Returns the stored model output JSON for each key that is still fresh."""
+
+    if not cache_keys:
+        return {}
+
+    with connections.cursor() as con:
+        rows = con.execute(
+            """
+            SELECT cache_key, CAST(output_json AS VARCHAR)
+            FROM llm_response_cache
+            WHERE cache_key IN (SELECT unnest(?::VARCHAR[]))
+              AND created_at >= now() - to_seconds(?)
+            """,
+            [cache_keys, max_age_seconds],
+        ).fetchall()
+
+    return {cache_key: output_json for cache_key, output_json in rows}
+
+
+def store_cached_responses(model_name: str, outputs: Mapping[str, str]) -> None:
+    """Upserts model output JSON keyed by its response cache key."""
+
+    if not outputs:
+        return
+
+    with connections.cursor() as con:
+        con.execute(
+            """
+            INSERT OR REPLACE INTO llm_response_cache (cache_key, model_name, output_json)
+            SELECT unnest(?::VARCHAR[]), ?, CAST(unnest(?::VARCHAR[]) AS JSON)
+            """,
+            [list(outputs.keys()), model_name, list(outputs.values())],
+        )
+
+
+# Job workers run concurrently and DuckDB rejects concurrent updates of the
+# same row, so every write to the jobs table goes through this lock.
+_jobs_lock = Lock()
+
+
+def create_job(
+    job_id: UUID,
+    budget: TokenBudget,
+    items: list[NaturalLanguagePrediction] | None = None,
+    path: str | None = None,
+) -> list[tuple[int, int]]:
+    """Stores a job's inputs, inline or from a JSONL file, packed into batches.
+
+    Returns the [start, stop) position ranges of the batches, which are also
+    stored so that a resumed job runs exactly the same batches.
+    """
+
+    with connections.cursor() as con:
+        con.begin()
+        try:
+            if path is not None:
+                con.execute(
+                    """
+                    INSERT INTO job_inputs
+                    SELECT
+                        ?,
+                        CAST(row_number() OVER () - 1 AS INTEGER),
+                        id,
+                        post_text,
+                        post_created_at
+                    FROM read_json(
+                        ?,
+                        format = 'newline_delimited',
+                        columns = {
+                            id: 'VARCHAR',
+                            post_text: 'VARCHAR',
+                            post_created_at: 'VARCHAR'
+                        }
+                    )
+                    """,
+                    [job_id, path],
+                )
+            else:
+                import pandas as pd
+
+                frame = pd.DataFrame(
+                    {
+                        "position": range(len(items or [])),
+                        "item_id": [item.id for item in items or []],
+                        "post_text": [item.post_text for item in items or []],
+                        "post_created_at": [
+                            item.post_created_at.isoformat() for item in items or []
+                        ],
+                    }
+                )
+                con.register("job_inputs_frame", frame)
+                try:
+                    con.execute(
+                        """
+                        INSERT INTO job_inputs
+                        SELECT ?, position, item_id, post_text, post_created_at
+                        FROM job_inputs_frame
+                        """,
+                        [job_id],
+                    )
+                finally:
+                    con.unregister("job_inputs_frame")
+
+            texts = con.execute(
+                "SELECT post_text FROM job_inputs WHERE job_id = ? ORDER BY position",
+                [job_id],
+            ).fetchall()
+            ranges = pack_by_token_budget(
+                (estimate_item_tokens(text or "") for (text,) in texts), budget
+            )
+            if ranges:
+                con.executemany(
+                    "INSERT INTO job_batches VALUES (?, ?, ?)",
+                    [[job_id, start, stop] for start, stop in ranges],
+                )
+            con.execute(
+                """
+                INSERT INTO jobs (job_id, status, source, batch_size, total_items)
+                VALUES (?, 'queued', ?, ?, ?)
+                """,
+                [job_id, path or "inline", budget.max_items, len(texts)],
+            )
+        except Exception:
+            con.rollback()
+            raise
+        con.commit()
+
+    return ranges
+
+
+def fetch_job_inputs(
+    job_id: UUID, start: int, stop: int
+) -> list[tuple[int, str | None, str | None, str | None]]:
+    """Unprocessed (position, id, post_text, post_created_at) rows in [start, stop)."""
+
+    with connections.cursor() as con:
+        return con.execute(
+            """
+            SELECT i.position, i.item_id, i.post_text, i.post_created_at
+            FROM job_inputs i
+            ANTI JOIN job_results r USING (job_id, position)
+            ANTI JOIN job_failures f USING (job_id, position)
+            WHERE i.job_id = ? AND i.position >= ? AND i.position < ?
+            ORDER BY i.position
+            """,
+            [job_id, start, stop],
+        ).fetchall()
+
+
+def start_job(job_id: UUID) -> None:
+    with _jobs_lock, connections.cursor() as con:
+        con.execute(
+            """
+            UPDATE jobs
+            SET status = 'running', started_at = coalesce(started_at, now())
+            WHERE job_id = ? AND status IN ('queued', 'running')
+            """,
+            [job_id],
+        )
+
+
+def finish_job(job_id: UUID) -> None:
+    with _jobs_lock, connections.cursor() as con:
+        con.execute(
+            """
+            UPDATE jobs
+            SET status = 'completed', finished_at = now()
+            WHERE job_id = ?
+            """,
+            [job_id],
+        )
+
+
+def record_job_batch(
+    job_id: UUID,
+    results: list[tuple[int, ParsedPredictionResponse]],
+    failures: list[tuple[int, str]],
+    usage: RunUsage | None,
+) -> None:
+    """Stores one processed batch and advances the job's counters atomically."""
+
+    with _jobs_lock, connections.cursor() as con:
+        con.begin()
+        try:
+            if results:
+                con.executemany(
+                    """
+                    INSERT INTO job_results (
+                        job_id, position, prediction_id, raw_prediction_json
+                    )
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    [
+                        [job_id, position, response.id, response.model_dump_json()]
+                        for position, response in results
+                    ],
+                )
+            if failures:
+                con.executemany(
+                    "INSERT INTO job_failures (job_id, position, error) VALUES (?, ?, ?)",
+                    [[job_id, position, error] for position, error in failures],
+                )
+            con.execute(
+                """
+                UPDATE jobs
+                SET processed_items = processed_items + ?,
+                    failed_items = failed_items + ?,
+                    input_tokens = input_tokens + ?,
+                    output_tokens = output_tokens + ?
+                WHERE job_id = ?
+                """,
+                [
+                    len(results),
+                    len(failures),
+                    usage.input_tokens if usage else 0,
+                    usage.output_tokens if usage else 0,
+                    job_id,
+                ],
+            )
+        except Exception:
+            con.rollback()
+            raise
+        con.commit()
+
+
+def fetch_job(job_id: UUID) -> JobRecord | None:
+    with connections.cursor() as con:
+        row = con.execute(
+            """
+            SELECT
+                job_id,
+                status,
+                source,
+                batch_size,
+                total_items,
+                processed_items,
+                failed_items,
+                input_tokens,
+                output_tokens,
+                created_at,
+                started_at,
+                finished_at
+            FROM jobs
+            WHERE job_id = ?
+            """,
+            [job_id],
         ).fetchone()
-    finally:
-        con.close()
 
-    if not result:
-        return None
+    return JobRecord(*row) if row else None
+
+
+def fetch_job_results(job_id: UUID, offset: int, limit: int) -> list[str]:
+    """Raw ParsedPredictionResponse JSON of a job, in input order."""
+
+    with connections.cursor() as con:
+        rows = con.execute(
+            """
+            SELECT CAST(raw_prediction_json AS VARCHAR)
+            FROM job_results
+            WHERE job_id = ?
+            ORDER BY position
+            LIMIT ? OFFSET ?
+            """,
+            [job_id, limit, offset],
+        ).fetchall()
+
+    return [raw for (raw,) in rows]
+
+
+def pending_job_batches() -> dict[UUID, list[tuple[int, int]]]:
+    """Position ranges of the batches that unfinished jobs still have to run."""
+
+    with connections.cursor() as con:
+        rows = con.execute(
+            """
+            SELECT DISTINCT b.job_id, b.start_position, b.stop_position
+            FROM job_inputs i
+            ANTI JOIN job_results r USING (job_id, position)
+            ANTI JOIN job_failures f USING (job_id, position)
+            JOIN job_batches b
+                ON b.job_id = i.job_id
+                AND i.position >= b.start_position
+                AND i.position < b.stop_position
+            JOIN jobs j ON j.job_id = i.job_id
+            WHERE j.status IN ('queued', 'running')
+            ORDER BY b.job_id, b.start_position
+            """
+        ).fetchall()
 
-    last_example = result[0]
-    return int(last_example) if last_example is not None else None
+    pending: dict[UUID, list[tuple[int, int]]] = {}
+    for job_id, start, stop in rows:
+        pending.setdefault(job_id, []).append((start, stop))
+    return pending
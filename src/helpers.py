@@ -1,15 +1,96 @@
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+from . import config
 from .models import (
     NaturalLanguagePrediction,
     ParsedPrediction,
     ParsedPredictionResponse,
-    PercentageChange,
-    Range,
-    Ranking,
-    TargetPrice,
     TargetType,
+    extracted_value_type,
 )
+from .tracing import traced
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for Gemini text (about four characters per token)."""
+    return -(-len(text) // 4)
+
+
+# Per-post overhead of the batch prompt ("Input n:", "Post:", "Created at: ...").
+PROMPT_TOKENS_PER_ITEM = 20
+# A ParsedPrediction is ~100 tokens of JSON plus notes, which grow with the post.
+OUTPUT_TOKENS_PER_ITEM = 120
+
+
+def estimate_item_tokens(post_text: str) -> tuple[int, int]:
+    """Estimated (input, output) tokens one post adds to a batch call."""
+    input_tokens = PROMPT_TOKENS_PER_ITEM + estimate_tokens(post_text)
+    return input_tokens, OUTPUT_TOKENS_PER_ITEM + input_tokens // 4
+
+
+@dataclass(frozen=True)
+class TokenBudget:
+    max_input_tokens: int
+    max_output_tokens: int
+    max_items: int | None = None
+    latency_target_seconds: float | None = None
+    output_tokens_per_second: float = config.batch_output_tokens_per_second
+
+    @property
+    def output_limit(self) -> float:
+        # Generation time dominates latency, so the latency target caps output.
+        if self.latency_target_seconds is None:
+            return self.max_output_tokens
+        return min(
+            self.max_output_tokens,
+            self.latency_target_seconds * self.output_tokens_per_second,
+        )
+
+
+def batch_token_budget(max_items: int | None = None) -> TokenBudget:
+    return TokenBudget(
+        max_input_tokens=config.batch_max_input_tokens,
+        max_output_tokens=config.batch_max_output_tokens,
+        max_items=max_items,
+        latency_target_seconds=config.batch_latency_target_seconds,
+    )
+
+
+def pack_by_token_budget(
+    estimates: Iterable[tuple[int, int]], budget: TokenBudget
+) -> list[tuple[int, int]]:
+    """Splits items, in order, into [start, stop) ranges that fit `budget`.
+
+    `estimates` holds each item's (input, output) tokens, as returned by
+    `estimate_item_tokens`. A batch is closed when the next item would push
+    it over either token limit or `max_items`; an item that exceeds the
+    budget on its own still gets a batch of its own.
+    """
+    output_limit = budget.output_limit
+    ranges: list[tuple[int, int]] = []
+    start = 0
+    input_total = output_total = 0
+    position = -1
+    for position, (input_tokens, output_tokens) in enumerate(estimates):
+        size = position - start
+        if size and (
+            input_total + input_tokens > budget.max_input_tokens
+            or output_total + output_tokens > output_limit
+            or (budget.max_items is not None and size >= budget.max_items)
+        ):
+            ranges.append((start, position))
+            start = position
+            input_total = output_total = 0
+        input_total += input_tokens
+        output_total += output_tokens
+
+    if position >= start:
+        ranges.append((start, position + 1))
+    return ranges
 
 
+@traced("build_prompt")
 def build_single_prompt(item: NaturalLanguagePrediction) -> str:
     return (
         "Input:\n"
@@ -19,6 +100,7 @@ def build_single_prompt(item: NaturalLanguagePrediction) -> str:
     )
 
 
+@traced("build_prompt")
 def build_batch_prompt(items: list[NaturalLanguagePrediction]) -> str:
     lines = [
         "You will receive multiple inputs. Produce one JSON object per entry in a JSON array.\n",
@@ -34,18 +116,10 @@ def build_batch_prompt(items: list[NaturalLanguagePrediction]) -> str:
 
 
 def infer_target_type(parsed: ParsedPrediction) -> TargetType:
-    extracted = parsed.extracted_value
-    if isinstance(extracted, TargetPrice):
-        return "target_price"
-    if isinstance(extracted, PercentageChange):
-        return "pct_change"
-    if isinstance(extracted, Range):
-        return "range"
-    if isinstance(extracted, Ranking):
-        return "ranking"
-    return "none"
+    return extracted_value_type(parsed.extracted_value) or "none"
 
 
+@traced("to_response")
 def to_response(
     parsed: ParsedPrediction, prediction_id: str | None = None
 ) -> ParsedPredictionResponse:
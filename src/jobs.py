@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import re
+from dataclasses import asdict
+from datetime import UTC, datetime
+from pathlib import Path, PurePath
+from time import perf_counter
+from uuid import UUID, uuid4
+
+from pydantic import ValidationError
+
+from . import config
+from .agent import run_batch_agent
+from .config import model_name
+from .database import (
+    JobRecord,
+    create_job,
+    fetch_job_inputs,
+    finish_job,
+    pending_job_batches,
+    record_job_batch,
+    start_job,
+)
+from .helpers import batch_token_budget, to_response
+from .models import JobStatus, NaturalLanguagePrediction
+from .telemetry import record_usage_event
+
+logger = logging.getLogger(__name__)
+
+# Characters DuckDB's readers expand as globs, and URL or drive prefixes.
+UNSAFE_PATH = re.compile(r"[*?\[\]{}]|^[A-Za-z][A-Za-z0-9+.-]*:")
+
+
+def resolve_job_path(path: str) -> str:
+    """The file a job's `path` names inside `jobs_input_dir`.
+
+    The path comes from the client and DuckDB will read whatever it is given,
+    so only plain relative paths to an existing file in that directory are
+    accepted; anything else raises ValueError.
+    """
+    relative = PurePath(path)
+    if (
+        not path
+        or relative.is_absolute()
+        or ".." in relative.parts
+        or UNSAFE_PATH.search(path)
+    ):
+        raise ValueError(f"path must be a file name inside {config.jobs_input_dir}")
+
+    base = Path(config.jobs_input_dir)
+    candidate = base / relative
+    # Symlinks could still point outside the directory.
+    if not candidate.resolve().is_relative_to(base.resolve()):
+        raise ValueError(f"path must be a file name inside {config.jobs_input_dir}")
+    if not candidate.is_file():
+        raise ValueError(f"{path} not found in {config.jobs_input_dir}")
+    return str(candidate)
+
+
+class JobRunner:
+    """Pool of async workers that parse bulk jobs stored in DuckDB.
+
+    A job's inputs are written to job_inputs when it is submitted and packed
+    into batches of at most `batch_size` items that fit the token budget; the
+    workers then pull one batch at a time, send it through
+    `run_batch_agent` and store results, failures and token spend per batch.
+    Since progress lives in the database, unfinished jobs are picked up again
+    from their missing batches when the service restarts.
+    """
+
+    def __init__(self, workers: int, batch_size: int) -> None:
+        self.workers = workers
+        self.batch_size = batch_size
+        self._queue: asyncio.Queue[tuple[UUID, int, int]] = asyncio.Queue()
+        self._remaining: dict[UUID, int] = {}
+        self._started: set[UUID] = set()
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        pending = await asyncio.to_thread(pending_job_batches)
+        for job_id, ranges in pending.items():
+            self._enqueue(job_id, ranges)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(
+        self,
+        items: list[NaturalLanguagePrediction] | None = None,
+        path: str | None = None,
+    ) -> UUID:
+        job_id = uuid4()
+        ranges = await asyncio.to_thread(
+            create_job, job_id, batch_token_budget(self.batch_size), items, path
+        )
+        if ranges:
+            self._enqueue(job_id, ranges)
+        else:
+            await asyncio.to_thread(finish_job, job_id)
+        return job_id
+
+    def _enqueue(self, job_id: UUID, ranges: list[tuple[int, int]]) -> None:
+        self._remaining[job_id] = self._remaining.get(job_id, 0) + len(ranges)
+        for start, stop in ranges:
+            self._queue.put_nowait((job_id, start, stop))
+
+    async def _work(self) -> None:
+        while True:
+            job_id, start, stop = await self._queue.get()
+            try:
+                await self._process(job_id, start, stop)
+            except Exception:
+                # The batch stays unrecorded and the job stays running, so the
+                # batch is picked up again on the next start.
+                logger.exception("Job %s batch %d-%d failed", job_id, start, stop)
+                continue
+            finally:
+                self._queue.task_done()
+
+            self._remaining[job_id] -= 1
+            if self._remaining[job_id] == 0:
+                del self._remaining[job_id]
+                self._started.discard(job_id)
+                await asyncio.to_thread(finish_job, job_id)
+
+    async def _process(self, job_id: UUID, start: int, stop: int) -> None:
+        if job_id not in self._started:
+            self._started.add(job_id)
+            await asyncio.to_thread(start_job, job_id)
+        rows = await asyncio.to_thread(fetch_job_inputs, job_id, start, stop)
+
+        positions: list[int] = []
+        items: list[NaturalLanguagePrediction] = []
+        failures: list[tuple[int, str]] = []
+        for position, item_id, post_text, post_created_at in rows:
+            try:
+                items.append(
+                    NaturalLanguagePrediction(
+                        id=item_id, post_text=post_text, post_created_at=post_created_at
+                    )
+                )
+                positions.append(position)
+            except ValidationError as exc:
+                failures.append((position, str(exc)))
+
+        results = []
+        usage = None
+        if items:
+            batch_id = str(uuid4())
+            started = perf_counter()
+            try:
+                parsed_list, usage = await run_batch_agent(items)
+                if len(parsed_list) != len(items):
+                    raise ValueError(
+                        "Batch parsing returned a different number of predictions than inputs"
+                    )
+            except Exception as exc:
+                logger.exception("Job %s batch %d-%d failed", job_id, start, stop)
+                failures.extend((position, str(exc)) for position in positions)
+            else:
+                for position, item, parsed in zip(positions, items, parsed_list):
+                    if isinstance(parsed, Exception):
+                        failures.append((position, str(parsed)))
+                    else:
+                        results.append(
+                            (position, to_response(parsed, prediction_id=item.id))
+                        )
+            record_usage_event(
+                model_name=model_name,
+                usage=usage,
+                batch_id=batch_id,
+                batch_size=len(items),
+                latency_ms=(perf_counter() - started) * 1000,
+                succeeded=bool(results),
+            )
+
+        await asyncio.to_thread(record_job_batch, job_id, results, failures, usage)
+
+
+def job_status(record: JobRecord) -> JobStatus:
+    """Adds throughput and ETA, derived from the stored counters, to a job row."""
+    items_per_second = None
+    eta_seconds = None
+    done = record.processed_items + record.failed_items
+    if record.started_at is not None:
+        ended = record.finished_at or datetime.now(UTC)
+        elapsed = (ended - record.started_at).total_seconds()
+        if elapsed > 0 and done:
+            items_per_second = done / elapsed
+            eta_seconds = (record.total_items - done) / items_per_second
+
+    return JobStatus(
+        **asdict(record), items_per_second=items_per_second, eta_seconds=eta_seconds
+    )
+
+
+job_runner = JobRunner(workers=config.jobs_workers, batch_size=config.jobs_batch_size)
@@ -1,39 +1,135 @@
+import asyncio
+import json
 from contextlib import asynccontextmanager
+from dataclasses import asdict
+from datetime import datetime
 from time import perf_counter
-from uuid import uuid4
+from uuid import UUID, uuid4
+import duckdb
 import uvicorn
-from fastapi import FastAPI
-from .agent import run_agent, run_batch_agent
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from . import config
+from .agent import run_agent, run_batch_agent, warm_up
+from .batching import micro_batcher
+from .cache import response_cache
 from .config import model_name
-from .database import init_db, log_usage_event
-from .helpers import to_response
+from .context_cache import context_caches
+from .database import connections, fetch_job, fetch_job_results, init_db
+from .helpers import (
+    batch_token_budget,
+    estimate_item_tokens,
+    pack_by_token_budget,
+    to_response,
+)
+from .jobs import job_runner, job_status, resolve_job_path
+from .metrics import (
+    batch_size_label,
+    registry,
+    request_duration,
+    requests_in_flight,
+)
 from .models import (
     BatchPredictionRequest,
+    JobRequest,
+    JobStatus,
     NaturalLanguagePrediction,
     ParsedPredictionResponse,
+    response_adapter,
+    response_list_adapter,
 )
+from .rate_limit import rate_limiter
+from .rollups import GRANULARITIES, GROUP_COLUMNS, fetch_report
+from .streaming import iter_completed
+from .telemetry import record_usage_event, track_request, writer
+from .tracing import TracedRoute, setup_tracing, shutdown_tracing, start_request_span
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    setup_tracing()
+    connections.open()
     init_db()
-    yield
+    writer.start()
+    await job_runner.start()
+    if config.warm_up_on_startup:
+        await asyncio.to_thread(warm_up)
+    try:
+        yield
+    finally:
+        await job_runner.stop()
+        await micro_batcher.drain()
+        await context_caches.close()
+        writer.stop()
+        connections.close()
+        shutdown_tracing()
 
 
 app = FastAPI(lifespan=lifespan)
+app.router.route_class = TracedRoute
+
+
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    """Reports model time and the remaining app overhead in Server-Timing."""
+    started = perf_counter()
+    requests_in_flight.inc()
+    status = "500"
+    endpoint = "unmatched"
+    try:
+        with start_request_span(request) as span, track_request() as timings:
+            response = await call_next(request)
+            status = str(response.status_code)
+            route = request.scope.get("route")
+            if route is not None:
+                endpoint = route.path
+            if span.is_recording():
+                span.update_name(f"{request.method} {endpoint}")
+                span.set_attribute("http.response.status_code", response.status_code)
+                trace_id = span.get_span_context().trace_id
+                response.headers["X-Trace-Id"] = f"{trace_id:032x}"
+    finally:
+        requests_in_flight.dec()
+        elapsed = perf_counter() - started
+        request_duration.observe(
+            elapsed,
+            endpoint,
+            request.method,
+            status,
+            batch_size_label(timings.batch_size),
+        )
+    total_ms = elapsed * 1000
+    model_ms = timings.model_seconds * 1000
+    response.headers["Server-Timing"] = (
+        f"model;dur={model_ms:.2f}, app;dur={max(total_ms - model_ms, 0):.2f}"
+    )
+    return response
+
+
+def json_response(content: bytes) -> Response:
+    """Response for JSON that was serialized from already validated models.
+
+    FastAPI sends a returned Response as is, skipping the `response_model`
+    validation and the jsonable_encoder pass it would otherwise run on the
+    models; `response_model` then only documents the endpoint.
+    """
+    return Response(content, media_type="application/json")
 
 
 @app.post("/parse_prediction", response_model=ParsedPredictionResponse)
 async def parse_prediction(
     input: NaturalLanguagePrediction,
-) -> ParsedPredictionResponse:
+) -> Response:
     batch_id = str(uuid4())
     started = perf_counter()
     try:
-        parsed, usage = await run_agent(input)
+        if config.micro_batching_enabled:
+            parsed, usage = await micro_batcher.submit(input)
+        else:
+            parsed, usage = await run_agent(input)
     except Exception as exc:
         elapsed_ms = (perf_counter() - started) * 1000
-        log_usage_event(
+        record_usage_event(
             model_name=model_name,
             usage=None,
             batch_id=batch_id,
@@ -44,7 +140,7 @@ async def parse_prediction(
         raise exc
 
     elapsed_ms = (perf_counter() - started) * 1000
-    log_usage_event(
+    record_usage_event(
         model_name=model_name,
         usage=usage,
         batch_id=batch_id,
@@ -52,24 +148,23 @@ async def parse_prediction(
         latency_ms=elapsed_ms,
         succeeded=True,
     )
-    return to_response(parsed, prediction_id=input.id)
-
+    return json_response(
+        response_adapter.dump_json(to_response(parsed, prediction_id=input.id))
+    )
 
-@app.post("/parse_prediction_batch", response_model=list[ParsedPredictionResponse])
-async def parse_prediction_batch(
-    request: BatchPredictionRequest,
-) -> list[ParsedPredictionResponse]:
-    if not request.items:
-        return []
 
-    batch_size = len(request.items)
+async def _parse_items(
+    items: list[NaturalLanguagePrediction],
+) -> list[ParsedPredictionResponse | Exception]:
+    """Responses in input order; an item that could not be parsed is its error."""
+    batch_size = len(items)
     batch_id = str(uuid4())
     started = perf_counter()
     try:
-        parsed_list, usage = await run_batch_agent(request.items)
+        parsed_list, usage = await run_batch_agent(items)
     except Exception as exc:
         elapsed_ms = (perf_counter() - started) * 1000
-        log_usage_event(
+        record_usage_event(
             model_name=model_name,
             usage=None,
             batch_id=batch_id,
@@ -80,7 +175,7 @@ async def parse_prediction_batch(
         raise exc
 
     elapsed_ms = (perf_counter() - started) * 1000
-    log_usage_event(
+    record_usage_event(
         model_name=model_name,
         usage=usage,
         batch_id=batch_id,
@@ -95,9 +190,141 @@ async def parse_prediction_batch(
         )
 
     return [
-        to_response(parsed_item, prediction_id=source_item.id)
-        for parsed_item, source_item in zip(parsed_list, request.items)
+        parsed_item
+        if isinstance(parsed_item, Exception)
+        else to_response(parsed_item, prediction_id=source_item.id)
+        for parsed_item, source_item in zip(parsed_list, items)
+    ]
+
+
+@app.post("/parse_prediction_batch", response_model=list[ParsedPredictionResponse])
+async def parse_prediction_batch(
+    request: BatchPredictionRequest,
+) -> Response:
+    if not request.items:
+        return json_response(b"[]")
+
+    responses = await _parse_items(request.items)
+    failed = [
+        {"index": index, "id": item.id, "error": str(response)}
+        for index, (item, response) in enumerate(zip(request.items, responses))
+        if isinstance(response, Exception)
     ]
+    if failed:
+        # With the response cache on, a retry only pays for the failed items.
+        raise HTTPException(status_code=502, detail=failed)
+    return json_response(response_list_adapter.dump_json(responses))
+
+
+@app.post("/parse_prediction_stream", response_class=StreamingResponse)
+async def parse_prediction_stream(request: BatchPredictionRequest) -> StreamingResponse:
+    """Streams one ParsedPredictionResponse per line as soon as its chunk is parsed.
+
+    Chunks are packed by estimated tokens, up to `stream_chunk_size` items.
+    Lines arrive out of input order, so items without an id are tagged with
+    their position in the request. Items of a chunk that failed are reported
+    and items that could not be parsed are reported as `{"id": ..., "error": ...}`
+    lines.
+    """
+    items = [
+        item if item.id is not None else item.model_copy(update={"id": str(index)})
+        for index, item in enumerate(request.items)
+    ]
+    ranges = pack_by_token_budget(
+        [estimate_item_tokens(item.post_text) for item in items],
+        batch_token_budget(max_items=config.stream_chunk_size),
+    )
+    chunks = (items[start:stop] for start, stop in ranges)
+
+    async def lines():
+        async for chunk, result in iter_completed(
+            chunks, _parse_items, config.stream_concurrency
+        ):
+            if isinstance(result, Exception):
+                for item in chunk:
+                    yield json.dumps({"id": item.id, "error": str(result)}) + "\n"
+                continue
+            for item, response in zip(chunk, result):
+                if isinstance(response, Exception):
+                    yield json.dumps({"id": item.id, "error": str(response)}) + "\n"
+                else:
+                    yield response.model_dump_json() + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.post("/jobs", response_model=JobStatus, status_code=202)
+async def submit_job(request: JobRequest) -> JobStatus:
+    path = None
+    try:
+        if request.path is not None:
+            path = resolve_job_path(request.path)
+        job_id = await job_runner.submit(items=request.items, path=path)
+    except (ValueError, duckdb.Error) as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return await get_job(job_id)
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: UUID) -> JobStatus:
+    record = await asyncio.to_thread(fetch_job, job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_status(record)
+
+
+@app.get("/jobs/{job_id}/results", response_model=list[ParsedPredictionResponse])
+async def get_job_results(job_id: UUID, offset: int = 0, limit: int = 100) -> Response:
+    rows = await asyncio.to_thread(fetch_job_results, job_id, offset, limit)
+    # Rows hold the serialized responses, so they are sent without a round trip.
+    return json_response(f"[{','.join(rows)}]".encode())
+
+
+@app.get("/usage_report")
+async def usage_report(
+    since: datetime | None = None,
+    until: datetime | None = None,
+    granularity: str = "day",
+    group_by: str = "model,batch_size",
+) -> list[dict]:
+    """scripts/cost_report rows, read on the API's own connection.
+
+    `group_by` is a comma-separated subset of model, batch_size and bucket.
+    """
+    groups = [name for name in group_by.split(",") if name]
+    if granularity not in GRANULARITIES or not set(groups) <= set(GROUP_COLUMNS):
+        raise HTTPException(status_code=400, detail="Unknown granularity or group")
+
+    def fetch():
+        with connections.cursor() as con:
+            return fetch_report(con, since, until, granularity, groups)
+
+    return [asdict(row) for row in await asyncio.to_thread(fetch)]
+
+
+@app.get("/telemetry")
+async def telemetry_stats() -> dict[str, int]:
+    return asdict(writer.stats())
+
+
+@app.get("/cache")
+async def cache_stats() -> dict[str, int]:
+    return asdict(response_cache.stats())
+
+
+@app.get("/context_cache")
+async def context_cache_stats() -> dict[str, int]:
+    return asdict(context_caches.stats())
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/rate_limit")
+async def rate_limit_state() -> dict[str, float]:
+    return asdict(rate_limiter.snapshot())
 
 
 def main() -> None:
@@ -0,0 +1,170 @@
+from bisect import bisect_left
+from collections import defaultdict
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+BATCH_SIZE_BUCKETS = ((1, "1"), (4, "2-4"), (8, "5-8"), (16, "9-16"), (32, "17-32"))
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], **extra) -> str:
+    pairs = [*zip(names, values), *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: defaultdict[tuple[str, ...], float] = defaultdict(float)
+        if not labelnames:
+            self._values[()] = 0
+
+    def inc(self, amount: float = 1, *labels: str) -> None:
+        self._values[labels] += amount
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in list(self._values.items())
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, *labels: str) -> None:
+        self._values[labels] -= amount
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+
+class Histogram:
+    """Fixed-bucket histogram; per-bucket counts are summed only when rendered."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Per label set: [count per bucket..., +Inf count, sum]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values.setdefault(labels, [0] * (len(self.buckets) + 2))
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> list[str]:
+        lines = []
+        for labels, series in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series[:-1]):
+                cumulative += count
+                label_text = _format_labels(self.labelnames, labels, le=bound)
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {series[-1]}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Process-local metrics rendered in the Prometheus text format.
+
+    Updates are plain dict/list operations with no locks: the request path
+    runs on the event loop, and the few metrics fed from the telemetry thread
+    only ever have that one writer, so a scrape may at worst see a value a
+    moment old.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: list[Counter | Histogram] = []
+
+    def counter(
+        self, name: str, help: str, labelnames: tuple[str, ...] = ()
+    ) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+def batch_size_label(batch_size: int | None) -> str:
+    if batch_size is None:
+        return ""
+    for upper, label in BATCH_SIZE_BUCKETS:
+        if batch_size <= upper:
+            return label
+    return "33+"
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    "api_request_duration_seconds",
+    "HTTP request latency.",
+    ("endpoint", "method", "status", "batch_size"),
+)
+requests_in_flight = registry.gauge(
+    "api_requests_in_flight", "HTTP requests currently being handled."
+)
+model_call_duration = registry.histogram(
+    "model_call_duration_seconds", "Latency of a single model call.", ("agent",)
+)
+model_tokens = registry.counter(
+    "model_tokens_total", "Tokens reported by the model.", ("agent", "kind")
+)
+rate_limit_retries = registry.counter(
+    "model_rate_limit_retries_total", "Model calls retried after a 429."
+)
+rate_limit_sleep = registry.counter(
+    "model_rate_limit_sleep_seconds_total",
+    "Time spent waiting for the rate limiter before model calls.",
+)
+db_write_duration = registry.histogram(
+    "db_write_duration_seconds",
+    "Latency of telemetry writes to DuckDB.",
+    ("table",),
+    buckets=DB_BUCKETS,
+)
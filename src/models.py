@@ -1,5 +1,18 @@
-from typing import Literal
-from pydantic import BaseModel, Field, field_validator, ConfigDict
+from typing import Annotated, Any, Literal
+from uuid import UUID
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Discriminator,
+    Field,
+    GetJsonSchemaHandler,
+    Tag,
+    TypeAdapter,
+    field_validator,
+    model_validator,
+)
+from pydantic.json_schema import JsonSchemaValue
+from pydantic_core import CoreSchema
 from datetime import datetime
 from pydantic_extra_types.currency_code import ISO4217
 
@@ -69,10 +82,75 @@ class Timeframe(BaseModel):
         return v
 
 
+TargetType = Literal["target_price", "pct_change", "range", "ranking", "none"]
+
+_TARGET_TYPES: dict[type[BasePrediction], TargetType] = {
+    TargetPrice: "target_price",
+    PercentageChange: "pct_change",
+    Range: "range",
+    Ranking: "ranking",
+}
+
+
+def extracted_value_type(value: Any) -> TargetType | None:
+    """Which prediction class `value` is, read from the keys it has.
+
+    Lets the union validate against one member instead of trying all of them,
+    without adding a tag field to the schema the model fills in or to the
+    stored JSON. Ties resolve as a plain (smart mode) union would: a range
+    needs both bounds, then price wins over percentage and ranking.
+    """
+    if value is None:
+        return "none"
+    if isinstance(value, BasePrediction):
+        return _TARGET_TYPES.get(type(value))
+    if not isinstance(value, dict):
+        return None
+    if "min" in value and "max" in value:
+        return "range"
+    if "price" in value:
+        return "target_price"
+    if "percentage" in value:
+        return "pct_change"
+    if "ranking" in value:
+        return "ranking"
+    return None
+
+
+class _AnyOfJsonSchema:
+    """Renders a tagged union as the plain `anyOf` the schema always had."""
+
+    @classmethod
+    def __get_pydantic_json_schema__(
+        cls, core_schema: CoreSchema, handler: GetJsonSchemaHandler
+    ) -> JsonSchemaValue:
+        schema = handler(core_schema)
+        schema["anyOf"] = schema.pop("oneOf")
+        return schema
+
+
+ExtractedValueType = Annotated[
+    Annotated[TargetPrice, Tag("target_price")]
+    | Annotated[PercentageChange, Tag("pct_change")]
+    | Annotated[Range, Tag("range")]
+    | Annotated[Ranking, Tag("ranking")]
+    | Annotated[None, Tag("none")],
+    Discriminator(
+        extracted_value_type,
+        custom_error_type="extracted_value_type",
+        custom_error_message=(
+            "extracted_value must be null or have a price, a percentage, "
+            "min and max, or a ranking"
+        ),
+    ),
+    _AnyOfJsonSchema,
+]
+
+
 class ParsedPrediction(BaseModel):
     """A prediction related to the value of a cryptocurrency"""
 
-    extracted_value: TargetPrice | PercentageChange | Range | Ranking | None = Field(
+    extracted_value: ExtractedValueType = Field(
         description="The prediction extracted values or None"
     )
     bear_bull: int = Field(
@@ -86,10 +164,6 @@ class ParsedPrediction(BaseModel):
     notes: list[str] = Field(description="Reasoning for parsing decisions")
 
 
-TargetType = Literal["target_price", "pct_change", "range", "ranking", "none"]
-ExtractedValueType = TargetPrice | PercentageChange | Range | Ranking | None
-
-
 class ParsedPredictionResponse(BaseModel):
     """Response returned by the FastAPI endpoint"""
 
@@ -103,6 +177,11 @@ class ParsedPredictionResponse(BaseModel):
     notes: list[str]
 
 
+# Built once: a TypeAdapter compiles its validator and serializer on creation.
+response_adapter = TypeAdapter(ParsedPredictionResponse)
+response_list_adapter = TypeAdapter(list[ParsedPredictionResponse])
+
+
 examples = {
     "items": [
         {
@@ -140,3 +219,42 @@ class BatchPredictionRequest(BaseModel):
         default_factory=list,
         description="Collection of posts to parse in a single request",
     )
+
+
+class JobRequest(BaseModel):
+    items: list[NaturalLanguagePrediction] | None = Field(
+        default=None, description="Posts to parse, sent inline"
+    )
+    path: str | None = Field(
+        default=None,
+        description=(
+            "JSONL file with one post per line, relative to the server's jobs "
+            "input directory"
+        ),
+    )
+
+    @model_validator(mode="after")
+    def validate_single_source(self):
+        if (self.items is None) == (self.path is None):
+            raise ValueError("provide exactly one of 'items' or 'path'")
+        return self
+
+
+class JobStatus(BaseModel):
+    job_id: UUID
+    status: Literal["queued", "running", "completed"]
+    source: str
+    total_items: int
+    processed_items: int
+    failed_items: int
+    input_tokens: int
+    output_tokens: int
+    created_at: datetime
+    started_at: datetime | None
+    finished_at: datetime | None
+    items_per_second: float | None = Field(
+        default=None, description="Throughput since the job started"
+    )
+    eta_seconds: float | None = Field(
+        default=None, description="Estimated time until every item is processed"
+    )
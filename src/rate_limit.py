@@ -0,0 +1,140 @@
+import asyncio
+import random
+import re
+from dataclasses import dataclass
+from time import monotonic
+from typing import Any
+
+from . import config
+
+
+@dataclass
+class RateLimitState:
+    requests_per_minute: int
+    tokens_per_minute: int
+    requests_available: float
+    tokens_available: float
+    paused_for_seconds: float
+    throttled_requests: int
+    rate_limited_responses: int
+    total_wait_seconds: float
+
+
+class TokenBucket:
+    """Continuously refilling budget of `capacity` units per minute."""
+
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self.refill_per_second = per_minute / 60
+        self.available = self.capacity
+        self._updated = monotonic()
+
+    def refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self.available = min(
+            self.capacity, self.available + elapsed * self.refill_per_second
+        )
+        self._updated = now
+
+    def seconds_until(self, amount: float) -> float:
+        missing = min(amount, self.capacity) - self.available
+        return max(missing, 0) / self.refill_per_second
+
+
+class RateLimiter:
+    """Process-wide RPM/TPM budget shared by every model call.
+
+    Callers `acquire` before sending a request and wait, in arrival order,
+    until both buckets can cover it. A 429 from the API pauses everyone via
+    `pause`, so a throttled burst backs off once instead of per coroutine.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int) -> None:
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._lock = asyncio.Lock()
+        self._paused_until = 0.0
+        self.throttled_requests = 0
+        self.rate_limited_responses = 0
+        self.total_wait_seconds = 0.0
+
+    async def acquire(self, tokens: int) -> float:
+        """Waits until one request of `tokens` input tokens fits the budget."""
+        started = monotonic()
+        async with self._lock:
+            throttled = False
+            while True:
+                now = monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                wait = max(
+                    self._paused_until - now,
+                    self.requests.seconds_until(1),
+                    self.tokens.seconds_until(tokens),
+                )
+                if wait <= 0:
+                    break
+                throttled = True
+                await asyncio.sleep(wait)
+
+            self.requests.available -= 1
+            self.tokens.available -= min(tokens, self.tokens.capacity)
+
+        waited = monotonic() - started
+        if throttled:
+            self.throttled_requests += 1
+            self.total_wait_seconds += waited
+        return waited
+
+    def pause(self, seconds: float) -> None:
+        """Holds back every caller for `seconds` after a rate limit response."""
+        self.rate_limited_responses += 1
+        self._paused_until = max(self._paused_until, monotonic() + seconds)
+
+    def snapshot(self) -> RateLimitState:
+        now = monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        return RateLimitState(
+            requests_per_minute=int(self.requests.capacity),
+            tokens_per_minute=int(self.tokens.capacity),
+            requests_available=self.requests.available,
+            tokens_available=self.tokens.available,
+            paused_for_seconds=max(self._paused_until - now, 0),
+            throttled_requests=self.throttled_requests,
+            rate_limited_responses=self.rate_limited_responses,
+            total_wait_seconds=self.total_wait_seconds,
+        )
+
+
+def backoff_delay(attempt: int, retry_hint: float | None = None) -> float:
+    """Exponential backoff with full jitter, never shorter than the API hint."""
+    ceiling = min(
+        config.rate_limit_backoff_max_seconds,
+        config.rate_limit_backoff_base_seconds * 2**attempt,
+    )
+    delay = random.uniform(0, ceiling)
+    if retry_hint is not None:
+        delay = max(delay, retry_hint)
+    return delay
+
+
+def retry_delay_hint(details: Any) -> float | None:
+    """Extracts google.rpc.RetryInfo's retryDelay (e.g. "38s") from an error body."""
+    if not isinstance(details, dict):
+        return None
+
+    error = details.get("error", details)
+    for detail in error.get("details") or []:
+        if not str(detail.get("@type", "")).endswith("RetryInfo"):
+            continue
+        match = re.fullmatch(r"([\d.]+)s", str(detail.get("retryDelay", "")))
+        if match:
+            return float(match.group(1))
+    return None
+
+
+rate_limiter = RateLimiter(
+    requests_per_minute=config.rate_limit_requests_per_minute,
+    tokens_per_minute=config.rate_limit_tokens_per_minute,
+)
@@ -0,0 +1,363 @@
+import math
+from dataclasses import dataclass
+from datetime import UTC, datetime
+
+import duckdb
+
+from . import config
+
+GRANULARITIES = ("hour", "day")
+GROUP_COLUMNS = {
+    "model": "model_name",
+    "batch_size": "batch_size",
+    "bucket": "bucket_start",
+}
+QUANTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+# DDSketch-style quantile sketch: a value x > 0 falls in bin ceil(log_gamma(x))
+# and is read back as the bin's midpoint, so every quantile is within
+# SKETCH_RELATIVE_ACCURACY of a real value. Bins are plain counts, which makes
+# sketches of different buckets mergeable by summing them.
+SKETCH_RELATIVE_ACCURACY = 0.01
+SKETCH_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+SKETCH_ZERO_BIN = -32768
+SKETCH_METRICS = ("latency_ms", "input_cost", "output_cost")
+
+ROLLUP_TABLES = """
+CREATE TABLE IF NOT EXISTS model_pricing (
+    model_name VARCHAR PRIMARY KEY,
+    input_rate DOUBLE,
+    cached_input_rate DOUBLE,
+    output_rate DOUBLE
+);
+CREATE TABLE IF NOT EXISTS usage_rollups (
+    granularity VARCHAR,
+    bucket_start TIMESTAMP,
+    model_name VARCHAR,
+    batch_size UINTEGER,
+    request_count UBIGINT,
+    succeeded_count UBIGINT,
+    latency_ms_sum DOUBLE,
+    input_tokens_sum UBIGINT,
+    cached_input_tokens_sum UBIGINT,
+    output_tokens_sum UBIGINT,
+    priced_count UBIGINT,
+    uncached_input_cost_sum DOUBLE,
+    cached_input_cost_sum DOUBLE,
+    output_cost_sum DOUBLE,
+    PRIMARY KEY (granularity, bucket_start, model_name, batch_size)
+);
+CREATE TABLE IF NOT EXISTS usage_sketches (
+    granularity VARCHAR,
+    bucket_start TIMESTAMP,
+    model_name VARCHAR,
+    batch_size UINTEGER,
+    metric VARCHAR,
+    sketch_bin INTEGER,
+    count UBIGINT,
+    PRIMARY KEY (granularity, bucket_start, model_name, batch_size, metric, sketch_bin)
+);
+"""
+
+
+def sketch_bin(value: str) -> str:
+    return f"""CASE WHEN {value} > 0
+        THEN CAST(ceil(ln({value}) / {math.log(SKETCH_GAMMA)!r}) AS INTEGER)
+        ELSE {SKETCH_ZERO_BIN} END"""
+
+
+def sketch_value(sketch_bin: str) -> str:
+    """Value a bin stands for, the inverse of `sketch_bin`."""
+    return f"""CASE WHEN {sketch_bin} = {SKETCH_ZERO_BIN} THEN 0.0
+        ELSE 2 * pow({SKETCH_GAMMA!r}, {sketch_bin}) / {SKETCH_GAMMA + 1!r} END"""
+
+
+def create_rollup_tables(con: duckdb.DuckDBPyConnection) -> None:
+    con.execute(ROLLUP_TABLES)
+    # Overwrite stored rates so that a price changed in config applies to the
+    # rows logged from now on, and to all of them after a rebuild.
+    con.executemany(
+        "INSERT OR REPLACE INTO model_pricing VALUES (?, ?, ?, ?)",
+        [
+            [model_name, rates["input"], rates["cached_input"], rates["output"]]
+            for model_name, rates in config.model_pricing.items()
+        ],
+    )
+
+
+def update_usage_rollups(con: duckdb.DuckDBPyConnection, source: str) -> None:
+    """Adds the token_usage rows in `source` to the hourly and daily rollups.
+
+    Costs are priced with the model_pricing rates at the time the rows are
+    added; models without a price have no cost. Must run in the transaction
+    that inserts the rows.
+    """
+
+    priced = f"""
+        SELECT
+            bucket.granularity,
+            date_trunc(bucket.granularity, usage.timestamp AT TIME ZONE 'UTC')
+                AS bucket_start,
+            usage.model_name,
+            usage.batch_size,
+            usage.succeeded,
+            usage.latency_ms,
+            usage.input_tokens,
+            usage.cache_read_tokens,
+            usage.output_tokens,
+            -- The token columns are unsigned: subtract as BIGINT so a row
+            -- reporting more cached than input tokens can't overflow.
+            greatest(
+                CAST(usage.input_tokens AS BIGINT) - usage.cache_read_tokens, 0
+            ) * pricing.input_rate AS uncached_input_cost,
+            usage.cache_read_tokens * pricing.cached_input_rate AS cached_input_cost,
+            usage.output_tokens * pricing.output_rate AS output_cost
+        FROM {source} usage
+        CROSS JOIN (SELECT unnest({list(GRANULARITIES)!r}) AS granularity) bucket
+        LEFT JOIN model_pricing pricing USING (model_name)
+    """
+    con.execute(
+        f"""
+        INSERT INTO usage_rollups
+        SELECT
+            granularity,
+            bucket_start,
+            model_name,
+            batch_size,
+            count(*),
+            count(*) FILTER (succeeded),
+            sum(latency_ms),
+            sum(input_tokens),
+            sum(cache_read_tokens),
+            sum(output_tokens),
+            count(output_cost),
+            sum(uncached_input_cost),
+            sum(cached_input_cost),
+            sum(output_cost)
+        FROM ({priced})
+        GROUP BY ALL
+        ON CONFLICT DO UPDATE SET
+            request_count = request_count + excluded.request_count,
+            succeeded_count = succeeded_count + excluded.succeeded_count,
+            latency_ms_sum = latency_ms_sum + excluded.latency_ms_sum,
+            input_tokens_sum = input_tokens_sum + excluded.input_tokens_sum,
+            cached_input_tokens_sum
+                = cached_input_tokens_sum + excluded.cached_input_tokens_sum,
+            output_tokens_sum = output_tokens_sum + excluded.output_tokens_sum,
+            priced_count = priced_count + excluded.priced_count,
+            uncached_input_cost_sum
+                = uncached_input_cost_sum + excluded.uncached_input_cost_sum,
+            cached_input_cost_sum
+                = cached_input_cost_sum + excluded.cached_input_cost_sum,
+            output_cost_sum = output_cost_sum + excluded.output_cost_sum
+        """
+    )
+    con.execute(
+        f"""
+        INSERT INTO usage_sketches
+        SELECT
+            granularity,
+            bucket_start,
+            model_name,
+            batch_size,
+            metric,
+            {sketch_bin("value")},
+            count(*)
+        FROM (
+            SELECT
+                granularity,
+                bucket_start,
+                model_name,
+                batch_size,
+                unnest({list(SKETCH_METRICS)!r}) AS metric,
+                unnest([
+                    latency_ms,
+                    uncached_input_cost + cached_input_cost,
+                    output_cost
+                ]) AS value
+            FROM ({priced})
+        )
+        WHERE value IS NOT NULL
+        GROUP BY ALL
+        ON CONFLICT DO UPDATE SET count = count + excluded.count
+        """
+    )
+
+
+def rebuild_usage_rollups(con: duckdb.DuckDBPyConnection) -> None:
+    """Recomputes every rollup from token_usage, e.g. after a price change."""
+
+    con.begin()
+    try:
+        con.execute("DELETE FROM usage_rollups")
+        con.execute("DELETE FROM usage_sketches")
+        update_usage_rollups(con, "token_usage")
+    except Exception:
+        con.rollback()
+        raise
+    con.commit()
+
+
+def build_report_query(granularity: str, group_by: list[str]) -> str:
+    """Report over the rollups of one granularity, for a [since, until) window.
+
+    Means come from the summed columns and quantiles from the merged
+    sketches, so the cost depends on the number of buckets in the window and
+    not on the number of requests behind them.
+    """
+
+    groups = [GROUP_COLUMNS[name] for name in group_by]
+    select_groups = ", ".join(
+        column if column in groups else f"NULL AS {column}"
+        for column in GROUP_COLUMNS.values()
+    )
+    partition = ", ".join([*groups, "metric"])
+    window = f"""
+        granularity = '{granularity}'
+        AND bucket_start >= date_trunc(
+            '{granularity}', coalesce(CAST(? AS TIMESTAMP), '-infinity')
+        )
+        AND bucket_start < coalesce(CAST(? AS TIMESTAMP), 'infinity')
+    """
+    quantile_bins = ",\n".join(
+        f"min(sketch_bin) FILTER (running > {q} * (total - 1)) AS {name}"
+        for name, q in QUANTILES.items()
+    )
+    quantile = {
+        (metric, name): f"any_value({sketch_value(name)}) FILTER (metric = '{metric}')"
+        for metric in ("latency_ms", "input_cost", "output_cost")
+        for name in QUANTILES
+    }
+    return f"""
+    WITH totals AS (
+        SELECT
+            {select_groups},
+            sum(request_count) AS request_count,
+            sum(succeeded_count) AS succeeded_count,
+            sum(latency_ms_sum) AS latency_ms_sum,
+            sum(input_tokens_sum) AS input_tokens_sum,
+            sum(cached_input_tokens_sum) AS cached_input_tokens_sum,
+            sum(output_tokens_sum) AS output_tokens_sum,
+            sum(priced_count) AS priced_count,
+            sum(uncached_input_cost_sum) AS uncached_input_cost_sum,
+            sum(cached_input_cost_sum) AS cached_input_cost_sum,
+            sum(output_cost_sum) AS output_cost_sum
+        FROM usage_rollups
+        WHERE {window}
+        GROUP BY ALL
+    ),
+    bins AS (
+        SELECT {select_groups}, metric, sketch_bin, sum(count) AS count
+        FROM usage_sketches
+        WHERE {window}
+        GROUP BY ALL
+    ),
+    cumulative AS (
+        SELECT
+            *,
+            sum(count) OVER (
+                PARTITION BY {partition} ORDER BY sketch_bin
+            ) AS running,
+            sum(count) OVER (PARTITION BY {partition}) AS total
+        FROM bins
+    ),
+    quantile_bins AS (
+        SELECT {select_groups}, metric, {quantile_bins}
+        FROM cumulative
+        GROUP BY ALL
+    ),
+    quantiles AS (
+        SELECT
+            {select_groups},
+            {quantile["latency_ms", "p50"]} / 1000.0 AS latency_p50,
+            {quantile["latency_ms", "p95"]} / 1000.0 AS latency_p95,
+            {quantile["latency_ms", "p99"]} / 1000.0 AS latency_p99,
+            {quantile["input_cost", "p50"]} AS input_cost_p50,
+            {quantile["input_cost", "p95"]} AS input_cost_p95,
+            {quantile["input_cost", "p99"]} AS input_cost_p99,
+            {quantile["output_cost", "p50"]} AS output_cost_p50,
+            {quantile["output_cost", "p95"]} AS output_cost_p95,
+            {quantile["output_cost", "p99"]} AS output_cost_p99
+        FROM quantile_bins
+        GROUP BY ALL
+    )
+    SELECT
+        totals.model_name,
+        totals.batch_size,
+        totals.bucket_start,
+        request_count,
+        succeeded_count / request_count AS success_rate,
+        latency_ms_sum / request_count / 1000.0 AS latency_mean,
+        latency_p50,
+        latency_p95,
+        latency_p99,
+        input_tokens_sum / request_count AS input_tokens_mean,
+        cached_input_tokens_sum / request_count AS cached_input_tokens_mean,
+        uncached_input_cost_sum / priced_count AS uncached_input_cost_mean,
+        cached_input_cost_sum / priced_count AS cached_input_cost_mean,
+        (uncached_input_cost_sum + cached_input_cost_sum) / priced_count
+            AS input_cost_mean,
+        input_cost_p50,
+        input_cost_p95,
+        input_cost_p99,
+        output_tokens_sum / request_count AS output_tokens_mean,
+        output_cost_sum / priced_count AS output_cost_mean,
+        output_cost_p50,
+        output_cost_p95,
+        output_cost_p99
+    FROM totals
+    LEFT JOIN quantiles
+        ON totals.model_name IS NOT DISTINCT FROM quantiles.model_name
+        AND totals.batch_size IS NOT DISTINCT FROM quantiles.batch_size
+        AND totals.bucket_start IS NOT DISTINCT FROM quantiles.bucket_start
+    ORDER BY totals.bucket_start, totals.model_name, totals.batch_size
+    """
+
+
+@dataclass
+class ReportRow:
+    model_name: str | None
+    batch_size: int | None
+    bucket_start: datetime | None
+    request_count: int
+    success_rate: float | None
+    latency_mean: float | None
+    latency_p50: float | None
+    latency_p95: float | None
+    latency_p99: float | None
+    input_tokens_mean: float | None
+    cached_input_tokens_mean: float | None
+    uncached_input_cost_mean: float | None
+    cached_input_cost_mean: float | None
+    input_cost_mean: float | None
+    input_cost_p50: float | None
+    input_cost_p95: float | None
+    input_cost_p99: float | None
+    output_tokens_mean: float | None
+    output_cost_mean: float | None
+    output_cost_p50: float | None
+    output_cost_p95: float | None
+    output_cost_p99: float | None
+
+
+def fetch_report(
+    con: duckdb.DuckDBPyConnection,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    granularity: str = "day",
+    group_by: list[str] | None = None,
+) -> list[ReportRow]:
+    """Report rows for a window; naive datetimes are taken as UTC."""
+
+    if group_by is None:
+        group_by = ["model", "batch_size"]
+    window = [
+        moment.replace(tzinfo=moment.tzinfo or UTC).astimezone(UTC).replace(tzinfo=None)
+        if moment
+        else None
+        for moment in (since, until)
+    ]
+    rows = con.execute(
+        build_report_query(granularity, group_by), [*window, *window]
+    ).fetchall()
+    return [ReportRow(*row) for row in rows]
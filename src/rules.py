@@ -0,0 +1,343 @@
+import re
+from calendar import monthrange
+from dataclasses import dataclass
+from datetime import UTC, datetime
+
+from .models import (
+    NaturalLanguagePrediction,
+    ParsedPrediction,
+    PercentageChange,
+    Range,
+    Ranking,
+    TargetPrice,
+    Timeframe,
+)
+
+TICKERS = {
+    "ADA",
+    "ALGO",
+    "APT",
+    "ARB",
+    "ATOM",
+    "AVAX",
+    "BNB",
+    "BTC",
+    "DOGE",
+    "DOT",
+    "ETH",
+    "FTM",
+    "ICP",
+    "LINK",
+    "LTC",
+    "MATIC",
+    "NEAR",
+    "OP",
+    "PEPE",
+    "SAND",
+    "SHIB",
+    "SOL",
+    "SUI",
+    "TON",
+    "TRX",
+    "UNI",
+    "VET",
+    "XLM",
+    "XRP",
+}
+
+ALIASES = {
+    "algorand": "ALGO",
+    "aptos": "APT",
+    "avalanche": "AVAX",
+    "binance coin": "BNB",
+    "bitcoin": "BTC",
+    "cardano": "ADA",
+    "chainlink": "LINK",
+    "cosmos": "ATOM",
+    "doge": "DOGE",
+    "dogecoin": "DOGE",
+    "ether": "ETH",
+    "ethereum": "ETH",
+    "fantom": "FTM",
+    "internet computer": "ICP",
+    "litecoin": "LTC",
+    "near protocol": "NEAR",
+    "polkadot": "DOT",
+    "polygon": "MATIC",
+    "ripple": "XRP",
+    "shiba inu": "SHIB",
+    "solana": "SOL",
+    "uniswap": "UNI",
+    "vechain": "VET",
+}
+
+# Positive weights are bullish, negative bearish; summed and clamped. Only
+# general market slang belongs here: words picked from the annotated posts
+# would make scripts/rules_benchmark measure the dataset instead of the rules.
+LEXICON = {
+    "ath": 30,
+    "break": 15,
+    "breaking": 20,
+    "bull run": 15,
+    "bullish": 30,
+    "double": 30,
+    "doubles": 30,
+    "explode": 30,
+    "exploding": 30,
+    "moon": 35,
+    "pump": 25,
+    "pumping": 30,
+    "reach": 15,
+    "undervalued": 20,
+    "up": 20,
+    "🚀": 25,
+    "bear market": -30,
+    "bearish": -30,
+    "bleeding": -30,
+    "crash": -40,
+    "dead": -30,
+    "down": -20,
+    "drop": -20,
+    "dropping": -25,
+    "dump": -35,
+    "falling": -25,
+    "lose": -25,
+    "losing": -25,
+    "overhyped": -20,
+    "overvalued": -20,
+    "rekt": -25,
+    "retrace": -20,
+    "worthless": -40,
+    "zero": -40,
+    "📉": -25,
+}
+
+ALIAS_PATTERN = re.compile(rf"\b({'|'.join(ALIASES)})\b")
+LEXICON_PATTERNS = [
+    (re.compile(rf"(?<!\w){re.escape(term)}(?!\w)"), weight)
+    for term, weight in LEXICON.items()
+]
+
+BEARISH_MOVES = re.compile(
+    r"\b(down|lose|losing|crash|dump|drop|dropping|bleed|bleeding|retrace|fall|"
+    r"falling|dip|tank)\b"
+)
+SARCASM_MARKERS = re.compile(r"\b(lmao|lol|jk)\b|(?<!\w)/s\b")
+HEDGE_MARKERS = re.compile(r"\b(imo|maybe|might|could|if|unless|probably)\b|\?")
+TEMPORAL_CUES = re.compile(r"\b(by|before|until|within|during|throughout)\b")
+
+NUMBER = r"(\d+(?:,\d{3})*(?:\.\d+)?|\.\d+)(?:\s*([kmb])(?![a-z]))?"
+RANGE = re.compile(rf"(\$)?{NUMBER}\s*(?:-|–|to|and)\s*(\$)?{NUMBER}(\s*cents)?\b")
+PRICE = re.compile(rf"\${NUMBER}")
+PERCENT = re.compile(r"([+-]?\d+(?:\.\d+)?)\s*%")
+MULTIPLE = re.compile(r"\b(\d+)x\b")
+RANKING = re.compile(r"(?:#|\btop\s+|\brank\s+#?)(\d+)\b")
+NOT_IN_RANKING = re.compile(r"\b(out of|never|not)\b[^.]*?\btop\s+\d+")
+ZERO = re.compile(r"\b(to|going to) zero\b")
+
+SUFFIXES = {"k": 1e3, "m": 1e6, "b": 1e9}
+QUARTER_MONTHS = {1: (1, 3), 2: (4, 6), 3: (7, 9), 4: (10, 12)}
+
+
+@dataclass
+class RuleResult:
+    parsed: ParsedPrediction
+    confidence: float
+
+
+def _number(digits: str, suffix: str | None) -> float:
+    return float(digits.replace(",", "")) * SUFFIXES.get(suffix or "", 1)
+
+
+def find_assets(text: str) -> list[str]:
+    """Tickers mentioned in the post, in order of first appearance."""
+    found: list[tuple[int, str]] = []
+    for match in re.finditer(r"(\$)?\b([A-Za-z]{2,6})\b", text):
+        cashtag, word = match.groups()
+        if word.upper() in TICKERS and (cashtag or word.isupper()):
+            found.append((match.start(), word.upper()))
+    lowered = text.lower()
+    for match in ALIAS_PATTERN.finditer(lowered):
+        found.append((match.start(), ALIASES[match[1]]))
+    return list(dict.fromkeys(ticker for _, ticker in sorted(found)))
+
+
+def _candidates(lowered: str) -> dict[str, list[float | tuple[float, float]]]:
+    candidates: dict[str, list] = {"range": [], "pct_change": [], "price": []}
+    ranges_spans = []
+    for match in RANGE.finditer(lowered):
+        low_dollar, low, low_suffix, high_dollar, high, high_suffix, cents = (
+            match.groups()
+        )
+        if not (low_dollar or high_dollar or low_suffix or high_suffix or cents):
+            continue
+        low_value = _number(low, low_suffix or high_suffix)
+        high_value = _number(high, high_suffix)
+        if cents:
+            low_value, high_value = low_value / 100, high_value / 100
+        if low_value < high_value:
+            candidates["range"].append((low_value, high_value))
+            ranges_spans.append(match.span())
+
+    for match in PRICE.finditer(lowered):
+        if any(start <= match.start() < end for start, end in ranges_spans):
+            continue
+        candidates["price"].append(_number(match.group(1), match.group(2)))
+    if ZERO.search(lowered):
+        candidates["price"].append(0.0)
+
+    bearish = BEARISH_MOVES.search(lowered) is not None
+    for match in PERCENT.finditer(lowered):
+        value = float(match.group(1))
+        candidates["pct_change"].append(-abs(value) if bearish else value)
+    for match in MULTIPLE.finditer(lowered):
+        candidates["pct_change"].append((int(match.group(1)) - 1) * 100.0)
+    if re.search(r"\bdoubles?\b", lowered):
+        candidates["pct_change"].append(100.0)
+
+    return candidates
+
+
+def _add_months(moment: datetime, months: int) -> datetime:
+    month_index = moment.month - 1 + months
+    year, month = moment.year + month_index // 12, month_index % 12 + 1
+    day = min(moment.day, monthrange(year, month)[1])
+    return moment.replace(year=year, month=month, day=day)
+
+
+def _year_end(year: int) -> datetime:
+    return datetime(year, 12, 31, 23, 59, 59, tzinfo=UTC)
+
+
+def resolve_timeframe(lowered: str, created: datetime) -> Timeframe | None:
+    """Turns relative time expressions into UTC bounds from the post date."""
+    created = created.astimezone(UTC)
+
+    if match := re.search(
+        r"\b(?:within|next|in)\s+(?:the next\s+)?(\d+)\s+months?", lowered
+    ):
+        return Timeframe(
+            explicit=True, start=created, end=_add_months(created, int(match[1]))
+        )
+    if re.search(r"\bnext month\b", lowered):
+        return Timeframe(explicit=True, start=created, end=_add_months(created, 1))
+
+    if match := re.search(r"\bq([1-4])(?:\s+(\d{4}))?\b", lowered):
+        quarter = int(match[1])
+        first_month, last_month = QUARTER_MONTHS[quarter]
+        year = int(match[2]) if match[2] else created.year
+        end = datetime(
+            year, last_month, monthrange(year, last_month)[1], 23, 59, 59, tzinfo=UTC
+        )
+        if end < created:
+            end = end.replace(year=year + 1)
+        by = re.search(rf"\b(by|before|end of)\s+(end of\s+)?q{quarter}", lowered)
+        start = created if by else datetime(end.year, first_month, 1, tzinfo=UTC)
+        return Timeframe(explicit=True, start=start, end=end)
+
+    if re.search(r"\b(eoy|end of (the )?year|year end|end the year)\b", lowered):
+        return Timeframe(explicit=True, start=created, end=_year_end(created.year))
+    if match := re.search(
+        r"\b(?:by|before)\s+(?:the\s+)?(?:end of\s+)?(\d{4})\b", lowered
+    ):
+        return Timeframe(explicit=True, start=created, end=_year_end(int(match[1])))
+    if match := re.search(r"\b(?:in|throughout|during)\s+(\d{4})\b", lowered):
+        year = int(match[1])
+        start = max(created, datetime(year, 1, 1, tzinfo=UTC))
+        return Timeframe(explicit=True, start=start, end=_year_end(year))
+    if re.search(r"\bnext year\b", lowered):
+        return Timeframe(explicit=True, start=created, end=_year_end(created.year + 1))
+
+    return None
+
+
+def score_sentiment(lowered: str, extracted: object) -> int:
+    score = 0
+    for pattern, weight in LEXICON_PATTERNS:
+        if pattern.search(lowered):
+            score += weight
+    if isinstance(extracted, PercentageChange):
+        score += 30 if extracted.percentage > 0 else -30
+    if isinstance(extracted, Ranking):
+        falling = NOT_IN_RANKING.search(lowered) or BEARISH_MOVES.search(lowered)
+        score += -30 if falling else 30
+    if isinstance(extracted, Range):
+        score //= 3
+    return max(-100, min(100, score))
+
+
+def extract(item: NaturalLanguagePrediction) -> RuleResult | None:
+    """Parses simple posts without the model.
+
+    Returns None when the post has no recognisable asset or value; otherwise
+    the result carries a confidence in [0, 1] that drops with every sign of
+    ambiguity (several assets or values, hedging, sarcasm, unresolved
+    timeframes), so the caller can send doubtful posts to the model.
+    """
+    text = item.post_text
+    lowered = text.lower()
+    assets = find_assets(text)
+    if not assets:
+        return None
+    asset = assets[0]
+
+    candidates = _candidates(lowered)
+    rankings = [int(match[1]) for match in RANKING.finditer(lowered)]
+    if rankings and NOT_IN_RANKING.search(lowered):
+        rankings = [ranking + 1 for ranking in rankings]
+
+    notes = ["Parsed by the rule-based extractor", "Assumed USD currency"]
+    # Ranking, range, percentage and price in order of boldness, as the
+    # model is instructed to pick the boldest class of a post.
+    if rankings:
+        extracted = Ranking(asset=asset, ranking=rankings[0], currency="USD")
+    elif candidates["range"]:
+        low, high = candidates["range"][0]
+        extracted = Range(asset=asset, min=low, max=high, currency="USD")
+    elif candidates["pct_change"]:
+        extracted = PercentageChange(
+            asset=asset, percentage=candidates["pct_change"][0], currency="USD"
+        )
+    elif candidates["price"]:
+        extracted = TargetPrice(
+            asset=asset, price=candidates["price"][0], currency="USD"
+        )
+    else:
+        return None
+
+    confidence = 0.95
+    classes = [kind for kind, values in candidates.items() if values]
+    classes += ["ranking"] if rankings else []
+    if len(assets) > 1:
+        confidence -= 0.3
+    if len(classes) > 1:
+        confidence -= 0.3
+    if (
+        any(len(set(values)) > 1 for values in candidates.values())
+        or len(set(rankings)) > 1
+    ):
+        confidence -= 0.3
+    confidence -= 0.3 * len(SARCASM_MARKERS.findall(lowered))
+    confidence -= 0.15 * len(HEDGE_MARKERS.findall(lowered))
+
+    try:
+        timeframe = resolve_timeframe(lowered, item.post_created_at)
+    except (ValueError, OverflowError):
+        # A date datetime can't hold, e.g. "by 0000" or "within 100000
+        # months": leave the post to the model.
+        return None
+    if timeframe is None:
+        timeframe = Timeframe(explicit=False)
+        notes.append("No explicit timeframe found")
+        if TEMPORAL_CUES.search(lowered):
+            confidence -= 0.2
+    else:
+        notes.append("Timeframe resolved relative to the post date")
+
+    parsed = ParsedPrediction(
+        extracted_value=extracted,
+        bear_bull=score_sentiment(lowered, extracted),
+        timeframe=timeframe,
+        notes=notes,
+    )
+    return RuleResult(parsed=parsed, confidence=max(confidence, 0.0))
@@ -0,0 +1,41 @@
+import asyncio
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable
+from typing import TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+async def iter_completed(
+    chunks: Iterable[list[T]],
+    parse: Callable[[list[T]], Awaitable[R]],
+    concurrency: int,
+) -> AsyncIterator[tuple[list[T], R | Exception]]:
+    """Parses chunks with at most `concurrency` in flight, yielding as each ends.
+
+    Chunks are pulled lazily, so only `concurrency` chunks' results are ever
+    held at once. A failed chunk yields its exception instead of stopping the
+    stream. Closing the iterator early cancels the chunks still running.
+    """
+    chunk_iter = iter(chunks)
+    pending: dict[asyncio.Task[R], list[T]] = {}
+
+    def fill() -> None:
+        while len(pending) < concurrency:
+            chunk = next(chunk_iter, None)
+            if chunk is None:
+                return
+            pending[asyncio.ensure_future(parse(chunk))] = chunk
+
+    try:
+        fill()
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                chunk = pending.pop(task)
+                exc = task.exception()
+                yield chunk, exc if exc is not None else task.result()
+            fill()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import os
+import random
+import re
+from dataclasses import dataclass
+from typing import Any
+
+from pydantic import ValidationError
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    TextPart,
+    ToolCallPart,
+    UserPromptPart,
+)
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+from pydantic_ai.profiles import ModelProfile
+from pydantic_ai.usage import RequestUsage
+
+from .models import NaturalLanguagePrediction
+from .rules import extract
+
+# Matches the posts laid out by build_single_prompt / build_batch_prompt.
+POST_PATTERN = re.compile(r"Post: '(.*?)'\nCreated at: (\S+)", re.DOTALL)
+PREDICTION_FIELDS = ("extracted_value", "bear_bull", "timeframe", "notes")
+
+# Used until token_usage holds real calls to sample from.
+DEFAULT_LATENCY_MS = 1500.0
+DEFAULT_LATENCY_MS_PER_ITEM = 400.0
+DEFAULT_INPUT_TOKENS = 1000
+DEFAULT_OUTPUT_TOKENS_PER_ITEM = 150
+
+
+@dataclass(frozen=True)
+class CallSample:
+    batch_size: int
+    latency_ms: float
+    input_tokens: int
+    output_tokens: int
+
+
+class StubBackend:
+    """Offline stand-in for Gemini behind a pydantic-ai FunctionModel.
+
+    In "replay" mode each post is answered with the latest recorded
+    raw_prediction_json for the same dataset post, falling back to generated
+    output; "fake" mode always generates output, from the rule-based
+    extractor when it recognises the post and a neutral prediction otherwise.
+    Every call sleeps for a latency, and reports token usage, drawn from the
+    recorded token_usage rows of the closest batch size.
+    """
+
+    def __init__(
+        self, mode: str, latency_scale: float = 1.0, seed: int | None = None
+    ) -> None:
+        if mode not in ("replay", "fake"):
+            raise ValueError(f"Unknown stub backend {mode!r}")
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._random = random.Random(seed)
+        self._samples: dict[int, list[CallSample]] | None = None
+        self._recorded: dict[str, dict[str, Any]] = {}
+
+    def model(self) -> FunctionModel:
+        return FunctionModel(
+            self.respond,
+            model_name=f"stub-{self.mode}",
+            profile=ModelProfile(supports_json_schema_output=True),
+        )
+
+    async def respond(
+        self, messages: list[ModelMessage], info: AgentInfo
+    ) -> ModelResponse:
+        if self._samples is None:
+            self._load()
+
+        prompt = _last_prompt(messages)
+        outputs = [
+            self._output(text, created)
+            for text, created in POST_PATTERN.findall(prompt)
+        ]
+        if not outputs:
+            outputs = [self._output("", "")]
+        sample = self._sample(len(outputs))
+        await asyncio.sleep(sample.latency_ms * self.latency_scale / 1000)
+
+        is_batch = "Input 1:" in prompt
+        payload = {"response": outputs} if is_batch else outputs[0]
+        if info.output_tools:
+            part = ToolCallPart(info.output_tools[0].name, payload)
+        else:
+            part = TextPart(json.dumps(payload))
+        return ModelResponse(
+            parts=[part],
+            usage=RequestUsage(
+                input_tokens=sample.input_tokens, output_tokens=sample.output_tokens
+            ),
+        )
+
+    def _load(self) -> None:
+        # Imported here because config builds the model before the database
+        # module can be imported.
+        from . import config
+        from .database import connect, connections
+
+        with connections.cursor() as con:
+            usage_rows = con.execute(
+                """
+                SELECT batch_size, latency_ms, input_tokens, output_tokens
+                FROM token_usage
+                WHERE succeeded AND input_tokens > 0 AND model_name NOT LIKE 'stub-%'
+                """
+            ).fetchall()
+        recorded_rows = []
+        if self.mode == "replay" and os.path.exists(config.results_db_file):
+            results = connect(config.results_db_file, read_only=True)
+            try:
+                recorded_rows = results.execute(
+                    """
+                    SELECT prediction_id, CAST(raw_prediction_json AS VARCHAR)
+                    FROM prediction_results
+                    WHERE prediction_id IS NOT NULL
+                    QUALIFY row_number() OVER (
+                        PARTITION BY prediction_id ORDER BY created_at DESC
+                    ) = 1
+                    """
+                ).fetchall()
+            finally:
+                results.close()
+
+        samples: dict[int, list[CallSample]] = {}
+        for row in usage_rows:
+            samples.setdefault(row[0], []).append(CallSample(*row))
+        self._samples = samples
+
+        if recorded_rows:
+            with open(config.dataset_file) as f:
+                post_texts = {
+                    str(entry["id"]): entry["post_text"] for entry in json.load(f)
+                }
+            for prediction_id, raw in recorded_rows:
+                if prediction_id in post_texts:
+                    recorded = json.loads(raw)
+                    self._recorded[post_texts[prediction_id]] = {
+                        field: recorded[field] for field in PREDICTION_FIELDS
+                    }
+
+    def _output(self, post_text: str, post_created_at: str) -> dict[str, Any]:
+        recorded = self._recorded.get(post_text)
+        if recorded is not None:
+            return recorded
+
+        try:
+            ruled = extract(
+                NaturalLanguagePrediction(
+                    post_text=post_text, post_created_at=post_created_at
+                )
+            )
+        except ValidationError:
+            ruled = None
+        if ruled is not None:
+            return ruled.parsed.model_dump(mode="json")
+        return {
+            "extracted_value": None,
+            "bear_bull": 0,
+            "timeframe": {"explicit": False, "start": None, "end": None},
+            "notes": ["Generated by the stub backend"],
+        }
+
+    def _sample(self, batch_size: int) -> CallSample:
+        if not self._samples:
+            return CallSample(
+                batch_size=batch_size,
+                latency_ms=DEFAULT_LATENCY_MS
+                + DEFAULT_LATENCY_MS_PER_ITEM * (batch_size - 1),
+                input_tokens=DEFAULT_INPUT_TOKENS,
+                output_tokens=DEFAULT_OUTPUT_TOKENS_PER_ITEM * batch_size,
+            )
+
+        closest = min(self._samples, key=lambda size: abs(size - batch_size))
+        sample = self._random.choice(self._samples[closest])
+        if closest == batch_size:
+            return sample
+        scale = batch_size / closest
+        return CallSample(
+            batch_size=batch_size,
+            latency_ms=sample.latency_ms,
+            input_tokens=round(sample.input_tokens * scale),
+            output_tokens=round(sample.output_tokens * scale),
+        )
+
+
+def _last_prompt(messages: list[ModelMessage]) -> str:
+    request = messages[-1]
+    if isinstance(request, ModelRequest):
+        for part in reversed(request.parts):
+            if isinstance(part, UserPromptPart) and isinstance(part.content, str):
+                return part.content
+    return ""
@@ -0,0 +1,220 @@
+import logging
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from queue import Empty, Full, Queue
+from threading import Thread
+from time import monotonic, perf_counter
+
+from pydantic_ai import RunUsage
+
+from . import config
+from .database import (
+    PredictionRow,
+    UsageEvent,
+    log_prediction_rows,
+    log_usage_events,
+)
+from .metrics import db_write_duration
+from .tracing import traced, tracer
+
+logger = logging.getLogger(__name__)
+
+TelemetryRow = UsageEvent | PredictionRow
+
+_STOP = object()
+
+
+@dataclass
+class TelemetryStats:
+    queue_depth: int
+    written_rows: int
+    dropped_rows: int
+    failed_rows: int
+    flushes: int
+
+
+class TelemetryWriter:
+    """Write-behind buffer for token_usage and prediction_results rows.
+
+    Request handlers only enqueue rows; a dedicated thread drains the queue and
+    writes them in bulk whenever `flush_rows` accumulate or `flush_interval`
+    elapses, so DuckDB I/O never runs on the event loop. When the queue is
+    full new rows are dropped and counted rather than blocking the caller.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int,
+        flush_rows: int,
+        flush_interval_seconds: float,
+    ) -> None:
+        self.flush_rows = flush_rows
+        self.flush_interval_seconds = flush_interval_seconds
+        self._queue: Queue[TelemetryRow | object] = Queue(maxsize=max_queue_size)
+        self._thread: Thread | None = None
+        self._buffered = 0
+        self.written_rows = 0
+        self.dropped_rows = 0
+        self.failed_rows = 0
+        self.flushes = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._thread = Thread(target=self._run, name="telemetry-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Flushes everything enqueued so far and stops the writer thread."""
+        if not self.running:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def record(self, row: TelemetryRow) -> bool:
+        """Enqueues a row without blocking; returns False if it was dropped."""
+        if not self.running:
+            # Nothing will drain the queue (e.g. scripts), so write through.
+            self._flush([row])
+            return True
+
+        try:
+            self._queue.put_nowait(row)
+        except Full:
+            self.dropped_rows += 1
+            return False
+        return True
+
+    def stats(self) -> TelemetryStats:
+        return TelemetryStats(
+            queue_depth=self._queue.qsize() + self._buffered,
+            written_rows=self.written_rows,
+            dropped_rows=self.dropped_rows,
+            failed_rows=self.failed_rows,
+            flushes=self.flushes,
+        )
+
+    def _run(self) -> None:
+        pending: list[TelemetryRow] = []
+        deadline = monotonic() + self.flush_interval_seconds
+        while True:
+            try:
+                row = self._queue.get(timeout=max(deadline - monotonic(), 0))
+            except Empty:
+                row = None
+
+            if row is _STOP:
+                self._flush(pending)
+                self._buffered = 0
+                return
+
+            if row is not None:
+                pending.append(row)
+                self._buffered = len(pending)
+
+            if len(pending) >= self.flush_rows or monotonic() >= deadline:
+                self._flush(pending)
+                pending = []
+                self._buffered = 0
+                deadline = monotonic() + self.flush_interval_seconds
+
+    def _flush(self, rows: list[TelemetryRow]) -> None:
+        if not rows:
+            return
+
+        usage_events = [row for row in rows if isinstance(row, UsageEvent)]
+        prediction_rows = [row for row in rows if isinstance(row, PredictionRow)]
+        try:
+            for table, log, table_rows in (
+                ("token_usage", log_usage_events, usage_events),
+                ("prediction_results", log_prediction_rows, prediction_rows),
+            ):
+                if table_rows:
+                    started = perf_counter()
+                    with tracer.start_as_current_span(
+                        "db_write", attributes={"table": table, "rows": len(table_rows)}
+                    ):
+                        log(table_rows)
+                    db_write_duration.observe(perf_counter() - started, table)
+        except Exception:
+            logger.exception("Failed to write %d telemetry rows", len(rows))
+            self.failed_rows += len(rows)
+            return
+
+        self.written_rows += len(rows)
+        self.flushes += 1
+
+
+writer = TelemetryWriter(
+    max_queue_size=config.telemetry_queue_size,
+    flush_rows=config.telemetry_flush_rows,
+    flush_interval_seconds=config.telemetry_flush_interval_seconds,
+)
+
+
+@traced("log_usage")
+def record_usage_event(
+    model_name: str,
+    usage: RunUsage | None,
+    batch_id: str,
+    batch_size: int,
+    latency_ms: float,
+    succeeded: bool,
+) -> None:
+    """Queue one usage row for the background writer.
+
+    Answers that made no model request (response cache hits, coalesced or
+    micro-batched followers, rule results) get no row, so token_usage only
+    describes model calls and their latency and cost stay undiluted.
+    """
+    timings = _current_request.get()
+    if timings is not None:
+        timings.batch_size = batch_size
+    if succeeded and usage is not None and usage.requests == 0:
+        return
+    writer.record(
+        UsageEvent(
+            model_name=model_name,
+            usage=usage,
+            batch_id=batch_id,
+            batch_size=batch_size,
+            latency_ms=latency_ms,
+            succeeded=succeeded,
+        )
+    )
+
+
+@dataclass
+class RequestTimings:
+    model_seconds: float = 0.0
+    batch_size: int | None = None
+
+
+# Timings of the request being handled. Tasks spawned by the request copy
+# the context and so update the same object.
+_current_request: ContextVar[RequestTimings | None] = ContextVar(
+    "current_request", default=None
+)
+
+
+@contextmanager
+def track_request() -> Iterator[RequestTimings]:
+    timings = RequestTimings()
+    token = _current_request.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_request.reset(token)
+
+
+def add_model_time(seconds: float) -> None:
+    timings = _current_request.get()
+    if timings is not None:
+        timings.model_seconds += seconds
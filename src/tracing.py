@@ -0,0 +1,184 @@
+import functools
+import json
+from collections.abc import Callable, Sequence
+from contextvars import ContextVar
+from time import time_ns
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from opentelemetry import trace
+from opentelemetry.propagate import extract
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import SpanKind
+from pydantic_ai import Agent
+from pydantic_ai.models.instrumented import InstrumentationSettings
+
+from . import config
+
+# Spans are no-ops until `setup_tracing` installs a provider.
+tracer = trace.get_tracer("parse-crypto-predictions")
+
+_provider: TracerProvider | None = None
+
+
+class JsonlSpanExporter(SpanExporter):
+    """Appends one JSON object per finished span to a file.
+
+    The file is opened for each exported batch rather than held open, so no
+    handle is leaked when the provider is never shut down.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        with open(self._path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(json.loads(span.to_json())) + "\n")
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        pass
+
+    def force_flush(self, timeout_millis: int = 30_000) -> bool:
+        return True
+
+
+def _exporter():
+    if config.tracing_exporter == "jsonl":
+        return JsonlSpanExporter(config.tracing_jsonl_file)
+    if config.tracing_exporter == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter,
+        )
+
+        # Without an endpoint the exporter honours OTEL_EXPORTER_OTLP_* vars.
+        return OTLPSpanExporter(endpoint=config.tracing_otlp_endpoint)
+    raise ValueError(f"Unknown tracing exporter {config.tracing_exporter!r}")
+
+
+def setup_tracing() -> None:
+    """Installs a sampled tracer provider when `tracing_enabled` is set.
+
+    The sampler respects the decision of an incoming `traceparent`, so a
+    caller can force a trace of one request while the rest are sampled at
+    `tracing_sample_ratio`. Model calls additionally get the pydantic-ai
+    spans, without prompt and output contents.
+    """
+
+    global _provider
+    if not config.tracing_enabled or _provider is not None:
+        return
+
+    _provider = TracerProvider(
+        resource=Resource.create({"service.name": "parse-crypto-predictions"}),
+        sampler=ParentBased(TraceIdRatioBased(config.tracing_sample_ratio)),
+    )
+    _provider.add_span_processor(BatchSpanProcessor(_exporter()))
+    trace.set_tracer_provider(_provider)
+    Agent.instrument_all(
+        InstrumentationSettings(tracer_provider=_provider, include_content=False)
+    )
+
+
+def shutdown_tracing() -> None:
+    if _provider is not None:
+        _provider.shutdown()
+
+
+def traced(name: str) -> Callable:
+    """Wraps a synchronous function in a span.
+
+    Outside a sampled request the span would be dropped anyway, so the
+    function is called directly; these run per item of a batch.
+    """
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not trace.get_current_span().is_recording():
+                return func(*args, **kwargs)
+            with tracer.start_as_current_span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def start_request_span(request: Request):
+    """Server span of a request, continuing the caller's `traceparent` if any."""
+
+    return tracer.start_as_current_span(
+        f"{request.method} {request.url.path}",
+        context=extract(request.headers),
+        kind=SpanKind.SERVER,
+        attributes={"http.request.method": request.method},
+    )
+
+
+# Start and end of the endpoint function within the route being handled.
+_handler_times: ContextVar[list[int] | None] = ContextVar("handler_times", default=None)
+
+
+class TracedRoute(APIRoute):
+    """Route that splits the request into validation, handler and
+    serialization spans.
+
+    FastAPI validates the body and serializes the response around the
+    endpoint call in one function, so the endpoint is wrapped to record when
+    it starts and ends, and the stages before and after it are recorded as
+    spans with explicit start and end times.
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs) -> None:
+        super().__init__(path, _time_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def traced_handler(request: Request) -> Response:
+            if not trace.get_current_span().is_recording():
+                return await handler(request)
+            started = time_ns()
+            times: list[int] = []
+            token = _handler_times.set(times)
+            try:
+                return await handler(request)
+            finally:
+                _handler_times.reset(token)
+                # No handler times means the request failed validation.
+                _record_span(
+                    "validate_request", started, times[0] if times else time_ns()
+                )
+                if len(times) == 2:
+                    _record_span("serialize_response", times[1], time_ns())
+
+        return traced_handler
+
+
+def _time_endpoint(endpoint: Callable) -> Callable:
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        times = _handler_times.get()
+        if times is not None:
+            times.append(time_ns())
+        try:
+            with tracer.start_as_current_span("handler"):
+                return await endpoint(*args, **kwargs)
+        finally:
+            if times is not None:
+                times.append(time_ns())
+
+    return wrapper
+
+
+def _record_span(name: str, start_time: int, end_time: int) -> None:
+    tracer.start_span(name, start_time=start_time).end(end_time=end_time)
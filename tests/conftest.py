@@ -0,0 +1,45 @@
+import pytest
+from pydantic_ai.models.function import FunctionModel
+
+from src import agent, config, database
+from src.cache import ResponseCache
+from src.database import ConnectionManager
+from src.stub_model import POST_PATTERN, StubBackend, _last_prompt
+
+
+class CountingStub(StubBackend):
+    """The fake stub backend, recording the kind and posts of every call."""
+
+    def __init__(self) -> None:
+        super().__init__("fake", latency_scale=0.01, seed=0)
+        self.calls: list[tuple[str, list[str]]] = []
+
+    async def respond(self, messages, info):
+        prompt = _last_prompt(messages)
+        kind = "batch" if "Input 1:" in prompt else "single"
+        self.calls.append((kind, [text for text, _ in POST_PATTERN.findall(prompt)]))
+        return await super().respond(messages, info)
+
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch) -> CountingStub:
+    """Routes every agent to a fresh CountingStub over a scratch database."""
+    manager = ConnectionManager(str(tmp_path / "crypto_predictions.db"))
+    monkeypatch.setattr(config, "db_file", manager.db_file)
+    monkeypatch.setattr(database, "connections", manager)
+    database.init_db()
+
+    backend = CountingStub()
+    model: FunctionModel = backend.model()
+    monkeypatch.setattr(config, "get_model", lambda: model)
+    monkeypatch.setattr(config, "rules_enabled", False)
+    monkeypatch.setattr(config, "context_cache_enabled", False)
+    monkeypatch.setattr(config, "request_coalescing_enabled", True)
+    monkeypatch.setattr(config, "response_cache_enabled", False)
+    monkeypatch.setattr(
+        agent, "response_cache", ResponseCache(100, 3600, persistent=False)
+    )
+    agent.get_agent.cache_clear()
+    yield backend
+    agent.get_agent.cache_clear()
+    manager.close()
@@ -0,0 +1,121 @@
+import asyncio
+import re
+
+import pytest
+from pydantic_ai import RunUsage
+from pydantic_ai.exceptions import UnexpectedModelBehavior
+
+from src import agent, config
+from src.cache import ResponseCache
+from src.models import NaturalLanguagePrediction, ParsedPrediction
+
+POST = re.compile(r"Post: '(.*?)'")
+
+
+def prediction(bear_bull: int) -> ParsedPrediction:
+    return ParsedPrediction(
+        extracted_value=None,
+        bear_bull=bear_bull,
+        timeframe={"explicit": False, "start": None, "end": None},
+        notes=[],
+    )
+
+
+def item(post_text: str) -> NaturalLanguagePrediction:
+    return NaturalLanguagePrediction(
+        id=post_text, post_text=post_text, post_created_at="2025-08-25T12:00:00Z"
+    )
+
+
+class FakeModel:
+    """Stands in for `_run_with_retries`: batches never validate the posts in
+    `invalid_in_batch`, and the posts in `broken` fail on their own too."""
+
+    def __init__(self, invalid_in_batch: set[str], broken: set[str]) -> None:
+        self.invalid_in_batch = invalid_in_batch
+        self.broken = broken
+        self.calls: list[tuple[str, list[str]]] = []
+
+    async def __call__(self, kind, prompt):
+        posts = POST.findall(prompt)
+        self.calls.append((kind, posts))
+        if kind == "batch":
+            return [
+                None if post in self.invalid_in_batch else prediction(len(post))
+                for post in posts
+            ], RunUsage(requests=1)
+        if posts[0] in self.broken:
+            raise UnexpectedModelBehavior("Exceeded maximum retries for output")
+        return prediction(len(posts[0])), RunUsage(requests=1)
+
+
+@pytest.fixture
+def model(monkeypatch) -> FakeModel:
+    model = FakeModel(invalid_in_batch={"retried", "broken"}, broken={"broken"})
+    monkeypatch.setattr(agent, "_run_with_retries", model)
+    monkeypatch.setattr(config, "batch_salvage_enabled", True)
+    monkeypatch.setattr(config, "rules_enabled", False)
+    monkeypatch.setattr(config, "response_cache_enabled", True)
+    monkeypatch.setattr(config, "response_cache_persistent", False)
+    monkeypatch.setattr(
+        agent, "response_cache", ResponseCache(100, 3600, persistent=False)
+    )
+    return model
+
+
+def test_partial_batch_keeps_the_items_that_validated(model):
+    items = [item("kept"), item("retried"), item("broken")]
+
+    outputs, usage = asyncio.run(agent.run_batch_agent(items))
+
+    assert outputs[:2] == [prediction(4), prediction(7)]
+    assert isinstance(outputs[2], UnexpectedModelBehavior)
+    # The batch, the failed pair as a smaller batch, then each one alone.
+    assert model.calls == [
+        ("batch", ["kept", "retried", "broken"]),
+        ("batch", ["retried", "broken"]),
+        ("single", ["retried"]),
+        ("single", ["broken"]),
+    ]
+    assert usage.requests == 3
+
+
+def test_only_the_failed_item_is_paid_for_again(model):
+    items = [item("kept"), item("retried"), item("broken")]
+    asyncio.run(agent.run_batch_agent(items))
+    model.calls.clear()
+
+    outputs, _ = asyncio.run(agent.run_batch_agent(items))
+
+    assert outputs[:2] == [prediction(4), prediction(7)]
+    assert isinstance(outputs[2], UnexpectedModelBehavior)
+    assert model.calls == [("batch", ["broken"]), ("single", ["broken"])]
+
+
+def test_duplicate_requests_share_one_model_call(stub):
+    async def parse_concurrently():
+        return await asyncio.gather(
+            *[agent.run_agent(item("BTC to $100k by 2026")) for _ in range(5)]
+        )
+
+    answers = asyncio.run(parse_concurrently())
+
+    assert stub.calls == [("single", ["BTC to $100k by 2026"])]
+    assert all(parsed == answers[0][0] for parsed, _ in answers)
+    assert [usage.requests for _, usage in answers] == [1, 0, 0, 0, 0]
+
+
+def test_a_batch_only_pays_for_posts_not_already_in_flight(stub):
+    async def parse_concurrently():
+        return await asyncio.gather(
+            agent.run_batch_agent([item("ETH to $5k"), item("SOL to $300")]),
+            agent.run_batch_agent([item("SOL to $300"), item("ADA to $2")]),
+        )
+
+    first, second = asyncio.run(parse_concurrently())
+
+    assert stub.calls == [
+        ("batch", ["ETH to $5k", "SOL to $300"]),
+        ("batch", ["ADA to $2"]),
+    ]
+    assert first[0][1] == second[0][0]
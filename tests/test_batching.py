@@ -0,0 +1,51 @@
+import asyncio
+from time import perf_counter
+
+from src.batching import MicroBatcher
+from src.models import NaturalLanguagePrediction
+
+POSTS = ["BTC to $100k", "ETH to $5k", "SOL to $300", "ADA to $2"]
+
+
+def item(post_text: str) -> NaturalLanguagePrediction:
+    return NaturalLanguagePrediction(
+        id=post_text, post_text=post_text, post_created_at="2025-08-25T12:00:00Z"
+    )
+
+
+def submit_all(batcher: MicroBatcher, posts: list[str]):
+    async def submit():
+        started = perf_counter()
+        answers = await asyncio.gather(*[batcher.submit(item(post)) for post in posts])
+        return answers, perf_counter() - started
+
+    return asyncio.run(submit())
+
+
+def test_a_full_batch_is_sent_without_waiting(stub):
+    batcher = MicroBatcher(max_batch_size=2, max_wait_ms=10_000)
+
+    answers, elapsed = submit_all(batcher, POSTS)
+
+    assert stub.calls == [("batch", POSTS[:2]), ("batch", POSTS[2:])]
+    assert elapsed < 5
+    # The first caller of each batch carries its usage.
+    assert [usage.requests for _, usage in answers] == [1, 0, 1, 0]
+
+
+def test_a_partial_batch_is_sent_when_the_wait_expires(stub):
+    batcher = MicroBatcher(max_batch_size=16, max_wait_ms=50)
+
+    answers, elapsed = submit_all(batcher, POSTS[:3])
+
+    assert stub.calls == [("batch", POSTS[:3])]
+    assert elapsed >= 0.05
+    assert len(answers) == 3
+
+
+def test_a_lone_item_goes_through_the_single_agent(stub):
+    batcher = MicroBatcher(max_batch_size=16, max_wait_ms=10)
+
+    submit_all(batcher, POSTS[:1])
+
+    assert stub.calls == [("single", POSTS[:1])]
@@ -0,0 +1,76 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from uuid import UUID
+
+import pytest
+
+from scripts import calculate_metrics
+from src import config, database
+from src.database import ConnectionManager, PredictionRow
+
+RUN_ID = UUID("11111111-1111-1111-1111-111111111111")
+BATCH_SIZE = 4
+
+
+@pytest.fixture
+def results(tmp_path, monkeypatch) -> ConnectionManager:
+    monkeypatch.setattr(config, "results_db_file", str(tmp_path / "results.db"))
+    monkeypatch.setattr(config, "eval_db_file", str(tmp_path / "evaluation.db"))
+    manager = ConnectionManager(config.results_db_file)
+    monkeypatch.setattr(database, "results", manager)
+    database.init_results_db()
+    yield manager
+    manager.close()
+
+
+@pytest.fixture(scope="module")
+def annotated() -> list[dict]:
+    with open(config.dataset_file) as f:
+        return json.load(f)
+
+
+def log_batches(annotated: list[dict], starts: range) -> None:
+    """Logs the annotations themselves as predictions, one batch per thread."""
+
+    def log(start: int) -> None:
+        database.log_prediction_rows(
+            [
+                PredictionRow(
+                    run_id=RUN_ID,
+                    example_id=start + offset,
+                    batch_id=start,
+                    batch_size=BATCH_SIZE,
+                    raw_prediction_json={
+                        key: entry.get(key)
+                        for key in (
+                            "id",
+                            "target_type",
+                            "extracted_value",
+                            "bear_bull",
+                            "timeframe",
+                            "notes",
+                        )
+                    },
+                )
+                for offset, entry in enumerate(annotated[start : start + BATCH_SIZE])
+            ]
+        )
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(log, starts))
+
+
+def evaluated_examples(results: ConnectionManager) -> int:
+    # calculate_metrics attaches the file read-only, which DuckDB only allows
+    # once this process has no read-write connection to it.
+    results.close()
+    (group,) = calculate_metrics.fetch_group_metrics()
+    return int(group.matrix.sum())
+
+
+def test_rows_logged_concurrently_are_aggregated_exactly_once(results, annotated):
+    log_batches(annotated, range(0, 48, BATCH_SIZE))
+    assert evaluated_examples(results) == 48
+
+    log_batches(annotated, range(48, 96, BATCH_SIZE))
+    assert evaluated_examples(results) == 96
@@ -0,0 +1,153 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from google.genai.errors import ClientError
+
+from src import agent, config, context_cache
+from src.context_cache import (
+    ContextCacheManager,
+    LocalCacheBackend,
+    build_context_caches,
+)
+
+TTL_SECONDS = config.context_cache_ttl_seconds
+REFRESH_MARGIN_SECONDS = config.context_cache_refresh_margin_seconds
+SETTINGS = {"temperature": 0.3}
+
+
+class Clock(datetime):
+    current = datetime(2025, 8, 25, 12, tzinfo=UTC)
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+    @classmethod
+    def advance(cls, seconds: float) -> None:
+        cls.current += timedelta(seconds=seconds)
+
+
+@pytest.fixture
+def caches(monkeypatch) -> ContextCacheManager:
+    monkeypatch.setattr(config, "context_cache_backend", "local")
+    monkeypatch.setattr(context_cache, "datetime", Clock)
+    monkeypatch.setattr(Clock, "current", Clock.current)
+    return build_context_caches()
+
+
+@pytest.fixture
+def backend(caches) -> LocalCacheBackend:
+    assert isinstance(caches.backend, LocalCacheBackend)
+    return caches.backend
+
+
+def test_creates_one_cache_per_prefix_and_reuses_it(caches, backend):
+    first = asyncio.run(caches.name_for("instructions", SETTINGS))
+    second = asyncio.run(caches.name_for("instructions", SETTINGS))
+
+    assert first == second
+    assert backend.created == 1
+    assert backend.caches[first][:2] == (config.model_name, "instructions")
+
+
+def test_refreshes_before_the_ttl_expires(caches, backend):
+    first = asyncio.run(caches.name_for("instructions", SETTINGS))
+
+    Clock.advance(TTL_SECONDS - REFRESH_MARGIN_SECONDS - 1)
+    assert asyncio.run(caches.name_for("instructions", SETTINGS)) == first
+
+    Clock.advance(2)
+    refreshed = asyncio.run(caches.name_for("instructions", SETTINGS))
+
+    assert refreshed != first
+    assert caches.stats().refreshed == 1
+    # Requests already sent may still reference the old cache.
+    assert first in backend.caches
+
+
+def test_changed_instructions_or_model_get_their_own_cache(
+    caches, backend, monkeypatch
+):
+    original = asyncio.run(caches.name_for("instructions", SETTINGS))
+    changed_instructions = asyncio.run(caches.name_for("other instructions", SETTINGS))
+    monkeypatch.setattr(config, "model_name", "other-model")
+    changed_model = asyncio.run(caches.name_for("instructions", SETTINGS))
+
+    assert len({original, changed_instructions, changed_model}) == 3
+    assert backend.caches[changed_model][0] == "other-model"
+
+
+def test_failed_creation_runs_uncached_until_the_retry_delay(caches, backend):
+    create = backend.create
+
+    async def refuse(model, system_instruction, ttl_seconds):
+        raise RuntimeError("cached content is too small")
+
+    backend.create = refuse
+    assert asyncio.run(caches.name_for("instructions", SETTINGS)) is None
+    backend.create = create
+
+    assert asyncio.run(caches.name_for("instructions", SETTINGS)) is None
+    Clock.advance(caches.retry_after_seconds + 1)
+    assert asyncio.run(caches.name_for("instructions", SETTINGS)) is not None
+    assert caches.stats().failures == 1
+
+
+def test_close_deletes_every_created_cache(caches, backend):
+    asyncio.run(caches.name_for("instructions", SETTINGS))
+    Clock.advance(TTL_SECONDS)
+    asyncio.run(caches.name_for("instructions", SETTINGS))
+
+    asyncio.run(caches.close())
+
+    assert backend.deleted == 2
+    assert backend.caches == {}
+
+
+class FakeRunner:
+    def __init__(self, error: Exception | None = None) -> None:
+        self.error = error
+        self.settings = []
+
+    async def run(self, prompt, model_settings=None):
+        self.settings.append(model_settings)
+        if self.error is not None:
+            raise self.error
+        return "uncached output"
+
+
+def client_error(code: int, status: str) -> ClientError:
+    return ClientError(code, {"error": {"code": code, "status": status}})
+
+
+@pytest.fixture
+def runners(caches, monkeypatch) -> dict[bool, FakeRunner]:
+    runners = {False: FakeRunner(), True: FakeRunner()}
+    monkeypatch.setattr(config, "context_cache_enabled", True)
+    monkeypatch.setattr(agent, "context_caches", caches)
+    monkeypatch.setattr(agent, "get_agent", lambda kind, cached=False: runners[cached])
+    return runners
+
+
+@pytest.mark.parametrize("error", [(403, "PERMISSION_DENIED"), (404, "NOT_FOUND")])
+def test_rejected_cache_falls_back_to_an_uncached_run(caches, runners, error):
+    runners[True].error = client_error(*error)
+
+    output = asyncio.run(agent._run("single", "prompt"))
+
+    assert output == "uncached output"
+    stale = runners[True].settings[0]["google_cached_content"]
+    assert asyncio.run(caches.name_for(*_single_prefix())) != stale
+
+
+def test_other_errors_of_a_cached_run_are_raised(runners):
+    runners[True].error = client_error(400, "INVALID_ARGUMENT")
+
+    with pytest.raises(ClientError):
+        asyncio.run(agent._run("single", "prompt"))
+    assert runners[False].settings == []
+
+
+def _single_prefix():
+    return agent.single_instructions, config.agent_settings
@@ -0,0 +1,72 @@
+import asyncio
+from uuid import UUID
+
+import pytest
+
+from scripts import generate_predictions
+from src import config, database
+from src.database import ConnectionManager
+
+RUN_ID = UUID("22222222-2222-2222-2222-222222222222")
+BATCH_SIZE = 2
+
+DATASET = [
+    {"id": position, "post_text": f"post {position}", "post_created_at": "2025-08-25"}
+    for position in range(8)
+]
+
+
+@pytest.fixture(autouse=True)
+def results(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "results_db_file", str(tmp_path / "results.db"))
+    manager = ConnectionManager(config.results_db_file)
+    monkeypatch.setattr(database, "results", manager)
+    database.init_results_db()
+    yield
+    manager.close()
+
+
+class FakeAPI:
+    """Answers every batch after a short delay, except `failing` ones."""
+
+    def __init__(self, failing: set[str]) -> None:
+        self.failing = failing
+        self.requested: list[str] = []
+        self.answered: list[str] = []
+
+    async def __call__(self, client, endpoint, payload):
+        first = payload["items"][0]["id"]
+        self.requested.append(first)
+        if first in self.failing:
+            raise RuntimeError(f"Request for batch {first} failed")
+        await asyncio.sleep(0.05)
+        self.answered.append(first)
+        return [{"id": entry["id"]} for entry in payload["items"]]
+
+
+def run(monkeypatch, api: FakeAPI) -> None:
+    monkeypatch.setattr(generate_predictions, "fetch_predictions", api)
+    asyncio.run(
+        generate_predictions.process_batch_size(
+            RUN_ID, BATCH_SIZE, DATASET, concurrency=4
+        )
+    )
+
+
+def test_a_failing_batch_does_not_cancel_the_others(monkeypatch):
+    api = FakeAPI(failing={"2"})
+
+    run(monkeypatch, api)
+
+    assert sorted(api.answered) == ["0", "4", "6"]
+    assert database.completed_batch_ids(RUN_ID, BATCH_SIZE) == {0, 4, 6}
+
+
+def test_a_resumed_run_only_retries_the_failed_batches(monkeypatch):
+    run(monkeypatch, FakeAPI(failing={"2"}))
+    api = FakeAPI(failing=set())
+
+    run(monkeypatch, api)
+
+    assert api.requested == ["2"]
+    assert database.completed_batch_ids(RUN_ID, BATCH_SIZE) == {0, 2, 4, 6}
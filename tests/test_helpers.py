@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+from src.helpers import TokenBudget, estimate_item_tokens, pack_by_token_budget
+
+
+def estimates(seed: int) -> list[tuple[int, int]]:
+    generator = random.Random(seed)
+    return [estimate_item_tokens("x" * generator.randint(10, 1200)) for _ in range(200)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize(
+    "budget",
+    [
+        TokenBudget(max_input_tokens=800, max_output_tokens=100_000),
+        TokenBudget(max_input_tokens=100_000, max_output_tokens=600),
+        TokenBudget(max_input_tokens=1_000, max_output_tokens=700, max_items=4),
+        TokenBudget(
+            max_input_tokens=100_000,
+            max_output_tokens=100_000,
+            latency_target_seconds=2,
+            output_tokens_per_second=250,
+        ),
+    ],
+)
+def test_batches_respect_both_budgets(seed, budget):
+    items = estimates(seed)
+
+    ranges = pack_by_token_budget(items, budget)
+
+    assert [start for start, _ in ranges] == [0] + [stop for _, stop in ranges[:-1]]
+    assert ranges[-1][1] == len(items)
+    for start, stop in ranges:
+        batch = items[start:stop]
+        if len(batch) == 1:
+            continue
+        assert sum(tokens for tokens, _ in batch) <= budget.max_input_tokens
+        assert sum(tokens for _, tokens in batch) <= budget.output_limit
+        assert budget.max_items is None or len(batch) <= budget.max_items
+        # Each batch is only closed when the next item would not fit.
+        if stop < len(items):
+            following = items[start : stop + 1]
+            assert (
+                sum(tokens for tokens, _ in following) > budget.max_input_tokens
+                or sum(tokens for _, tokens in following) > budget.output_limit
+                or (budget.max_items is not None and stop - start >= budget.max_items)
+            )
+
+
+def test_an_item_over_the_budget_gets_a_batch_of_its_own():
+    budget = TokenBudget(max_input_tokens=100, max_output_tokens=100)
+
+    assert pack_by_token_budget([(10, 10), (500, 10), (10, 10)], budget) == [
+        (0, 1),
+        (1, 2),
+        (2, 3),
+    ]
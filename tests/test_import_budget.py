@@ -0,0 +1,9 @@
+import statistics
+
+from scripts.import_budget import time_import
+from src import config
+
+
+def test_api_cold_import_stays_within_budget():
+    runs = [time_import("src.main")["src.main"] / 1000 for _ in range(3)]
+    assert statistics.median(runs) <= config.import_budget_ms
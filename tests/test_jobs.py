@@ -0,0 +1,82 @@
+import asyncio
+import os
+
+import pytest
+
+from src import config
+from src.database import fetch_job
+from src.jobs import JobRunner, resolve_job_path
+from src.models import NaturalLanguagePrediction
+
+POSTS = [f"{asset} to the moon" for asset in ("BTC", "ETH", "SOL", "ADA", "XRP", "DOT")]
+
+
+@pytest.fixture
+def jobs_dir(tmp_path, monkeypatch):
+    inputs = tmp_path / "jobs"
+    (inputs / "nested").mkdir(parents=True)
+    (inputs / "posts.jsonl").write_text("")
+    (inputs / "nested" / "posts.jsonl").write_text("")
+    (tmp_path / "secret.jsonl").write_text("")
+    os.symlink(tmp_path / "secret.jsonl", inputs / "link.jsonl")
+    monkeypatch.setattr(config, "jobs_input_dir", str(inputs))
+    return inputs
+
+
+@pytest.mark.parametrize("path", ["posts.jsonl", "nested/posts.jsonl"])
+def test_files_inside_the_jobs_directory_are_accepted(jobs_dir, path):
+    assert resolve_job_path(path) == str(jobs_dir / path)
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "",
+        "/etc/passwd",
+        "../secret.jsonl",
+        "nested/../../secret.jsonl",
+        "*.jsonl",
+        "nested/post?.jsonl",
+        "https://example.com/posts.jsonl",
+        "s3://bucket/posts.jsonl",
+        "link.jsonl",
+        "missing.jsonl",
+        "nested",
+    ],
+)
+def test_anything_else_is_rejected(jobs_dir, path):
+    with pytest.raises(ValueError):
+        resolve_job_path(path)
+
+
+def test_a_resumed_job_skips_completed_batches(stub):
+    items = [
+        NaturalLanguagePrediction(
+            id=str(position), post_text=post, post_created_at="2025-08-25T12:00:00Z"
+        )
+        for position, post in enumerate(POSTS)
+    ]
+
+    async def run_one_batch_then_restart():
+        # Submitted without workers, so only the batch taken here gets done
+        # before the "restart".
+        first_run = JobRunner(workers=2, batch_size=2)
+        job_id = await first_run.submit(items=items)
+        await first_run._process(*first_run._queue.get_nowait())
+        done_before_restart = list(stub.calls)
+
+        restarted = JobRunner(workers=2, batch_size=2)
+        await restarted.start()
+        try:
+            async with asyncio.timeout(10):
+                while fetch_job(job_id).status != "completed":
+                    await asyncio.sleep(0.01)
+        finally:
+            await restarted.stop()
+        return fetch_job(job_id), done_before_restart
+
+    job, done_before_restart = asyncio.run(run_one_batch_then_restart())
+
+    assert done_before_restart == [("batch", POSTS[:2])]
+    assert sorted(stub.calls[1:]) == [("batch", POSTS[2:4]), ("batch", POSTS[4:])]
+    assert (job.processed_items, job.failed_items) == (6, 0)
@@ -0,0 +1,58 @@
+import duckdb
+
+from src import config
+from src.rollups import create_rollup_tables, update_usage_rollups
+
+
+def test_more_cached_than_input_tokens_does_not_overflow():
+    con = duckdb.connect()
+    create_rollup_tables(con)
+    con.execute(
+        """
+        CREATE TEMP TABLE usage_rows AS
+        SELECT
+            TIMESTAMPTZ '2025-08-25 12:00:00+00' AS timestamp,
+            'gemini-2.5-flash' AS model_name,
+            10::UINTEGER AS input_tokens,
+            5::UINTEGER AS output_tokens,
+            1::UINTEGER AS requests,
+            20::UINTEGER AS cache_read_tokens,
+            0::UINTEGER AS cache_write_tokens,
+            uuid() AS batch_id,
+            1::UINTEGER AS batch_size,
+            10.0 AS latency_ms,
+            true AS succeeded
+        """
+    )
+
+    update_usage_rollups(con, "usage_rows")
+
+    rows = con.execute(
+        """
+        SELECT granularity, request_count, uncached_input_cost_sum
+        FROM usage_rollups
+        ORDER BY granularity
+        """
+    ).fetchall()
+    assert rows == [("day", 1, 0.0), ("hour", 1, 0.0)]
+
+
+def test_config_price_changes_replace_the_stored_rates(monkeypatch):
+    con = duckdb.connect()
+    create_rollup_tables(con)
+    monkeypatch.setitem(
+        config.model_pricing,
+        "gemini-2.5-flash",
+        {"input": 1e-6, "cached_input": 1e-7, "output": 2e-6},
+    )
+
+    create_rollup_tables(con)
+
+    rates = con.execute(
+        """
+        SELECT input_rate, cached_input_rate, output_rate
+        FROM model_pricing
+        WHERE model_name = 'gemini-2.5-flash'
+        """
+    ).fetchone()
+    assert rates == (1e-6, 1e-7, 2e-6)
@@ -0,0 +1,32 @@
+from datetime import UTC, datetime
+
+import pytest
+
+from src.models import NaturalLanguagePrediction
+from src.rules import extract
+
+CREATED_AT = datetime(2025, 8, 25, 12, tzinfo=UTC)
+
+
+@pytest.mark.parametrize(
+    "post_text",
+    [
+        "BTC to $100k by 0000",
+        "ETH to $5k within 100000 months",
+    ],
+)
+def test_out_of_range_dates_fall_through_to_the_model(post_text):
+    item = NaturalLanguagePrediction(post_text=post_text, post_created_at=CREATED_AT)
+
+    assert extract(item) is None
+
+
+def test_in_range_dates_still_resolve():
+    item = NaturalLanguagePrediction(
+        post_text="ETH to $5k within 3 months", post_created_at=CREATED_AT
+    )
+
+    result = extract(item)
+
+    assert result is not None
+    assert result.parsed.timeframe.end == datetime(2025, 11, 25, 12, tzinfo=UTC)
@@ -0,0 +1,35 @@
+import pytest
+from pydantic_ai import RunUsage
+
+from src import telemetry
+
+
+@pytest.fixture
+def recorded(monkeypatch) -> list:
+    rows = []
+    monkeypatch.setattr(telemetry.writer, "record", rows.append)
+    return rows
+
+
+def record(usage: RunUsage | None, succeeded: bool = True) -> None:
+    telemetry.record_usage_event(
+        model_name="gemini-2.5-flash",
+        usage=usage,
+        batch_id="00000000-0000-0000-0000-000000000000",
+        batch_size=1,
+        latency_ms=0.1,
+        succeeded=succeeded,
+    )
+
+
+def test_answers_without_a_model_request_log_no_usage(recorded):
+    record(RunUsage())
+
+    assert recorded == []
+
+
+def test_model_calls_and_failures_are_logged(recorded):
+    record(RunUsage(requests=1, input_tokens=10))
+    record(None, succeeded=False)
+
+    assert [row.succeeded for row in recorded] == [True, False]